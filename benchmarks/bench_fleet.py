@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Benchmark for fleet mode request throughput against the number of worker processes.
+
+Starts a ``fleet.Fleet`` of synthetic TCP devices on consecutive ports for each worker count, then runs client
+processes that each send Read Holding Registers requests round-robin across the devices for a fixed time, one
+request in flight per connection.  Throughput should scale with the number of workers up to the number of cores
+(leaving cores for the clients).
+
+Usage::
+
+   python benchmarks/bench_fleet.py [--devices 64] [--workers 1 2 4] [--clients 4] [--duration 5]
+
+"""
+
+import os
+import sys
+import argparse
+import multiprocessing
+import shutil
+import socket
+import struct
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim'))
+
+import modbus_sim
+import fleet
+
+TEMPLATE = """/**DEVICE_DESC;VendorName=Bench;ProductCode=BM;ProductName=Bench;ModelName=Fleet{n};MajorMinorRevision=1.0.0;sparse
+/**SIM_PORT;port=tcp:{port};mode=tcp
+deviceId=1;networkId=1;plcBaseAddress=0;byteOrder=msb;wordOrder=msw
+"""
+REGISTER = """/*REGISTER;paramId={id};Name=Point{id};Default={id}
+paramId={id};deviceId=1;registerType=holding;address={address};encoding=int16
+"""
+REGISTERS_PER_DEVICE = 50
+
+
+def make_templates(directory, devices, base_port):
+    """
+    Writes the templates of synthetic devices on consecutive TCP ports
+
+    :param str directory: the template directory
+    :param int devices: the number of devices
+    :param int base_port: the port of the first device
+    """
+    for n in range(devices):
+        with open(os.path.join(directory, 'device{:05d}.txt'.format(n)), 'w') as f:
+            f.write(TEMPLATE.format(n=n, port=base_port + n))
+            for param_id in range(REGISTERS_PER_DEVICE):
+                f.write(REGISTER.format(id=param_id, address=param_id))
+
+
+def _connect(port, timeout=10.0):
+    """Connects to a device, retrying until its worker is listening"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            sock = socket.create_connection(('localhost', port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EnvironmentError("connection closed")
+        data += chunk
+    return data
+
+
+def _client(ports, duration, results):
+    """Client process: reads 10 holding registers round-robin across the ports until the duration has elapsed"""
+    sockets = [_connect(port) for port in ports]
+    count = 0
+    transaction = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        for sock in sockets:
+            transaction = (transaction + 1) & 0xffff
+            sock.sendall(struct.pack('>HHHBBHH', transaction, 0, 6, 1, 3, 0, 10))
+            header = _recv_exactly(sock, 7)
+            _recv_exactly(sock, struct.unpack('>H', header[4:6])[0] - 1)
+            count += 1
+    for sock in sockets:
+        sock.close()
+    results.put(count)
+
+
+def measure(template_dir, workers, clients, duration, base_port, devices):
+    """
+    Measures the request throughput of a fleet
+
+    :return: the requests per second
+    :rtype: float
+    """
+    user_options = argparse.Namespace(template=[template_dir], port='tcp:502', baudrate=9600, mode=None,
+                                      cache_dir=None)
+    slaves = modbus_sim.load_slaves(user_options, unique_ids=False)
+    supervisor = fleet.Fleet(slaves, workers=workers, update_interval=1)
+    supervisor.start()
+    try:
+        for port in range(base_port, base_port + devices):
+            _connect(port).close()
+        results = multiprocessing.Queue()
+        ports = list(range(base_port, base_port + devices))
+        processes = [multiprocessing.Process(target=_client, args=(ports[n::clients], duration, results))
+                     for n in range(clients)]
+        for process in processes:
+            process.start()
+        total = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+    finally:
+        supervisor.stop()
+    return total / float(duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fleet throughput benchmark")
+    parser.add_argument('--devices', type=int, default=64, help="the number of devices (TCP ports)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="worker counts to benchmark")
+    parser.add_argument('--clients', type=int, default=4, help="the number of client processes")
+    parser.add_argument('--duration', type=float, default=5, help="seconds of load per worker count")
+    parser.add_argument('--base-port', dest='base_port', type=int, default=15020, help="the first device port")
+    args = parser.parse_args()
+    template_dir = tempfile.mkdtemp(prefix='bench_fleet_')
+    try:
+        make_templates(template_dir, args.devices, args.base_port)
+        print("{} cores, {} devices, {} clients".format(multiprocessing.cpu_count(), args.devices, args.clients))
+        print("{:>8} {:>14}".format('workers', 'requests/s'))
+        for workers in args.workers:
+            rate = measure(template_dir, workers, args.clients, args.duration, args.base_port, args.devices)
+            print("{:>8} {:>14.0f}".format(workers, rate))
+    finally:
+        shutil.rmtree(template_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Benchmark for the overhead of metrics collection on the request path and on ``update_values``.
+
+Executes batches of pipelined requests (Read Holding Registers, Read Input Registers, Read Coils and Write
+Multiple Registers) in process with ``pipeline.RequestProcessor``, then times ``update_values`` ticks, with metrics
+disabled and enabled.  The time per request and per tick is reported for each, with the overhead relative to the
+disabled run.  Disabled metrics only cost a test of ``metrics.registry`` per batch and per tick.
+
+Usage::
+
+   python benchmarks/bench_metrics.py [--registers 200] [--batch 16] [--repeat 5] [--seconds 1] [--ticks 200]
+
+"""
+
+import os
+import sys
+import argparse
+import struct
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim'))
+
+from pymodbus.datastore import ModbusServerContext
+
+import modbus_sim
+import metrics
+from datastore import install_response_encoder
+from pipeline import RequestProcessor
+
+TEMPLATE = """/**DEVICE_DESC;VendorName=Bench;ProductCode=BM;ProductName=Bench;ModelName=Metrics;MajorMinorRevision=1.0.0;sparse
+/**SIM_PORT;port=tcp:502;mode=tcp
+deviceId=1;networkId=1;plcBaseAddress=0;byteOrder=msb;wordOrder=msw
+"""
+REGISTER = """/*REGISTER;paramId={id};Name=Point{id};Default={id}
+paramId={id};deviceId=1;registerType={reg_type};address={address};encoding={encoding}
+"""
+TYPES = [('holding', 'int16'), ('analog', 'uint16'), ('coil', 'boolean')]
+
+
+def make_template(path, registers):
+    """
+    Writes a template with holding, input and coil registers
+
+    :param str path: the template file
+    :param int registers: the number of registers of each type
+    """
+    with open(path, 'w') as f:
+        f.write(TEMPLATE)
+        param_id = 0
+        for reg_type, encoding in TYPES:
+            for address in range(registers):
+                param_id += 1
+                f.write(REGISTER.format(id=param_id, reg_type=reg_type, address=address, encoding=encoding))
+
+
+def make_batch(size):
+    """
+    Builds pipelined MBAP frames cycling through read and write requests
+
+    :param int size: the number of requests
+    :rtype: bytearray
+    """
+    requests = [struct.pack('>BHH', 3, 0, 10), struct.pack('>BHH', 4, 0, 10), struct.pack('>BHH', 1, 0, 16),
+                struct.pack('>BHHBHH', 16, 20, 2, 4, 1, 2)]
+    batch = bytearray()
+    for transaction in range(size):
+        pdu = requests[transaction % len(requests)]
+        batch.extend(struct.pack('>HHHB', transaction, 0, len(pdu) + 1, 1) + pdu)
+    return batch
+
+
+def time_requests(processor, batch, size, seconds, repeat):
+    """
+    Times the execution of pipelined request batches
+
+    :return: the best time per request in seconds
+    :rtype: float
+    """
+    best = None
+    for _ in range(repeat):
+        count = 0
+        start = time.time()
+        deadline = start + seconds
+        while time.time() < deadline:
+            for _ in range(100):
+                processor.process(batch, [])
+            count += 100 * size
+        elapsed = (time.time() - start) / count
+        best = elapsed if best is None or elapsed < best else best
+    return best
+
+
+def time_updates(context, slaves, ticks, repeat):
+    """
+    Times ``update_values`` ticks
+
+    :return: the best time per tick in seconds
+    :rtype: float
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(ticks):
+            modbus_sim.update_values(context, slaves)
+        elapsed = (time.time() - start) / ticks
+        best = elapsed if best is None or elapsed < best else best
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics overhead benchmark")
+    parser.add_argument('--registers', type=int, default=200, help="registers of each type in the template")
+    parser.add_argument('--batch', type=int, default=16, help="pipelined requests per batch")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per measurement (best is reported)")
+    parser.add_argument('--seconds', type=float, default=1, help="seconds of requests per run")
+    parser.add_argument('--ticks', type=int, default=200, help="update ticks per run")
+    args = parser.parse_args()
+    fd, path = tempfile.mkstemp(suffix='.txt', prefix='bench_metrics_')
+    os.close(fd)
+    try:
+        make_template(path, args.registers)
+        user_options = argparse.Namespace(template=[path], port='tcp:502', baudrate=9600, mode=None, cache_dir=None)
+        slaves = modbus_sim.load_slaves(user_options)
+    finally:
+        os.remove(path)
+    context = ModbusServerContext(slaves=dict((slave.slave_id, slave.context) for slave in slaves), single=False)
+    install_response_encoder()
+    processor = RequestProcessor(context)
+    batch = make_batch(args.batch)
+    results = {}
+    for state in ['disabled', 'enabled']:
+        if state == 'enabled':
+            metrics.enable()
+        else:
+            metrics.disable()
+        results[state] = (time_requests(processor, batch, args.batch, args.seconds, args.repeat),
+                          time_updates(context, slaves, args.ticks, args.repeat))
+    metrics.disable()
+    print("{:<10} {:>16} {:>10} {:>16} {:>10}".format('metrics', 'request (us)', 'overhead', 'tick (us)',
+                                                       'overhead'))
+    for state in ['disabled', 'enabled']:
+        request, tick = results[state]
+        print("{:<10} {:>16.2f} {:>9.1f}% {:>16.1f} {:>9.1f}%".format(
+            state, request * 1e6, (request / results['disabled'][0] - 1) * 100,
+            tick * 1e6, (tick / results['disabled'][1] - 1) * 100))
+    check = min(timeit.repeat('registry = metrics.registry\nif registry is not None: pass', 'import metrics',
+                              repeat=args.repeat, number=1000000)) / 1000000
+    print("disabled check: {:.0f} ns per batch of {} requests".format(check * 1e9, args.batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Benchmark for ``Slave._parse_template`` load time against template size.
+
+Generates synthetic templates with 1k, 10k and 100k registers spread evenly across the four register types
+and reports the time taken to construct a ``Slave`` from each.  Parse time should grow linearly with
+the number of registers.  The time to construct the same ``Slave`` from its compiled (cached) template is
+reported alongside.
+
+Usage::
+
+   python benchmarks/bench_parse_template.py [--sizes 1000 10000 100000] [--repeat 3]
+
+"""
+
+import os
+import sys
+import argparse
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim'))
+
+import modbus_sim
+
+REGISTER_TYPES = ['analog', 'holding', 'input', 'coil']
+
+
+def make_template(num_registers, sparse=True):
+    """
+    Builds the text of a synthetic device template
+
+    :param int num_registers: the number of registers (paramIds) to define
+    :param bool sparse: adds the ``sparse`` tag to the device description
+    :return: the template text
+    :rtype: str
+    """
+    lines = ["/**DEVICE_DESC;VendorName=Bench;ProductCode=BM;ProductName=Bench;ModelName=Parse;"
+             "MajorMinorRevision=1.0.0{}".format(';sparse' if sparse else ''),
+             "/**SIM_PORT;port=tcp:502;mode=tcp",
+             "deviceId=1;networkId=1;plcBaseAddress=0;byteOrder=msb;wordOrder=msw"]
+    for param_id in range(1, num_registers + 1):
+        reg_type = REGISTER_TYPES[param_id % len(REGISTER_TYPES)]
+        address = param_id // len(REGISTER_TYPES)
+        encoding = 'boolean' if reg_type in ['input', 'coil'] else 'int16'
+        lines.append("/*REGISTER;paramId={id};Name=Point{id};Default=0".format(id=param_id))
+        lines.append("paramId={id};deviceId=1;registerType={reg_type};address={addr};encoding={enc}"
+                     .format(id=param_id, reg_type=reg_type, addr=address, enc=encoding))
+    return "\n".join(lines) + "\n"
+
+
+def time_parse(template_file, repeat=3, cache_dir=None):
+    """
+    Times construction of a ``Slave`` from a template file
+
+    :param str template_file: path to the template
+    :param int repeat: the number of runs
+    :param str cache_dir: the compiled template cache directory, or ``None`` to always parse
+    :return: the best time in seconds
+    :rtype: float
+    """
+    user_options = argparse.Namespace(template=template_file, port='tcp:502', baudrate=9600, mode=None,
+                                      cache_dir=cache_dir)
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        modbus_sim.Slave(user_options)
+        elapsed = time.time() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Template parse benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="register counts to benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per size (best is reported)")
+    args = parser.parse_args()
+    print("{:>10} {:>12} {:>14} {:>12}".format('registers', 'parse (s)', 'us/register', 'cached (s)'))
+    for size in args.sizes:
+        fd, path = tempfile.mkstemp(suffix='.txt', prefix='bench_template_')
+        cache_dir = tempfile.mkdtemp(prefix='bench_cache_')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(make_template(size))
+            elapsed = time_parse(path, repeat=args.repeat)
+            time_parse(path, repeat=1, cache_dir=cache_dir)
+            cached = time_parse(path, repeat=args.repeat, cache_dir=cache_dir)
+        finally:
+            os.remove(path)
+            shutil.rmtree(cache_dir)
+        print("{:>10} {:>12.3f} {:>14.2f} {:>12.3f}".format(size, elapsed, elapsed / size * 1e6, cached))
+
+
+if __name__ == "__main__":
+    main()
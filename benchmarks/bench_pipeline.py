@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Benchmark for Modbus TCP transaction pipelining.
+
+Each server is started in a child process on a TCP port:
+
+   * ``pymodbus``: the stock pymodbus Twisted server, writing every response separately
+   * ``twisted``: the simulator's Twisted server, executing pipelined requests in batches (``start_server``)
+   * ``loop``: the simulator's event loop server (``--server loop``)
+
+Client processes then send Read Holding Registers requests for a fixed time, ``depth`` requests in flight per
+connection with distinct MBAP transaction IDs: the requests are sent with one write and all the responses are read
+before the next batch.  The request rate and the p50/p99 round trip of a batch are reported for each server and
+depth; with a depth of 1 this is the usual one request at a time.
+
+Usage::
+
+   python benchmarks/bench_pipeline.py [--servers pymodbus twisted loop] [--depths 1 4 16 64] [--connections 8]
+                                       [--clients 2] [--duration 5]
+
+"""
+
+import os
+import sys
+import argparse
+import multiprocessing
+import socket
+import struct
+import tempfile
+import time
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim')
+
+TEMPLATE = """/**DEVICE_DESC;VendorName=Bench;ProductCode=BM;ProductName=Bench;ModelName=Pipeline;MajorMinorRevision=1.0.0;sparse
+/**SIM_PORT;port=tcp:{port};mode=tcp
+deviceId=1;networkId=1;plcBaseAddress=0;byteOrder=msb;wordOrder=msw
+"""
+REGISTER = """/*REGISTER;paramId={id};Name=Point{id};Default={id}
+paramId={id};deviceId=1;registerType=holding;address={id};encoding=int16
+"""
+
+
+def _serve(server, template, port):
+    """Server process: serves the template with one of the server engines until terminated"""
+    sys.path.insert(0, SOURCE)
+    import modbus_sim
+    from pymodbus.datastore import ModbusServerContext
+    from pymodbus.server.async import StartTcpServer
+    from pymodbus.transaction import ModbusSocketFramer
+    from datastore import install_response_encoder
+    from eventloop import EventLoopServer
+    user_options = argparse.Namespace(template=[template], port='tcp:{}'.format(port), baudrate=9600, mode=None,
+                                      cache_dir=None)
+    slave = modbus_sim.load_slaves(user_options)[0]
+    context = ModbusServerContext(slaves={slave.slave_id: slave.context}, single=False)
+    install_response_encoder()
+    address = modbus_sim.server_address(slave.port)
+    if server == 'loop':
+        EventLoopServer(context, identity=slave.identity, address=address).serve_forever()
+    elif server == 'twisted':
+        modbus_sim.start_server(slave, context)
+    else:
+        StartTcpServer(context, identity=slave.identity, address=address, framer=ModbusSocketFramer)
+
+
+def _connect(port, timeout=10.0):
+    """Connects to the server, retrying until it is listening"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            sock = socket.create_connection(('localhost', port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EnvironmentError("connection closed")
+        data += chunk
+    return data
+
+
+def _client(port, connections, depth, duration, start_event, results):
+    """Client process: sends batches of ``depth`` requests round-robin across its connections"""
+    sockets = [_connect(port) for _ in range(connections)]
+    # each response to a read of 10 registers is 7 + 2 + 20 bytes
+    response_size = 29 * depth
+    start_event.wait()
+    count = 0
+    transaction = 0
+    round_trips = []
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        for sock in sockets:
+            batch = []
+            for _ in range(depth):
+                transaction = (transaction + 1) & 0xffff
+                batch.append(struct.pack('>HHHBBHH', transaction, 0, 6, 1, 3, 0, 10))
+            start = time.time()
+            sock.sendall(b''.join(batch))
+            _recv_exactly(sock, response_size)
+            round_trips.append(time.time() - start)
+            count += depth
+    for sock in sockets:
+        sock.close()
+    results.put((count, round_trips))
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(server, depth, template, port, connections, clients, duration):
+    """
+    Measures the request throughput and batch round trip of a server at a pipeline depth
+
+    :return: the requests per second and the p50 and p99 round trips in milliseconds
+    :rtype: tuple
+    """
+    process = multiprocessing.Process(target=_serve, args=(server, template, port))
+    process.daemon = True
+    process.start()
+    try:
+        _connect(port).close()
+        results = multiprocessing.Queue()
+        start_event = multiprocessing.Event()
+        processes = [multiprocessing.Process(target=_client,
+                                             args=(port, connections // clients + (n < connections % clients),
+                                                   depth, duration, start_event, results))
+                     for n in range(clients)]
+        for client in processes:
+            client.start()
+        start_event.set()
+        total = 0
+        round_trips = []
+        for _ in processes:
+            count, times = results.get()
+            total += count
+            round_trips.extend(times)
+        for client in processes:
+            client.join()
+    finally:
+        process.terminate()
+        process.join()
+    round_trips.sort()
+    return (total / float(duration), _percentile(round_trips, 0.5) * 1000, _percentile(round_trips, 0.99) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modbus TCP pipelining benchmark")
+    parser.add_argument('--servers', nargs='+', default=['pymodbus', 'twisted', 'loop'],
+                        help="servers to benchmark")
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 4, 16, 64],
+                        help="requests in flight per connection")
+    parser.add_argument('--connections', type=int, default=8, help="concurrent master connections")
+    parser.add_argument('--clients', type=int, default=2, help="client processes sharing the connections")
+    parser.add_argument('--duration', type=float, default=5, help="seconds of load per server and depth")
+    parser.add_argument('--port', type=int, default=15502, help="the TCP port of the server")
+    args = parser.parse_args()
+    fd, template = tempfile.mkstemp(suffix='.txt', prefix='bench_pipeline_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(TEMPLATE.format(port=args.port))
+            for param_id in range(20):
+                f.write(REGISTER.format(id=param_id))
+        print("{} connections, {} clients".format(args.connections, args.clients))
+        print("{:>10} {:>6} {:>12} {:>10} {:>10}".format('server', 'depth', 'requests/s', 'p50 (ms)', 'p99 (ms)'))
+        for server in args.servers:
+            for depth in args.depths:
+                rate, p50, p99 = measure(server, depth, template, args.port, args.connections, args.clients,
+                                         args.duration)
+                print("{:>10} {:>6} {:>12.0f} {:>10.2f} {:>10.2f}".format(server, depth, rate, p50, p99))
+    finally:
+        os.remove(template)
+
+
+if __name__ == "__main__":
+    main()
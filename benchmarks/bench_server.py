@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Benchmark comparing the server engines selectable with ``--server`` (``twisted`` and ``loop``) and the number of
+``--workers`` processes sharing the port with SO_REUSEPORT.
+
+For each engine and worker count the simulator is launched as a subprocess on a TCP port.  Client processes then
+open a number of concurrent master connections between them and send Read Holding Registers requests round-robin
+across their connections for a fixed time, one request in flight per connection.  The total request rate is
+reported for each engine and worker count; with several workers it should scale with the number of cores (leaving
+cores for the clients).
+
+Usage::
+
+   python benchmarks/bench_server.py [--engines twisted loop] [--workers 1 2 4] [--connections 1000] [--clients 4]
+                                     [--duration 5]
+
+"""
+
+import os
+import sys
+import argparse
+import multiprocessing
+import socket
+import struct
+import subprocess
+import tempfile
+import time
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim', 'modbus_sim.py')
+
+TEMPLATE = """/**DEVICE_DESC;VendorName=Bench;ProductCode=BM;ProductName=Bench;ModelName=Server;MajorMinorRevision=1.0.0;sparse
+/**SIM_PORT;port=tcp:{port};mode=tcp
+deviceId=1;networkId=1;plcBaseAddress=0;byteOrder=msb;wordOrder=msw
+"""
+REGISTER = """/*REGISTER;paramId={id};Name=Point{id};Default={id}
+paramId={id};deviceId=1;registerType=holding;address={id};encoding=int16
+"""
+
+
+def _connect(port, timeout=10.0):
+    """Connects to the simulator, retrying until it is listening"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            sock = socket.create_connection(('localhost', port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EnvironmentError("connection closed")
+        data += chunk
+    return data
+
+
+def _client(port, connections, duration, start_event, results):
+    """Client process: reads 10 holding registers round-robin across its connections until the duration elapses"""
+    sockets = [_connect(port) for _ in range(connections)]
+    start_event.wait()
+    count = 0
+    transaction = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        for sock in sockets:
+            transaction = (transaction + 1) & 0xffff
+            sock.sendall(struct.pack('>HHHBBHH', transaction, 0, 6, 1, 3, 0, 10))
+            header = _recv_exactly(sock, 7)
+            _recv_exactly(sock, struct.unpack('>H', header[4:6])[0] - 1)
+            count += 1
+    for sock in sockets:
+        sock.close()
+    results.put(count)
+
+
+def measure(engine, workers, template, port, connections, clients, duration):
+    """
+    Measures the request throughput of a server engine
+
+    :return: the requests per second
+    :rtype: float
+    """
+    process = subprocess.Popen([sys.executable, SIMULATOR, '--server', engine, '--workers', str(workers),
+                                '--template', template, '--port', 'tcp:{}'.format(port), '--no-cache'],
+                               stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    try:
+        _connect(port).close()
+        results = multiprocessing.Queue()
+        start_event = multiprocessing.Event()
+        processes = [multiprocessing.Process(target=_client,
+                                             args=(port, connections // clients + (n < connections % clients),
+                                                   duration, start_event, results))
+                     for n in range(clients)]
+        for client in processes:
+            client.start()
+        start_event.set()
+        total = sum(results.get() for _ in processes)
+        for client in processes:
+            client.join()
+    finally:
+        process.terminate()
+        process.wait()
+    return total / float(duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server engine benchmark")
+    parser.add_argument('--engines', nargs='+', default=['twisted', 'loop'], help="server engines to benchmark")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1], help="worker process counts to benchmark")
+    parser.add_argument('--connections', type=int, default=1000, help="concurrent master connections")
+    parser.add_argument('--clients', type=int, default=4, help="client processes sharing the connections")
+    parser.add_argument('--duration', type=float, default=5, help="seconds of load per engine")
+    parser.add_argument('--port', type=int, default=15502, help="the TCP port of the simulator")
+    args = parser.parse_args()
+    fd, template = tempfile.mkstemp(suffix='.txt', prefix='bench_server_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(TEMPLATE.format(port=args.port))
+            for param_id in range(20):
+                f.write(REGISTER.format(id=param_id))
+        print("{} cores".format(multiprocessing.cpu_count()))
+        print("{:>10} {:>8} {:>12} {:>14}".format('engine', 'workers', 'connections', 'requests/s'))
+        for engine in args.engines:
+            for workers in args.workers:
+                rate = measure(engine, workers, template, args.port, args.connections, args.clients, args.duration)
+                print("{:>10} {:>8} {:>12} {:>14.0f}".format(engine, workers, args.connections, rate))
+    finally:
+        os.remove(template)
+
+
+if __name__ == "__main__":
+    main()
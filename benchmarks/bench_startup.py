@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Benchmark for the simulator startup time for TCP and serial launches.
+
+Times parsing the command line and constructing the ``Slave`` from a small template for:
+
+   * a TCP launch (``--port tcp:502``), which should not discover serial ports at all
+   * a serial launch with a cold serial port cache (first discovery in the process)
+   * a serial launch with a warm serial port cache
+
+The serial launches use the first serial port found on the host and are skipped if there is none.
+With ``--legacy`` the time taken to discover ports by opening every ``/dev/tty*`` device is reported for
+comparison.
+
+Usage::
+
+   python benchmarks/bench_startup.py [--repeat 5] [--legacy]
+
+"""
+
+import os
+import sys
+import argparse
+import glob
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim'))
+
+import serial
+import modbus_sim
+
+TEMPLATE = """/**DEVICE_DESC;VendorName=Bench;ProductCode=BM;ProductName=Bench;ModelName=Startup;MajorMinorRevision=1.0.0
+/**SIM_PORT;port={port};mode={mode}
+deviceId=1;networkId=1;plcBaseAddress=0;byteOrder=msb;wordOrder=msw
+/*REGISTER;paramId=1;Name=Point1;Default=0
+paramId=1;deviceId=1;registerType=holding;address=0;encoding=int16
+/*REGISTER;paramId=2;Name=Point2;Default=0
+paramId=2;deviceId=1;registerType=coil;address=0;encoding=boolean
+"""
+
+
+def time_launch(port, mode, repeat=5, cold=False):
+    """
+    Times parsing the command line and constructing a ``Slave``
+
+    :param str port: the ``--port`` argument and template port
+    :param str mode: the template Modbus mode
+    :param int repeat: the number of runs
+    :param bool cold: clears the serial port cache before each run
+    :return: the best time in seconds
+    :rtype: float
+    """
+    fd, path = tempfile.mkstemp(suffix='.txt', prefix='bench_template_')
+    with os.fdopen(fd, 'w') as f:
+        f.write(TEMPLATE.format(port=port, mode=mode))
+    best = None
+    try:
+        for _ in range(repeat):
+            if cold:
+                modbus_sim._serial_ports = None
+            start = time.time()
+            user_options = modbus_sim.get_parser().parse_args(['--port', port, '--template', path, '--no-cache'])
+            modbus_sim.load_slaves(user_options)
+            elapsed = time.time() - start
+            best = elapsed if best is None or elapsed < best else best
+    finally:
+        os.remove(path)
+    return best
+
+
+def time_legacy_discovery():
+    """
+    Times serial port discovery by opening and closing every ``/dev/tty*`` device
+
+    :return: the time in seconds and the number of ports found
+    :rtype: tuple
+    """
+    start = time.time()
+    found = 0
+    for port in glob.glob('/dev/tty[A-Za-z]*'):
+        try:
+            s = serial.Serial(port)
+            s.close()
+            found += 1
+        except (OSError, serial.SerialException):
+            pass
+    return time.time() - start, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per launch (best is reported)")
+    parser.add_argument('--legacy', action='store_true', help="also time discovery by opening every tty device")
+    args = parser.parse_args()
+    print("{:<24} {:>12}".format('launch', 'time (s)'))
+    modbus_sim._serial_ports = None
+    print("{:<24} {:>12.4f}".format('tcp:502', time_launch('tcp:502', 'tcp', repeat=args.repeat)))
+    if modbus_sim._serial_ports is not None:
+        print("warning: serial ports were discovered during a TCP launch")
+    ports = modbus_sim.SerialPort.list_serial_ports(refresh=True)
+    if len(ports) > 0:
+        print("{:<24} {:>12.4f}".format('{} (cold)'.format(ports[0]),
+                                        time_launch(ports[0], 'rtu', repeat=args.repeat, cold=True)))
+        print("{:<24} {:>12.4f}".format('{} (cached)'.format(ports[0]),
+                                        time_launch(ports[0], 'rtu', repeat=args.repeat)))
+    else:
+        print("{:<24} {:>12}".format('serial', 'no ports'))
+    if args.legacy:
+        elapsed, found = time_legacy_discovery()
+        print("{:<24} {:>12.4f} ({} ports)".format('legacy discovery', elapsed, found))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark suite for the simulator's hot paths, saved as JSON and checked against a baseline.
+
+Benchmark groups:
+
+   * ``parse``: ``Slave._parse_template`` for synthetic templates of several sizes (no compiled template cache)
+   * ``encode``: ``Register.set_value`` and ``Register.get_value`` for every encoding
+   * ``update``: one ``update_values`` tick for several register counts, and with every register driven by each
+     waveform generator
+   * ``request``: end-to-end read and write requests against a local simulator for each server engine, driven by
+     ``loadgen.run_load`` over one TCP connection
+
+Every result is a time in seconds per operation (lower is better), the best of ``--repeat`` runs.  With
+``--save`` the results are written to a JSON file with the Python version, platform and git revision.  With
+``--check`` the results are compared with a saved baseline and the exit status is 1 if any benchmark is slower
+by more than ``--threshold`` (a fraction, default 0.25).
+
+Usage::
+
+   python benchmarks/bench_suite.py --save baseline.json
+   python benchmarks/bench_suite.py --check baseline.json [--threshold 0.25] [--save current.json]
+                                    [--groups parse encode update request] [--repeat 5]
+
+"""
+
+import os
+import sys
+import argparse
+import json
+import platform
+import socket
+import subprocess
+import tempfile
+import time
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim')
+sys.path.insert(0, SOURCE)
+
+import modbus_sim
+import loadgen
+import waveforms
+from bench_parse_template import make_template
+
+GROUPS = ['parse', 'encode', 'update', 'request']
+PARSE_SIZES = [1000, 10000]
+UPDATE_SIZES = [100, 1000, 10000]
+WAVEFORM_SIZE = 10000
+WAVEFORM_TAGS = ';waveform={waveform};amplitude=100;steps=0|50|100'
+ENGINES = ['twisted', 'loop']
+ENCODINGS = ['int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64', 'float32', 'float64',
+             'boolean', 'string']
+ENCODING_VALUES = {'float32': 12.5, 'float64': 12.5, 'boolean': 1, 'string': 'ABCD'}
+
+HEADER = """/**DEVICE_DESC;VendorName=Bench;ProductCode=BM;ProductName=Bench;ModelName=Suite;MajorMinorRevision=1.0.0;sparse
+/**SIM_PORT;port=tcp:{port};mode=tcp
+deviceId=1;networkId=1;plcBaseAddress=0;byteOrder=msb;wordOrder=msw
+"""
+REGISTER = """/*REGISTER;paramId={id};Name={name};Default=0
+paramId={id};deviceId=1;registerType={reg_type};address={address};encoding={encoding}{length}
+"""
+
+
+def best_of(function, number, repeat):
+    """
+    Times a function
+
+    :param function: the function to call without arguments
+    :param int number: the calls per run
+    :param int repeat: the number of runs
+    :return: the best time per call in seconds
+    :rtype: float
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for _ in xrange(number):
+            function()
+        elapsed = (time.time() - start) / number
+        best = elapsed if best is None or elapsed < best else best
+    return best
+
+
+def _write_template(text):
+    """Writes a template to a temporary file and returns its path"""
+    fd, path = tempfile.mkstemp(suffix='.txt', prefix='bench_suite_')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    return path
+
+
+def _load(path):
+    """Constructs a ``Slave`` from a template file without the compiled template cache"""
+    return modbus_sim.Slave(argparse.Namespace(template=path, port='tcp:502', baudrate=9600, mode=None,
+                                               cache_dir=None))
+
+
+def bench_parse(repeat):
+    """Times ``Slave._parse_template`` per template size"""
+    results = {}
+    for size in PARSE_SIZES:
+        path = _write_template(make_template(size))
+        try:
+            results['parse.{}'.format(size)] = best_of(lambda: _load(path), 1, repeat)
+        finally:
+            os.remove(path)
+    return results
+
+
+def _encoding_template(port=502):
+    """Builds a template with one holding register per encoding (a coil for boolean)"""
+    text = HEADER.format(port=port)
+    address = 0
+    for param_id, encoding in enumerate(ENCODINGS, 1):
+        length = 4 if encoding == 'string' else 1
+        text += REGISTER.format(id=param_id, name=encoding, reg_type='coil' if encoding == 'boolean' else 'holding',
+                                address=address, encoding=encoding,
+                                length=';length={}'.format(length) if encoding == 'string' else '')
+        address += 4
+    return text
+
+
+def bench_encode(repeat, number=2000):
+    """Times ``Register.set_value`` and ``Register.get_value`` per encoding"""
+    path = _write_template(_encoding_template())
+    try:
+        slave = _load(path)
+    finally:
+        os.remove(path)
+    results = {}
+    for reg in slave.registers:
+        value = ENCODING_VALUES.get(reg.encoding, 12)
+        results['encode.set.{}'.format(reg.encoding)] = best_of(lambda: reg.set_value(value), number, repeat)
+        results['encode.get.{}'.format(reg.encoding)] = best_of(reg.get_value, number, repeat)
+    return results
+
+
+def _time_ticks(text, number, repeat):
+    """Times one ``update_values`` tick of the slave of a template"""
+    path = _write_template(text)
+    try:
+        slave = _load(path)
+    finally:
+        os.remove(path)
+    # the first tick builds the slave's update engine
+    modbus_sim.update_values(None, [slave])
+    return best_of(lambda: modbus_sim.update_values(None, [slave]), number, repeat)
+
+
+def bench_update(repeat):
+    """Times one ``update_values`` tick per register count, and per waveform"""
+    results = {}
+    for size in UPDATE_SIZES:
+        results['update.{}'.format(size)] = _time_ticks(make_template(size), max(1, 10000 // size), repeat)
+    for waveform in sorted(waveforms.WAVEFORMS):
+        text = make_template(WAVEFORM_SIZE).replace('Default=0', 'Default=0' + WAVEFORM_TAGS.format(waveform=waveform))
+        results['update.{}.{}'.format(waveform, WAVEFORM_SIZE)] = _time_ticks(text, 1, repeat)
+    return results
+
+
+def _wait_listening(port, timeout=15.0):
+    """Waits for the simulator to accept connections"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('localhost', port)).close()
+            return
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def bench_request(repeat, port=15510, duration=2.0):
+    """Times end-to-end read and write requests over one connection per server engine"""
+    path = _write_template(_encoding_template(port))
+    results = {}
+    try:
+        slave = _load(path)
+        reads, writes = loadgen.derive_requests([slave])
+        for engine in ENGINES:
+            process = subprocess.Popen([sys.executable, os.path.join(SOURCE, 'modbus_sim.py'), '--server', engine,
+                                        '--template', path, '--no-cache'],
+                                       stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+            try:
+                _wait_listening(port)
+                for kind, requests in [('read', reads), ('write', writes)]:
+                    best = None
+                    for _ in range(repeat):
+                        run = loadgen.run_load('tcp:{}'.format(port), requests, [], duration=duration / repeat)
+                        elapsed = 1.0 / run['requests_per_second'] if run['requests'] > 0 else float('inf')
+                        best = elapsed if best is None or elapsed < best else best
+                    results['request.{}.{}'.format(engine, kind)] = best
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        os.remove(path)
+    return results
+
+
+def _revision():
+    """Returns the git revision of the working tree, if any"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SOURCE,
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(groups, repeat):
+    """
+    Runs benchmark groups
+
+    :param list groups: the groups to run
+    :param int repeat: the runs per benchmark
+    :return: the results by benchmark name, in seconds per operation
+    :rtype: dict
+    """
+    benchmarks = {'parse': bench_parse, 'encode': bench_encode, 'update': bench_update, 'request': bench_request}
+    results = {}
+    for group in groups:
+        results.update(benchmarks[group](repeat))
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compares results with a baseline
+
+    :param dict results: the current results by benchmark name
+    :param dict baseline: the baseline results by benchmark name
+    :param float threshold: the allowed slowdown as a fraction e.g. 0.25
+    :return: (name, baseline, current, change) of each benchmark slower than the threshold
+    :rtype: list
+    """
+    regressions = []
+    for name in sorted(results):
+        if name in baseline and baseline[name] > 0:
+            change = results[name] / baseline[name] - 1
+            if change > threshold:
+                regressions.append((name, baseline[name], results[name], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark suite")
+    parser.add_argument('--groups', nargs='+', default=GROUPS, choices=GROUPS, help="benchmark groups to run")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per benchmark (best is reported)")
+    parser.add_argument('--save', default=None, metavar='FILE', help="saves the results to a JSON file")
+    parser.add_argument('--check', default=None, metavar='FILE', help="compares the results with a baseline file")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="the slowdown reported as a regression, as a fraction (default 0.25)")
+    args = parser.parse_args()
+    results = run_suite(args.groups, args.repeat)
+    baseline = {}
+    if args.check is not None:
+        with open(args.check) as f:
+            baseline = json.load(f)['results']
+    print("{:<32} {:>14} {:>14} {:>9}".format('benchmark', 'time (us)', 'baseline (us)', 'change'))
+    for name in sorted(results):
+        if name in baseline:
+            print("{:<32} {:>14.2f} {:>14.2f} {:>8.1f}%".format(name, results[name] * 1e6, baseline[name] * 1e6,
+                                                                 (results[name] / baseline[name] - 1) * 100))
+        else:
+            print("{:<32} {:>14.2f}".format(name, results[name] * 1e6))
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'revision': _revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': args.repeat,
+                       'results': results}, f, indent=2, sort_keys=True)
+    if args.check is not None:
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, before, after, change in regressions:
+            print("regression: {} {:.2f} us -> {:.2f} us (+{:.1f}%)".format(name, before * 1e6, after * 1e6,
+                                                                           change * 100))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Precompiled ``struct`` codecs converting between register values and 16-bit Modbus register words.
+
+The register layouts match those produced by pymodbus ``BinaryPayloadBuilder.to_registers`` and read by
+``BinaryPayloadDecoder.fromRegisters`` for the same byte order and word order:
+
+   * 8-bit values (``int8``, ``uint8``, ``boolean``) occupy the high byte of a single register
+   * 16/32/64-bit values are split into big-endian words, word-swapped for ``Endian.Little`` word order and
+     byte-swapped within each word for ``Endian.Little`` byte order
+   * ``ascii``/``string`` values are NUL-padded to the register length
+
+Coils and discrete inputs hold single bits rather than register words, so their values use a ``BitCodec``
+from ``get_bit_codec`` instead.
+
+Codecs are immutable and shared through ``get_codec`` so each distinct combination of encoding, byte order,
+word order and length is compiled once.
+"""
+
+import struct
+
+from pymodbus.constants import Endian
+
+ENCODING_FORMATS = {
+    'int8': 'bx',
+    'uint8': 'Bx',
+    'boolean': 'Bx',
+    'int16': 'h',
+    'uint16': 'H',
+    'int32': 'i',
+    'uint32': 'I',
+    'float32': 'f',
+    'int64': 'q',
+    'uint64': 'Q',
+    'float64': 'd',
+}
+STRING_ENCODINGS = ['ascii', 'string']
+
+_codecs = {}
+
+
+def register_count(encoding, length=1):
+    """
+    Returns the number of 16-bit registers used by an encoding
+
+    :param str encoding: the data encoding e.g. 'float32'
+    :param int length: the number of registers for string encodings
+    :rtype: int
+    """
+    if encoding in STRING_ENCODINGS:
+        return length
+    return max(1, struct.calcsize('>' + ENCODING_FORMATS[encoding]) // 2)
+
+
+class RegisterCodec(object):
+    """
+    Packs values to and unpacks values from a list of register words for one encoding, byte order and word order
+    """
+    def __init__(self, encoding, byteorder=Endian.Big, wordorder=Endian.Big, length=1):
+        """
+        :param str encoding: the data encoding from ``ENCODING_FORMATS`` or ``STRING_ENCODINGS``
+        :param byteorder: the byte order within each register from [Endian.Big, Endian.Little]
+        :param wordorder: the register order for multi-register values from [Endian.Big, Endian.Little]
+        :param int length: the number of registers for string encodings
+        :raises ValueError: if the encoding is not supported
+        """
+        if encoding not in ENCODING_FORMATS and encoding not in STRING_ENCODINGS:
+            raise ValueError("Unsupported encoding {enc}".format(enc=encoding))
+        self.encoding = encoding
+        self.byteorder = byteorder
+        self.wordorder = wordorder
+        self.length = register_count(encoding, length)
+        self.is_string = encoding in STRING_ENCODINGS
+        if self.is_string or encoding in ['int8', 'uint8', 'boolean']:
+            value_format = '>' + ('{}s'.format(2 * self.length) if self.is_string else ENCODING_FORMATS[encoding])
+            word_format = '>{}H'.format(self.length)
+        else:
+            # The value's byte order follows the word order and the words are byte-swapped when the byte order
+            # differs from the word order, which reproduces all four pymodbus byte/word order combinations.
+            value_format = (Endian.Little if wordorder == Endian.Little else Endian.Big) + ENCODING_FORMATS[encoding]
+            word_format = '{}{}H'.format(Endian.Big if byteorder == wordorder else Endian.Little, self.length)
+        self._value = struct.Struct(value_format)
+        self._words = struct.Struct(word_format)
+
+    def encode(self, value):
+        """
+        Encodes a value into register words
+
+        :param value: the value to encode
+        :return: the register words
+        :rtype: list
+        """
+        if self.is_string and not isinstance(value, bytes):
+            value = value.encode('ascii')
+        return list(self._words.unpack(self._value.pack(value)))
+
+    def decode(self, registers):
+        """
+        Decodes a value from register words
+
+        :param registers: a sequence of ``length`` register words
+        :return: the decoded value
+        """
+        value = self._value.unpack(self._words.pack(*registers))[0]
+        if self.is_string:
+            value = value.rstrip(b'\x00')
+        return value
+
+
+class BitCodec(object):
+    """
+    Packs integer values to and unpacks them from a list of coil or discrete input bits, least significant bit first
+    """
+    def __init__(self, length=1):
+        """
+        :param int length: the number of bits
+        """
+        self.length = length
+
+    def encode(self, value):
+        """
+        Encodes a value into bits
+
+        :param value: the value to encode, e.g. True or 1 to set a single bit
+        :return: the bits
+        :rtype: list
+        """
+        value = int(value)
+        return [(value >> bit) & 1 for bit in range(self.length)]
+
+    def decode(self, bits):
+        """
+        Decodes a value from bits
+
+        :param bits: a sequence of ``length`` bits
+        :return: the decoded value
+        :rtype: int
+        """
+        value = 0
+        for bit, state in enumerate(bits):
+            if state:
+                value |= 1 << bit
+        return value
+
+
+def get_codec(encoding, byteorder=Endian.Big, wordorder=Endian.Big, length=1):
+    """
+    Returns the shared codec for an encoding, compiling it on first use
+
+    :param str encoding: the data encoding e.g. 'float32'
+    :param byteorder: the byte order from [Endian.Big, Endian.Little]
+    :param wordorder: the word order from [Endian.Big, Endian.Little]
+    :param int length: the number of registers for string encodings
+    :rtype: RegisterCodec
+    :raises ValueError: if the encoding is not supported
+    """
+    key = (encoding, byteorder, wordorder, length if encoding in STRING_ENCODINGS else 1)
+    codec = _codecs.get(key, None)
+    if codec is None:
+        codec = RegisterCodec(encoding, byteorder=byteorder, wordorder=wordorder, length=length)
+        _codecs[key] = codec
+    return codec
+
+
+def get_bit_codec(encoding, length=1):
+    """
+    Returns the shared codec for a coil or discrete input register
+
+    :param str encoding: the data encoding e.g. 'boolean'
+    :param int length: the number of bits
+    :rtype: BitCodec
+    :raises ValueError: if the encoding is not supported for bits
+    """
+    if encoding not in ENCODING_FORMATS or 'float' in encoding:
+        raise ValueError("Unsupported bit encoding {enc}".format(enc=encoding))
+    key = ('bit', length)
+    codec = _codecs.get(key, None)
+    if codec is None:
+        codec = BitCodec(length=length)
+        _codecs[key] = codec
+    return codec
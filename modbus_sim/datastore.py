@@ -0,0 +1,720 @@
+"""
+Compact Modbus data blocks for the simulated slave context.
+
+``SegmentedDataBlock`` groups the addresses used by a template into contiguous runs and allocates storage for
+those runs only, so a map with registers at 1 and 40001 allocates two small runs rather than a 40k block.
+The run holding a request is found with a binary search, which also makes sparse-mode address checks
+O(log runs) instead of building sets of addresses.
+
+``ArrayDataBlock`` stores 16-bit registers in a ``bytearray`` in network (big-endian) byte order, i.e. exactly as
+they are sent on the wire, using 2 bytes per register instead of a boxed Python int per register.  Reads return a
+``RegisterView`` over a ``memoryview`` slice of the block, so no values are copied until the response is encoded,
+and ``install_response_encoder`` lets pymodbus read responses copy a view straight into the response PDU.
+
+``BitDataBlock`` stores coils and discrete inputs packed 8 per byte, least significant bit first, which is the
+layout of a Read Coils / Read Discrete Inputs response.  Reads return a ``BitView`` whose packed bytes are a plain
+slice of the block when the read starts on a byte boundary, so aligned reads do no per-bit work.
+
+``RegisterBank`` double-buffers the data blocks of a slave context.  Periodic updates write into a back copy of
+the blocks, which records the address ranges written, and the finished update is published by copying each of
+those ranges into the live blocks with a single write, so requests never read a partly written multi-register
+value and values written by masters to other addresses during the update are kept.
+
+.. note::
+   Python 2.7 ``array.array`` does not support ``memoryview``, hence the ``bytearray`` storage.
+
+"""
+
+import binascii
+import bisect
+import struct
+
+from pymodbus.compat import int2byte
+from pymodbus.datastore.store import BaseModbusDataBlock
+from pymodbus.exceptions import ParameterException
+from pymodbus.bit_read_message import ReadBitsResponseBase
+from pymodbus.datastore import ModbusSlaveContext
+from pymodbus.register_read_message import ReadRegistersResponseBase
+
+_register_structs = {}
+
+
+def _register_struct(count):
+    """Returns a cached ``struct.Struct`` for ``count`` big-endian 16-bit registers"""
+    packer = _register_structs.get(count, None)
+    if packer is None:
+        packer = struct.Struct('>{}H'.format(count))
+        _register_structs[count] = packer
+    return packer
+
+
+class RegisterView(object):
+    """
+    A read-only sequence of 16-bit register values over a slice of a data block's buffer
+    """
+    __slots__ = ['view']
+
+    def __init__(self, view):
+        """
+        :param memoryview view: the big-endian register bytes
+        """
+        self.view = view
+
+    def __len__(self):
+        return len(self.view) // 2
+
+    def __iter__(self):
+        return iter(_register_struct(len(self.view) // 2).unpack_from(self.view))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.tolist()[index]
+        count = len(self.view) // 2
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("register index out of range")
+        return _register_struct(1).unpack_from(self.view, index * 2)[0]
+
+    def __eq__(self, other):
+        return self.tolist() == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        """Returns the register values as a list of ints"""
+        return list(_register_struct(len(self.view) // 2).unpack_from(self.view))
+
+    def tobytes(self):
+        """Returns the register values as big-endian bytes"""
+        return self.view.tobytes()
+
+
+class ArrayDataBlock(BaseModbusDataBlock):
+    """
+    A sequential data block of 16-bit registers stored in a bytearray
+    """
+    def __init__(self, address, count, default_value=0, buffer=None):
+        """
+        :param int address: the starting address of the block
+        :param int count: the number of registers in the block
+        :param int default_value: the initial value of each register
+        :param buffer: an existing writable buffer of ``count * 2`` bytes to hold the registers
+            e.g. a ``multiprocessing`` shared ``c_ubyte`` array, by default a new ``bytearray``
+        """
+        self.address = address
+        self.default_value = default_value
+        self._buffer = bytearray(count * 2) if buffer is None else memoryview(buffer)
+        self._view = memoryview(self._buffer)
+        if default_value:
+            self.reset()
+
+    @property
+    def values(self):
+        """The register values as a list (a copy, for compatibility with pymodbus data blocks)"""
+        return RegisterView(self._view).tolist()
+
+    def __len__(self):
+        return len(self._buffer) // 2
+
+    def __str__(self):
+        return "ArrayDataBlock({}, {})".format(self.address, len(self))
+
+    def __iter__(self):
+        return enumerate(RegisterView(self._view), self.address)
+
+    def reset(self):
+        """Resets all registers to the default value"""
+        self._buffer[:] = _register_struct(1).pack(self.default_value) * len(self)
+
+    def copy(self):
+        """Returns a new block with a copy of the registers"""
+        block = ArrayDataBlock(self.address, len(self), default_value=self.default_value)
+        block.sync(self)
+        return block
+
+    def sync(self, source):
+        """
+        Copies the registers of a block of the same address and size into this block
+
+        :param ArrayDataBlock source: the block to copy
+        """
+        self._buffer[:] = source._buffer
+
+    def copy_to(self, target, address, count):
+        """
+        Copies registers into another block holding the same addresses, as one copy of their bytes
+
+        :param ArrayDataBlock target: the block to copy into
+        :param int address: the first address
+        :param int count: the number of registers
+        """
+        start = (address - target.address) * 2
+        source = (address - self.address) * 2
+        target._buffer[start:start + count * 2] = self._view[source:source + count * 2]
+
+    def validate(self, address, count=1):
+        """
+        Checks to see if the request is in range
+
+        :param int address: the starting address
+        :param int count: the number of registers
+        :rtype: bool
+        """
+        return self.address <= address and address + count <= self.address + len(self)
+
+    def getValues(self, address, count=1):
+        """
+        Returns a view of the requested registers without copying them
+
+        :param int address: the starting address
+        :param int count: the number of registers
+        :rtype: RegisterView
+        """
+        start = (address - self.address) * 2
+        return RegisterView(self._view[start:start + count * 2])
+
+    def setValues(self, address, values):
+        """
+        Sets the requested registers
+
+        :param int address: the starting address
+        :param values: a register value or a sequence of register values
+        :raises ParameterException: if the values do not fit in the block
+        """
+        start = address - self.address
+        if isinstance(values, RegisterView):
+            count = len(values)
+        else:
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            count = len(values)
+        if start < 0 or start + count > len(self):
+            raise ParameterException("Registers {}:{} outside data block {}".format(address, count, self))
+        if isinstance(values, RegisterView):
+            self._buffer[start * 2:(start + count) * 2] = values.tobytes()
+        else:
+            _register_struct(count).pack_into(self._buffer, start * 2, *values)
+
+
+class BitView(object):
+    """
+    A read-only sequence of bits over a range of a bit-packed buffer, least significant bit first
+    """
+    __slots__ = ['buffer', 'offset', 'count']
+
+    def __init__(self, buffer, offset, count):
+        """
+        :param buffer: the packed bits, a ``bytearray`` or other mutable sequence of byte values
+        :param int offset: the index of the first bit in the buffer
+        :param int count: the number of bits
+        """
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+
+    @classmethod
+    def frombytes(cls, data, count):
+        """
+        Returns a view of packed bytes e.g. from ``numpy.packbits``
+
+        :param bytes data: the packed bits, least significant bit first
+        :param int count: the number of bits
+        :rtype: BitView
+        """
+        return cls(bytearray(data), 0, count)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        buffer = self.buffer
+        for bit in range(self.offset, self.offset + self.count):
+            yield (buffer[bit >> 3] >> (bit & 7)) & 1 == 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.tolist()[index]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("bit index out of range")
+        bit = self.offset + index
+        return (self.buffer[bit >> 3] >> (bit & 7)) & 1 == 1
+
+    def __eq__(self, other):
+        return self.tolist() == [bool(value) for value in other]
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        """Returns the bits as a list of bools"""
+        return list(self)
+
+    def tobytes(self):
+        """Returns the bits packed 8 per byte, least significant bit first, with unused high bits cleared"""
+        size = (self.count + 7) // 8
+        first, shift = divmod(self.offset, 8)
+        if shift == 0:
+            data = bytearray(self.buffer[first:first + size])
+        else:
+            # shift the bits down as one little-endian integer rather than bit by bit
+            chunk = bytearray(self.buffer[first:(self.offset + self.count + 7) // 8])
+            chunk.reverse()
+            value = int(binascii.hexlify(chunk), 16) >> shift
+            data = bytearray(binascii.unhexlify('{:0{}x}'.format(value & ((1 << 8 * size) - 1), 2 * size)))
+            data.reverse()
+        if self.count % 8:
+            data[-1] &= (1 << (self.count % 8)) - 1
+        return bytes(data)
+
+
+class BitDataBlock(BaseModbusDataBlock):
+    """
+    A sequential data block of coils or discrete inputs packed 8 per byte in a bytearray
+    """
+    def __init__(self, address, count, default_value=False, buffer=None):
+        """
+        :param int address: the starting address of the block
+        :param int count: the number of bits in the block
+        :param bool default_value: the initial value of each bit
+        :param buffer: an existing mutable sequence of ``(count + 7) // 8`` byte values to hold the bits
+            e.g. a ``multiprocessing`` shared ``c_ubyte`` array, by default a new ``bytearray``
+        """
+        self.address = address
+        self.default_value = default_value
+        self.count = count
+        self._buffer = bytearray((count + 7) // 8) if buffer is None else buffer
+        if default_value:
+            self.reset()
+
+    @property
+    def values(self):
+        """The bit values as a list (a copy, for compatibility with pymodbus data blocks)"""
+        return BitView(self._buffer, 0, self.count).tolist()
+
+    def __len__(self):
+        return self.count
+
+    def __str__(self):
+        return "BitDataBlock({}, {})".format(self.address, len(self))
+
+    def __iter__(self):
+        return enumerate(BitView(self._buffer, 0, self.count), self.address)
+
+    def reset(self):
+        """Resets all bits to the default value"""
+        self._buffer[:] = bytearray((b'\xff' if self.default_value else b'\x00') * len(self._buffer))
+        if self.default_value and self.count % 8:
+            self._buffer[-1] &= (1 << (self.count % 8)) - 1
+
+    def copy(self):
+        """Returns a new block with a copy of the bits"""
+        block = BitDataBlock(self.address, self.count, default_value=self.default_value)
+        block.sync(self)
+        return block
+
+    def sync(self, source):
+        """
+        Copies the bits of a block of the same address and size into this block
+
+        :param BitDataBlock source: the block to copy
+        """
+        self._buffer[:] = source._buffer
+
+    def copy_to(self, target, address, count):
+        """
+        Copies bits into another block holding the same addresses
+
+        :param BitDataBlock target: the block to copy into
+        :param int address: the first address
+        :param int count: the number of bits
+        """
+        target.setValues(address, self.getValues(address, count))
+
+    def validate(self, address, count=1):
+        """
+        Checks to see if the request is in range
+
+        :param int address: the starting address
+        :param int count: the number of bits
+        :rtype: bool
+        """
+        return self.address <= address and address + count <= self.address + self.count
+
+    def getValues(self, address, count=1):
+        """
+        Returns a view of the requested bits without copying them
+
+        :param int address: the starting address
+        :param int count: the number of bits
+        :rtype: BitView
+        """
+        return BitView(self._buffer, address - self.address, count)
+
+    def setValues(self, address, values):
+        """
+        Sets the requested bits
+
+        :param int address: the starting address
+        :param values: a bit value or a sequence of bit values, any true value sets the bit
+        :raises ParameterException: if the values do not fit in the block
+        """
+        start = address - self.address
+        if not isinstance(values, (list, tuple, BitView)):
+            values = [values]
+        count = len(values)
+        if start < 0 or start + count > self.count:
+            raise ParameterException("Bits {}:{} outside data block {}".format(address, count, self))
+        buffer = self._buffer
+        if isinstance(values, BitView) and start % 8 == 0:
+            # whole bytes are copied, preserving the bits after the last value
+            data = bytearray(values.tobytes())
+            whole = count // 8
+            buffer[start // 8:start // 8 + whole] = data[:whole]
+            if count % 8:
+                mask = (1 << (count % 8)) - 1
+                last = start // 8 + whole
+                buffer[last] = (buffer[last] & ~mask) | data[whole]
+            return
+        for bit, value in enumerate(values, start):
+            if value:
+                buffer[bit >> 3] |= 1 << (bit & 7)
+            else:
+                buffer[bit >> 3] &= ~(1 << (bit & 7)) & 0xff
+
+
+def merge_extents(extents, gap=0):
+    """
+    Merges (address, count) extents into sorted, non-overlapping runs
+
+    :param extents: an iterable of (address, count) tuples
+    :param int gap: runs separated by no more than ``gap`` unused addresses are merged
+    :return: a list of (address, count) runs
+    :rtype: list
+    """
+    runs = []
+    for address, count in sorted(extents):
+        if len(runs) > 0 and address <= runs[-1][0] + runs[-1][1] + gap:
+            start, length = runs[-1]
+            runs[-1] = (start, max(length, address + count - start))
+        else:
+            runs.append((address, count))
+    return runs
+
+
+class SegmentedDataBlock(BaseModbusDataBlock):
+    """
+    A data block made of separately allocated runs of contiguous addresses.
+
+    In sparse mode only addresses inside a run are valid.  Otherwise any address from 0 to the end of the last
+    run is valid: reads of unallocated addresses return the default value and writes to them allocate a new run.
+    """
+    def __init__(self, extents, factory, sparse=True, gap=0, default_value=0):
+        """
+        :param extents: an iterable of (address, count) tuples used by the template
+        :param factory: a callable ``factory(address, count)`` returning the data block for a run
+        :param bool sparse: if True addresses outside the runs are invalid
+        :param int gap: runs separated by no more than ``gap`` unused addresses share one allocation
+        :param default_value: the value of unallocated addresses
+        """
+        self.sparse = sparse
+        self.gap = gap
+        self.default_value = default_value
+        # the (address, count) of every write while recording, e.g. for ``RegisterBank.publish``, else None
+        self.written = None
+        # set by ``rebind`` when the runs live in memory shared with other processes
+        self.shared = False
+        self._factory = factory
+        self._starts = []
+        self._ends = []
+        self._runs = []
+        for address, count in merge_extents(extents, gap=0 if sparse else gap):
+            self._starts.append(address)
+            self._ends.append(address + count)
+            self._runs.append(factory(address, count))
+        self.address = self._starts[0] if len(self._starts) > 0 else 0
+        self.end = self._ends[-1] if len(self._ends) > 0 else 0
+
+    @property
+    def runs(self):
+        """The (address, count) of each allocated run"""
+        return [(start, end - start) for start, end in zip(self._starts, self._ends)]
+
+    @property
+    def values(self):
+        """The allocated values as a dictionary of address: value"""
+        return dict(self)
+
+    def __len__(self):
+        return sum(end - start for start, end in zip(self._starts, self._ends))
+
+    def __str__(self):
+        return "SegmentedDataBlock({} runs, {} addresses)".format(len(self._runs), len(self))
+
+    def __iter__(self):
+        for start, end, run in zip(self._starts, self._ends, self._runs):
+            for address, value in enumerate(run.getValues(start, end - start), start):
+                yield address, value
+
+    def reset(self):
+        """Resets all runs to their default value"""
+        for run in self._runs:
+            run.reset()
+
+    def copy(self):
+        """Returns a new block with copies of the allocated runs"""
+        block = SegmentedDataBlock([], self._factory, sparse=self.sparse, gap=self.gap,
+                                   default_value=self.default_value)
+        block.sync(self)
+        return block
+
+    def sync(self, source):
+        """
+        Makes this block a copy of another, reusing the allocated runs when both have the same runs
+
+        :param SegmentedDataBlock source: the block to copy
+        :raises ValueError: if the runs differ and this block's runs are shared, as they cannot be replaced
+        """
+        if self._starts == source._starts and self._ends == source._ends:
+            for run, source_run in zip(self._runs, source._runs):
+                run.sync(source_run)
+        elif self.shared:
+            raise ValueError("Unable to replace the shared runs of {}".format(self))
+        else:
+            self._starts = list(source._starts)
+            self._ends = list(source._ends)
+            self._runs = [run.copy() for run in source._runs]
+        self.address = source.address
+        self.end = source.end
+
+    def rebind(self, factory, shared=False):
+        """
+        Moves each allocated run into a new block, copying its values e.g. into shared memory
+
+        :param factory: a callable ``factory(address, count)`` returning the new data block for a run
+        :param bool shared: the new runs are shared with other processes, so the block becomes sparse and its runs
+            are never reallocated or replaced
+        """
+        runs = []
+        for start, end, run in zip(self._starts, self._ends, self._runs):
+            new_run = factory(start, end - start)
+            new_run.sync(run)
+            runs.append(new_run)
+        self._runs = runs
+        if shared:
+            self.shared = True
+            self.sparse = True
+
+    def _find(self, address, count):
+        """Returns the index of the run holding all of address..address+count-1, or -1"""
+        i = bisect.bisect_right(self._starts, address) - 1
+        if i >= 0 and address + count <= self._ends[i]:
+            return i
+        return -1
+
+    def validate(self, address, count=1):
+        """
+        Checks to see if the request is in range
+
+        :param int address: the starting address
+        :param int count: the number of values
+        :rtype: bool
+        """
+        if count < 1:
+            return False
+        if self.sparse:
+            return self._find(address, count) >= 0
+        return 0 <= address and address + count <= self.end
+
+    def getValues(self, address, count=1):
+        """
+        Returns the requested values, as a view of a single run where possible
+
+        :param int address: the starting address
+        :param int count: the number of values
+        """
+        i = self._find(address, count)
+        if i >= 0:
+            return self._runs[i].getValues(address, count)
+        values = [self.default_value] * count
+        i = max(0, bisect.bisect_right(self._starts, address) - 1)
+        while i < len(self._runs) and self._starts[i] < address + count:
+            start = max(address, self._starts[i])
+            end = min(address + count, self._ends[i])
+            if start < end:
+                values[start - address:end - address] = list(self._runs[i].getValues(start, end - start))
+            i += 1
+        return values
+
+    def setValues(self, address, values, written=None):
+        """
+        Sets the requested values, allocating a run for unallocated addresses if not sparse
+
+        :param int address: the starting address
+        :param values: a value or a sequence of values
+        :param list written: (optional) the (address, count) of the values that changed, recorded while recording
+            writes instead of the whole range e.g. when a window of registers is written back unchanged around them
+        :raises ParameterException: if any address is invalid
+        """
+        if not isinstance(values, (list, tuple, RegisterView, BitView)):
+            values = [values]
+        count = len(values)
+        i = self._find(address, count)
+        if i < 0:
+            if self.sparse:
+                raise ParameterException("Addresses {}:{} not defined in {}".format(address, count, self))
+            i = self._allocate(address, count)
+        self._runs[i].setValues(address, values)
+        if self.written is not None:
+            if written is None:
+                self.written.append((address, count))
+            else:
+                self.written.extend(written)
+
+    def copy_to(self, target, extents):
+        """
+        Copies ranges of addresses into another block, one copy per range, e.g. to publish the ranges written by
+        an update without touching the addresses around them
+
+        :param SegmentedDataBlock target: the block to copy into
+        :param extents: the (address, count) of each range
+        """
+        # consecutive ranges usually fall in the same pair of runs, which is looked up once
+        start = end = 0
+        source = destination = None
+        for address, count in extents:
+            if not start <= address < address + count <= end:
+                i = self._find(address, count)
+                j = target._find(address, count)
+                if i < 0 or j < 0:
+                    # a range across runs, or not allocated in the target
+                    target.setValues(address, self.getValues(address, count))
+                    start = end = 0
+                    continue
+                source = self._runs[i]
+                destination = target._runs[j]
+                start = max(self._starts[i], target._starts[j])
+                end = min(self._ends[i], target._ends[j])
+                registers = isinstance(source, ArrayDataBlock)
+                if registers:
+                    source_view, source_base = source._view, source.address * 2
+                    target_buffer, target_base = destination._buffer, destination.address * 2
+            if registers:
+                first = address * 2
+                last = first + count * 2
+                target_buffer[first - target_base:last - target_base] = source_view[first - source_base:last -
+                                                                                    source_base]
+            else:
+                source.copy_to(destination, address, count)
+
+    def _allocate(self, address, count):
+        """Allocates a run covering address..address+count-1 merged with any runs it overlaps or adjoins"""
+        if self.shared:
+            raise ParameterException("Addresses {}:{} not allocated in shared {}".format(address, count, self))
+        first = bisect.bisect_left(self._ends, address)
+        last = bisect.bisect_right(self._starts, address + count)
+        start = min([address] + self._starts[first:last])
+        end = max([address + count] + self._ends[first:last])
+        run = self._factory(start, end - start)
+        for old_start, old_end, old_run in zip(self._starts[first:last], self._ends[first:last],
+                                               self._runs[first:last]):
+            run.setValues(old_start, list(old_run.getValues(old_start, old_end - old_start)))
+        self._starts[first:last] = [start]
+        self._ends[first:last] = [end]
+        self._runs[first:last] = [run]
+        self.address = self._starts[0]
+        self.end = max(self.end, end)
+        return first
+
+
+class RegisterBank(object):
+    """
+    Double-buffered data blocks for a slave context, updated with ``stage`` and ``publish``::
+
+        staging = bank.stage()
+        staging.setValues(...)  # writes are not visible to requests yet
+        bank.publish()          # the written ranges are copied to the live blocks
+
+    Only the address ranges written to the staging context are published, each with one write, so a value
+    written by a master (or by another process to live blocks in shared memory) between ``stage`` and ``publish``
+    is replaced only if the update wrote the same address.
+    """
+    def __init__(self, context):
+        """
+        :param pymodbus.ModbusSlaveContext context: the slave context served to requests
+        """
+        self.context = context
+        self._back = None
+        self._staging = None
+        self._staging_context = None
+
+    def stage(self):
+        """
+        Copies the live blocks into the back buffer and starts recording the writes to it
+
+        :return: a slave context over the back buffer for the update to write into
+        :rtype: pymodbus.ModbusSlaveContext
+        """
+        live = self.context.store
+        if self._back is None:
+            self._back = dict((key, block.copy()) for key, block in live.items())
+        else:
+            for key, block in live.items():
+                self._back[key].sync(block)
+        for block in self._back.values():
+            block.written = []
+        if self._staging_context is None:
+            # constructing a context allocates default blocks of the full address space, so it is built once
+            self._staging_context = ModbusSlaveContext(di=self._back['d'], co=self._back['c'], ir=self._back['i'],
+                                                       hr=self._back['h'], zero_mode=self.context.zero_mode)
+        self._staging_context.store = self._back
+        self._staging = self._staging_context
+        return self._staging
+
+    def publish(self):
+        """Copies the ranges written to the back buffer into the live blocks, one write per merged range"""
+        if self._staging is None:
+            raise ValueError("No staged update to publish")
+        for key, back in self._back.items():
+            back.copy_to(self.context.store[key], back.written)
+            back.written = None
+        self._staging = None
+
+
+def _encode_registers_response(self):
+    """Encodes a read registers response, copying a ``RegisterView`` directly into the PDU"""
+    if isinstance(self.registers, RegisterView):
+        return int2byte(len(self.registers) * 2) + self.registers.tobytes()
+    return _pymodbus_encode_registers_response(self)
+
+
+_pymodbus_encode_registers_response = ReadRegistersResponseBase.encode
+
+
+def _encode_bits_response(self):
+    """Encodes a read coils/discrete inputs response, copying a ``BitView`` directly into the PDU"""
+    if isinstance(self.bits, BitView):
+        data = self.bits.tobytes()
+        return int2byte(len(data)) + data
+    return _pymodbus_encode_bits_response(self)
+
+
+_pymodbus_encode_bits_response = ReadBitsResponseBase.encode
+
+
+def install_response_encoder():
+    """
+    Replaces the encoders of pymodbus read register and read bit responses with ones that serve
+    ``RegisterView`` and ``BitView`` values as a single bytes copy instead of packing each value
+    """
+    ReadRegistersResponseBase.encode = _encode_registers_response
+    ReadBitsResponseBase.encode = _encode_bits_response
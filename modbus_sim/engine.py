@@ -0,0 +1,383 @@
+"""
+A NumPy-vectorized engine for the periodic register updates of a ``Slave`` without a simulator.
+
+Registers are grouped by register type, encoding, byte order and word order.  Each tick the engine:
+
+   1. reads the register image of each data block (one read per window of addresses holding the engine's
+      registers, e.g. of one scan class) into a ``uint16`` array
+   2. gathers and decodes the words of every group with NumPy views matching ``codec.RegisterCodec``
+   3. increments analog values with wraparound from max to min, or toggles discrete values (as bits of coils
+      and discrete inputs, which are read from and written to bit-packed blocks), or for registers with a
+      waveform generates the values of all the block's registers sharing the waveform in one batch
+      (see ``waveforms``)
+   4. encodes and scatters the new values into the image and writes it back (one write per window), recording
+      only the addresses of the engine's registers as written so that ``RegisterBank.publish`` leaves the other
+      addresses of each window as they are
+
+Values written by a master between ticks are read back from the data blocks, as with ``Register.get_value``.
+
+.. note::
+   The engine does not refresh the ``Register.value`` cache of each register; use ``Register.get_value``.
+
+"""
+
+import bisect
+import time
+
+import numpy
+
+import headless
+from pymodbus.constants import Endian
+
+import codec
+import waveforms
+from datastore import BitView, RegisterView, merge_extents
+
+_logger = headless.get_wrapping_logger(name=__name__, debug=True)
+
+# windows of an image separated by no more than this many unused addresses are read and written as one, as copying
+# the unused words costs less than another read and write
+WINDOW_GAP = 1024
+
+NUMPY_FORMATS = {
+    'int8': 'i1',
+    'uint8': 'u1',
+    'boolean': 'u1',
+    'int16': 'i2',
+    'uint16': 'u2',
+    'int32': 'i4',
+    'uint32': 'u4',
+    'float32': 'f4',
+    'int64': 'i8',
+    'uint64': 'u8',
+    'float64': 'f8',
+}
+
+
+def decode_words(words, encoding, byteorder=Endian.Big, wordorder=Endian.Big):
+    """
+    Decodes the values of many registers at once
+
+    :param numpy.ndarray words: a (registers, length) array of register words
+    :param str encoding: the data encoding, from ``NUMPY_FORMATS``
+    :param byteorder: the byte order from [Endian.Big, Endian.Little]
+    :param wordorder: the word order from [Endian.Big, Endian.Little]
+    :return: a 1-D array of values
+    :rtype: numpy.ndarray
+    """
+    fmt = NUMPY_FORMATS[encoding]
+    if fmt[1] == '1':
+        # 8-bit values occupy the high byte of the register
+        return (words[:, 0] >> 8).astype(numpy.uint8).view(fmt)
+    word_dtype = numpy.dtype(('>' if byteorder == wordorder else '<') + 'u2')
+    value_dtype = numpy.dtype(('<' if wordorder == Endian.Little else '>') + fmt)
+    return numpy.ascontiguousarray(words, dtype=word_dtype).view(value_dtype).ravel()
+
+
+def encode_values(values, encoding, byteorder=Endian.Big, wordorder=Endian.Big):
+    """
+    Encodes many register values at once
+
+    :param numpy.ndarray values: a 1-D array of values
+    :param str encoding: the data encoding, from ``NUMPY_FORMATS``
+    :param byteorder: the byte order from [Endian.Big, Endian.Little]
+    :param wordorder: the word order from [Endian.Big, Endian.Little]
+    :return: a (registers, length) array of register words
+    :rtype: numpy.ndarray
+    """
+    fmt = NUMPY_FORMATS[encoding]
+    if fmt[1] == '1':
+        return (values.astype(fmt).view(numpy.uint8).astype(numpy.uint16) << 8).reshape(-1, 1)
+    word_dtype = numpy.dtype(('>' if byteorder == wordorder else '<') + 'u2')
+    value_dtype = numpy.dtype(('<' if wordorder == Endian.Little else '>') + fmt)
+    words = values.astype(value_dtype).reshape(-1, 1).view(word_dtype)
+    return words.astype(numpy.uint16)
+
+
+class BlockImage(object):
+    """
+    The register image of one data block of a slave context, flattened across windows of its allocated runs
+    """
+    def __init__(self, block, extents=None, gap=WINDOW_GAP):
+        """
+        :param block: a ``datastore.SegmentedDataBlock``
+        :param list extents: (optional) the (address, count) of the registers to image, by default every
+            allocated run
+        :param int gap: merges the windows of extents separated by no more than ``gap`` unused addresses
+        """
+        self.block = block
+        self.block_runs = block.runs
+        if extents is None:
+            self.runs = self.block_runs
+        else:
+            # windows never span two allocated runs, so each is read and written as a view of one run
+            self.runs = []
+            for start, count in merge_extents(extents, gap=gap):
+                for run_start, run_count in self.block_runs:
+                    first = max(start, run_start)
+                    last = min(start + count, run_start + run_count)
+                    if first < last:
+                        self.runs.append((first, last - first))
+        self.bases = []
+        size = 0
+        for start, count in self.runs:
+            self.bases.append(size)
+            size += count
+        self.words = numpy.zeros(size, dtype=numpy.uint16)
+        self._kind = [None] * len(self.runs)
+        # the (address, count) of the runs of adjacent registers in each window, recorded as written
+        self.spans = [[] for _ in self.runs]
+        starts = [start for start, count in self.runs]
+        for start, count in (merge_extents(extents) if extents is not None else self.runs):
+            i = max(0, bisect.bisect_right(starts, start) - 1)
+            while i < len(self.runs) and self.runs[i][0] < start + count:
+                first = max(start, self.runs[i][0])
+                last = min(start + count, self.runs[i][0] + self.runs[i][1])
+                if first < last:
+                    self.spans[i].append((first, last - first))
+                i += 1
+
+    def is_stale(self):
+        """Returns True if the block has allocated new runs since the image was created"""
+        return self.block.runs != self.block_runs
+
+    def index(self, address):
+        """
+        Returns the position of an address in the flattened image
+
+        :param int address: the data block address
+        :rtype: int
+        """
+        for (start, count), base in zip(self.runs, self.bases):
+            if start <= address < start + count:
+                return base + address - start
+        raise ValueError("Address {} not allocated in {}".format(address, self.block))
+
+    def read(self):
+        """Reads the block into the image, one read per run"""
+        for i, ((start, count), base) in enumerate(zip(self.runs, self.bases)):
+            values = self.block.getValues(start, count)
+            self._kind[i] = type(values)
+            if self._kind[i] is RegisterView:
+                self.words[base:base + count] = numpy.frombuffer(values.tobytes(), dtype='>u2')
+            elif self._kind[i] is BitView:
+                # unpackbits is most significant bit first (NumPy 1.16 has no bitorder) so reverse each byte
+                bits = numpy.unpackbits(numpy.frombuffer(values.tobytes(), dtype=numpy.uint8))
+                self.words[base:base + count] = bits.reshape(-1, 8)[:, ::-1].ravel()[:count]
+            else:
+                self.words[base:base + count] = numpy.asarray(values, dtype=numpy.uint16)
+
+    def write(self):
+        """Writes the image back to the block, one write per run, recording the registers' addresses as written"""
+        for i, ((start, count), base) in enumerate(zip(self.runs, self.bases)):
+            words = self.words[base:base + count]
+            if self._kind[i] is RegisterView:
+                values = RegisterView(memoryview(words.astype('>u2').tobytes()))
+            elif self._kind[i] is BitView:
+                bits = numpy.zeros((count + 7) // 8 * 8, dtype=numpy.uint8)
+                bits[:count] = words != 0
+                values = BitView.frombytes(numpy.packbits(bits.reshape(-1, 8)[:, ::-1]).tobytes(), count)
+            else:
+                values = words.tolist()
+            self.block.setValues(start, values, written=self.spans[i])
+
+
+class RegisterGroup(object):
+    """
+    Registers of one block sharing an encoding, byte order and word order, with their limits as arrays
+    """
+    def __init__(self, registers, image, offset=0):
+        """
+        :param list registers: the ``Slave.Register`` objects of the group
+        :param BlockImage image: the image of the data block holding the registers
+        :param int offset: the address offset applied by the slave context (1 for PLC base address 1)
+        """
+        first = registers[0]
+        self.reg_type = first.reg_type
+        self.encoding = first.encoding
+        self.byteorder = first.byteorder
+        self.wordorder = first.wordorder
+        self.is_bits = self.reg_type in ['di', 'co']
+        self.length = first.length if self.is_bits else codec.register_count(self.encoding)
+        self.registers = registers
+        fmt = NUMPY_FORMATS[self.encoding]
+        starts = numpy.array([image.index(reg.address + offset) for reg in registers], dtype=numpy.intp)
+        self.positions = starts.reshape(-1, 1) + numpy.arange(self.length, dtype=numpy.intp)
+        self.has_max = numpy.array([reg.max is not None for reg in registers], dtype=bool)
+        self.has_min = numpy.array([reg.min is not None for reg in registers], dtype=bool)
+        self.max = numpy.array([reg.max if reg.max is not None else 0 for reg in registers], dtype=fmt)
+        self.min = numpy.array([reg.min if reg.min is not None else 0 for reg in registers], dtype=fmt)
+
+    def update(self, image, now=None):
+        """
+        Increments or toggles the group's values within the block image
+
+        :param BlockImage image: the image of the data block holding the registers
+        :param float now: the tick time (unused)
+        """
+        if self.is_bits:
+            # coils and discrete inputs are toggled as integers of their bits, least significant bit first
+            shifts = numpy.arange(self.length, dtype=numpy.uint64)
+            old = (image.words[self.positions].astype(numpy.uint64) << shifts).sum(axis=1)
+            new = numpy.where(old == 1, 0, 1).astype(numpy.uint64)
+            image.words[self.positions] = (new.reshape(-1, 1) >> shifts) & 1
+            return
+        old = decode_words(image.words[self.positions], self.encoding, self.byteorder, self.wordorder)
+        if self.reg_type in ['hr', 'ir']:
+            increment = ~self.has_max | (old < self.max)
+            # a 1-D operand keeps the dtype of old (a scalar 1 would promote uint64 to float64)
+            new = numpy.where(increment, old + numpy.ones(1, dtype=old.dtype), self.min)
+            new = numpy.where(increment | self.has_min, new, old)
+        else:
+            new = numpy.where(old == 1, 0, 1).astype(old.dtype)
+        image.words[self.positions] = encode_values(new, self.encoding, self.byteorder, self.wordorder)
+
+
+class WaveformGroup(object):
+    """
+    Registers of one block driven by the same waveform, generated as one batch and encoded per encoding
+    """
+    def __init__(self, waveform, registers, image, offset=0):
+        """
+        :param str waveform: the waveform, from ``waveforms.WAVEFORMS``
+        :param list registers: the ``Slave.Register`` objects of the group
+        :param BlockImage image: the image of the data block holding the registers
+        :param int offset: the address offset applied by the slave context (1 for PLC base address 1)
+        """
+        self.waveform = waveform
+        self.generate = waveforms.WAVEFORMS[waveform]
+        self.reg_type = registers[0].reg_type
+        self.is_bits = self.reg_type in ['di', 'co']
+        self.registers = registers
+        self.params = waveforms.parameter_arrays(registers)
+        # registers without limits are clipped to infinity
+        self.max = numpy.array([reg.max if reg.max is not None else numpy.inf for reg in registers],
+                               dtype=numpy.float64)
+        self.min = numpy.array([reg.min if reg.min is not None else -numpy.inf for reg in registers],
+                               dtype=numpy.float64)
+        self.random = numpy.random.RandomState()
+        # the registers of each encoding, byte order and word order as (indices, positions, encoding, byte order,
+        # word order), encoded together after the whole group is generated
+        by_encoding = {}
+        for i, reg in enumerate(registers):
+            key = (reg.encoding, reg.length) if self.is_bits else (reg.encoding, reg.byteorder, reg.wordorder)
+            by_encoding.setdefault(key, []).append(i)
+        self.encodings = []
+        for key, indices in by_encoding.items():
+            first = registers[indices[0]]
+            length = first.length if self.is_bits else codec.register_count(first.encoding)
+            starts = numpy.array([image.index(registers[i].address + offset) for i in indices], dtype=numpy.intp)
+            positions = starts.reshape(-1, 1) + numpy.arange(length, dtype=numpy.intp)
+            # a group of one encoding takes all the values without gathering them
+            selection = numpy.array(indices, dtype=numpy.intp) if len(by_encoding) > 1 else slice(None)
+            self.encodings.append((selection, positions, first.encoding, first.byteorder, first.wordorder))
+
+    def _read(self, image):
+        """Returns the current values of the group's registers, e.g. for a random walk"""
+        values = numpy.zeros(len(self.registers), dtype=numpy.float64)
+        for indices, positions, encoding, byteorder, wordorder in self.encodings:
+            if self.is_bits:
+                shifts = numpy.arange(positions.shape[1], dtype=numpy.uint64)
+                values[indices] = (image.words[positions].astype(numpy.uint64) << shifts).sum(axis=1)
+            else:
+                values[indices] = decode_words(image.words[positions], encoding, byteorder, wordorder)
+        return values
+
+    def update(self, image, now):
+        """
+        Generates the group's values at the tick time within the block image
+
+        :param BlockImage image: the image of the data block holding the registers
+        :param float now: the tick time as a Unix time
+        """
+        previous = self._read(image) if self.waveform == 'walk' else None
+        values = self.generate(now, self.params, previous, self.random)
+        values = numpy.clip(values, self.min, self.max)
+        for indices, positions, encoding, byteorder, wordorder in self.encodings:
+            if self.is_bits and positions.shape[1] == 1:
+                image.words[positions[:, 0]] = numpy.rint(values[indices])
+            elif self.is_bits:
+                shifts = numpy.arange(positions.shape[1], dtype=numpy.uint64)
+                new = numpy.rint(values[indices]).astype(numpy.uint64)
+                image.words[positions] = (new.reshape(-1, 1) >> shifts) & 1
+            else:
+                new = values[indices] if 'float' in encoding else numpy.rint(values[indices])
+                image.words[positions] = encode_values(new, encoding, byteorder, wordorder)
+
+
+class UpdateEngine(object):
+    """
+    Vectorized increment/toggle and waveform updates for the numeric registers of a ``Slave``, e.g. of one scan
+    class
+    """
+    def __init__(self, slave, registers=None):
+        """
+        :param Slave slave: the slave whose registers are updated
+        :param list registers: (optional) the registers to update, by default all the slave's registers
+        """
+        self.slave = slave
+        self.registers = registers if registers is not None else slave.registers
+        self.images = {}
+        self.groups = []
+        self._store_keys = {}
+        self._build(slave.context)
+
+    def _build(self, context):
+        """
+        Creates the block images and register groups
+
+        :param pymodbus.ModbusSlaveContext context: the slave context holding the data blocks
+        """
+        offset = 0 if self.slave.zero_mode else 1
+        self.images = {}
+        extents = {}
+        grouped = {}
+        generated = {}
+        for reg in self.registers:
+            if reg.reg_type is None or reg.address is None or reg.encoding not in NUMPY_FORMATS:
+                continue
+            if reg.reg_type in ['di', 'co']:
+                if 'float' in reg.encoding:
+                    continue
+                key = (reg.reg_type, reg.encoding, reg.length)
+            else:
+                key = (reg.reg_type, reg.encoding, reg.byteorder, reg.wordorder)
+            if reg.reg_type not in extents:
+                self._store_keys[reg.reg_type] = context.decode(reg.get_function_code())
+                extents[reg.reg_type] = []
+            extents[reg.reg_type].append((reg.address + offset, reg.length))
+            if reg.waveform is not None:
+                generated.setdefault((reg.reg_type, reg.waveform['type']), []).append(reg)
+                continue
+            grouped.setdefault(key, []).append(reg)
+        for reg_type in extents:
+            self.images[reg_type] = BlockImage(context.store[self._store_keys[reg_type]], extents[reg_type])
+        self.groups = [RegisterGroup(registers, self.images[key[0]], offset=offset)
+                       for key, registers in grouped.items()]
+        self.groups += [WaveformGroup(key[1], registers, self.images[key[0]], offset=offset)
+                        for key, registers in generated.items()]
+
+    def tick(self, context=None, now=None):
+        """
+        Applies one update to every register, with one read and one write per window
+
+        :param pymodbus.ModbusSlaveContext context: the context to update e.g. the staging context of a
+            ``datastore.RegisterBank``, by default the slave's context
+        :param float now: the tick time of the waveforms as a Unix time, by default the current time
+        """
+        if context is None:
+            context = self.slave.context
+        if now is None:
+            now = time.time()
+        for reg_type, image in self.images.items():
+            image.block = context.store[self._store_keys[reg_type]]
+        if any(image.is_stale() for image in self.images.values()):
+            self._build(context)
+        for image in self.images.values():
+            image.read()
+        for group in self.groups:
+            group.update(self.images[group.reg_type], now)
+        for image in self.images.values():
+            image.write()
+        _logger.debug("Updated {} registers in {} groups".format(sum(len(g.registers) for g in self.groups),
+                                                                len(self.groups)))
@@ -0,0 +1,350 @@
+"""
+A single-threaded event loop Modbus TCP/UDP server, an alternative to the Twisted servers of pymodbus.
+
+One loop accepts connections, decodes pipelined MBAP frames, executes each batch of requests against the
+``ModbusServerContext`` (see ``pipeline.RequestProcessor``) and runs timers (see ``scheduler.TimerQueue``) such
+as ``update_values`` between socket events, so requests never hop threads and never run concurrently with an
+update.  Sockets are multiplexed with ``select.epoll`` where available (``select.select`` otherwise), so
+thousands of idle master connections cost one file descriptor each and no threads.
+
+.. note::
+   Python 2.7 has no ``asyncio``, hence the ``select`` based loop.  Serial ports are served by the Twisted engine.
+
+"""
+
+import errno
+import os
+import select
+import socket
+import sys
+
+import headless
+
+from pipeline import RequestProcessor
+from scheduler import TimerQueue
+
+_logger = headless.get_wrapping_logger(name=__name__, debug=True)
+
+RECV_SIZE = 65536
+LISTEN_BACKLOG = 1024
+# Python 2.7 does not define SO_REUSEPORT (Linux 3.9+)
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15 if sys.platform.startswith('linux') else None)
+
+
+def listening_socket(address, udp=False, reuse_port=False):
+    """
+    Creates a non-blocking socket bound to an address, listening for connections if TCP
+
+    :param tuple address: the (host, port) to bind
+    :param bool udp: creates a UDP socket instead of a TCP socket
+    :param bool reuse_port: sets SO_REUSEPORT so several processes can bind the same port and the kernel
+        balances new connections (or datagrams) between them
+    :rtype: socket.socket
+    :raises EnvironmentError: if SO_REUSEPORT is not supported by the platform
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if udp else socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        if SO_REUSEPORT is None:
+            raise EnvironmentError("SO_REUSEPORT is not supported on {}".format(sys.platform))
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.bind(address)
+    if not udp:
+        sock.listen(LISTEN_BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+
+def raise_file_limit():
+    """
+    Raises the soft limit of open files to the hard limit so the server can hold thousands of connections
+
+    :return: the open file limit
+    :rtype: int
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+class _Poller(object):
+    """
+    Minimal readiness poller over ``select.epoll``, or ``select.select`` where epoll is unavailable
+    """
+    def __init__(self):
+        self._epoll = select.epoll() if hasattr(select, 'epoll') else None
+        self._read = set()
+        self._write = set()
+
+    def register(self, fd, write=False):
+        """
+        Watches a file descriptor for reads, and optionally writes
+
+        :param int fd: the file descriptor
+        :param bool write: also watch for the descriptor being writable
+        """
+        if self._epoll is not None:
+            self._epoll.register(fd, select.EPOLLIN | (select.EPOLLOUT if write else 0))
+        else:
+            self._read.add(fd)
+            if write:
+                self._write.add(fd)
+
+    def modify(self, fd, write):
+        """
+        Changes whether a watched descriptor is watched for writes
+
+        :param int fd: the file descriptor
+        :param bool write: watch for the descriptor being writable
+        """
+        if self._epoll is not None:
+            self._epoll.modify(fd, select.EPOLLIN | (select.EPOLLOUT if write else 0))
+        elif write:
+            self._write.add(fd)
+        else:
+            self._write.discard(fd)
+
+    def unregister(self, fd):
+        """Stops watching a file descriptor"""
+        if self._epoll is not None:
+            self._epoll.unregister(fd)
+        else:
+            self._read.discard(fd)
+            self._write.discard(fd)
+
+    def poll(self, timeout):
+        """
+        Waits for events
+
+        :param float timeout: the maximum wait in seconds, or None to wait indefinitely
+        :return: a list of (fd, readable, writable) tuples
+        :rtype: list
+        """
+        if self._epoll is not None:
+            events = self._epoll.poll(-1 if timeout is None else timeout)
+            return [(fd, bool(event & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR)),
+                     bool(event & select.EPOLLOUT)) for fd, event in events]
+        readable, writable, _ = select.select(list(self._read), list(self._write), [], timeout)
+        readable = set(readable)
+        writable = set(writable)
+        events = [(fd, True, fd in writable) for fd in readable]
+        events.extend((fd, False, True) for fd in writable if fd not in readable)
+        return events
+
+    def close(self):
+        if self._epoll is not None:
+            self._epoll.close()
+
+
+class Connection(object):
+    """
+    A master connection with its queue of received request bytes and its queued response bytes
+    """
+    __slots__ = ['sock', 'address', 'inbuf', 'outbuf', 'waiting']
+
+    def __init__(self, sock, address):
+        """
+        :param socket.socket sock: the connected non-blocking socket
+        :param address: the master's address
+        """
+        self.sock = sock
+        self.address = address
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.waiting = False
+
+
+class EventLoopServer(TimerQueue):
+    """
+    A Modbus TCP or UDP server running requests and timers on one event loop
+    """
+    def __init__(self, context, identity=None, address=('localhost', 502), udp=False, reuse_port=False):
+        """
+        :param pymodbus.ModbusServerContext context: the slave contexts to serve
+        :param pymodbus.ModbusDeviceIdentification identity: the device identification to report
+        :param tuple address: the (host, port) to listen on
+        :param bool udp: serves Modbus over UDP datagrams instead of TCP connections
+        :param bool reuse_port: binds with SO_REUSEPORT so several worker processes can share the port
+        """
+        super(EventLoopServer, self).__init__(wake=self._wakeup)
+        self.context = context
+        self.address = address
+        self.udp = udp
+        self.reuse_port = reuse_port
+        self.processor = RequestProcessor(context, identity)
+        self.connections = {}
+        self.running = False
+        self._poller = None
+        self._listener = None
+        self._wake_read, self._wake_write = os.pipe()
+
+    def listen(self):
+        """Creates the listening socket"""
+        self._listener = listening_socket(self.address, udp=self.udp, reuse_port=self.reuse_port)
+        _logger.info("Event loop Modbus {} server listening on {}:{}".format('UDP' if self.udp else 'TCP',
+                                                                           *self._listener.getsockname()))
+
+    def serve_forever(self):
+        """Runs the event loop until ``stop`` is called"""
+        if self._listener is None:
+            self.listen()
+        limit = raise_file_limit()
+        _logger.debug("Open file limit {}".format(limit))
+        self._poller = _Poller()
+        self._poller.register(self._listener.fileno())
+        self._poller.register(self._wake_read)
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    events = self._poller.poll(self.next_timeout())
+                except (IOError, OSError, select.error), e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fd, readable, writable in events:
+                    if fd == self._listener.fileno():
+                        if self.udp:
+                            self._receive_datagrams()
+                        else:
+                            self._accept()
+                    elif fd == self._wake_read:
+                        os.read(self._wake_read, 512)
+                    else:
+                        connection = self.connections.get(fd, None)
+                        if connection is None:
+                            continue
+                        if readable:
+                            self._read(connection)
+                        if writable and fd in self.connections:
+                            self._flush(connection)
+                self.run_due()
+        finally:
+            self._shutdown()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wake_write, b'x')
+        except OSError:
+            pass
+
+    def stop(self):
+        """Stops the event loop, from any thread"""
+        self.running = False
+        self._wakeup()
+
+    def _accept(self):
+        """Accepts all pending connections"""
+        while True:
+            try:
+                sock, address = self._listener.accept()
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                if e.args[0] in (errno.EMFILE, errno.ENFILE):
+                    _logger.error("Unable to accept connection: {}".format(e))
+                    return
+                raise
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = Connection(sock, address)
+            self.connections[sock.fileno()] = connection
+            self._poller.register(sock.fileno())
+            _logger.debug("Client connected {}".format(address))
+
+    def _read(self, connection):
+        """Reads from a connection and queues the responses to every complete request"""
+        try:
+            data = connection.sock.recv(RECV_SIZE)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self._close(connection)
+            return
+        if not data:
+            self._close(connection)
+            return
+        connection.inbuf.extend(data)
+        responses = []
+        try:
+            consumed = self.processor.process(connection.inbuf, responses)
+        except Exception, e:
+            # a request that cannot be served must not stop the loop serving every other connection
+            _logger.error("Unable to process request from {}: {}".format(connection.address, e))
+            self._close(connection)
+            return
+        if consumed < 0:
+            _logger.warning("Invalid MBAP header from {}".format(connection.address))
+            self._close(connection)
+            return
+        del connection.inbuf[:consumed]
+        if len(responses) > 0:
+            connection.outbuf.extend(b''.join(responses))
+            self._flush(connection)
+
+    def _flush(self, connection):
+        """Sends as much of a connection's queued responses as the socket accepts"""
+        try:
+            sent = connection.sock.send(connection.outbuf)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                sent = 0
+            else:
+                self._close(connection)
+                return
+        del connection.outbuf[:sent]
+        # only watch for the socket becoming writable while responses are queued
+        waiting = len(connection.outbuf) > 0
+        if waiting != connection.waiting:
+            self._poller.modify(connection.sock.fileno(), waiting)
+            connection.waiting = waiting
+
+    def _close(self, connection):
+        """Closes a connection"""
+        fd = connection.sock.fileno()
+        self._poller.unregister(fd)
+        del self.connections[fd]
+        connection.sock.close()
+        _logger.debug("Client disconnected {}".format(connection.address))
+
+    def _receive_datagrams(self):
+        """Serves all pending UDP requests"""
+        while True:
+            try:
+                data, address = self._listener.recvfrom(RECV_SIZE)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                raise
+            responses = []
+            try:
+                self.processor.process(bytearray(data), responses)
+            except Exception, e:
+                _logger.error("Unable to process datagram from {}: {}".format(address, e))
+                continue
+            if len(responses) > 0:
+                try:
+                    self._listener.sendto(b''.join(responses), address)
+                except socket.error, e:
+                    _logger.warning("Unable to send UDP response to {}: {}".format(address, e))
+
+    def _shutdown(self):
+        """Closes every socket"""
+        for connection in list(self.connections.values()):
+            self._close(connection)
+        if self._poller is not None:
+            self._poller.close()
+            self._poller = None
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
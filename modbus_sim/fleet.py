@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""
+Fleet mode: many simulated devices, each on its own TCP/UDP port, served by several worker processes.
+
+The supervisor process loads every ``Slave``, moves the data blocks of each slave into a register image in
+shared memory (a ``multiprocessing`` shared ``c_ubyte`` array) and forks the workers.  Each worker serves its share
+of the slaves with one reactor and refreshes their values with one update timer, as ``run_async_server`` does for
+a single process.  Updates are written through the slave's ``RegisterBank``, which copies just the registers each
+finished update wrote into the shared image.  The supervisor reads and writes register values directly in shared
+memory with ``Fleet.get_value`` and ``Fleet.set_value``, without going through Modbus.
+
+Usage::
+
+   python modbus_sim/fleet.py --template templates/ --workers 4 --base-port 5020
+
+``ReusePortEndpoint`` instead serves the same slaves from every worker on a single port shared with
+``SO_REUSEPORT``, for many masters polling one simulated device (``modbus_sim.py --workers N``).
+
+.. note::
+   Workers inherit the shared memory when they are forked, so fleet mode requires a platform with ``fork``.
+   The shared data blocks are ``sparse``, so writes to addresses outside the template's runs are rejected rather
+   than allocating runs local to one worker.  Each template needs a port of its own (see ``--base-port``), and the
+   workers serve with the Twisted engine, so ``--server loop`` and ``--profile-access`` are refused.
+
+"""
+
+import sys
+import ctypes
+import multiprocessing
+import multiprocessing.sharedctypes
+import signal
+import socket
+
+import headless
+
+from pymodbus.datastore import ModbusServerContext
+
+import metrics
+from modbus_sim import get_parser, load_slaves, schedule_updates, server_address, start_server, start_simulators
+from datastore import ArrayDataBlock, BitDataBlock, RegisterBank, install_response_encoder
+from eventloop import EventLoopServer, listening_socket
+from pipeline import PipelinedServerFactory, PipelinedUdpProtocol
+from scheduler import Scheduler
+
+_logger = headless.get_wrapping_logger(name=__name__, debug=True)
+
+BIT_STORES = ['d', 'c']
+
+
+def _run_size(key, count):
+    """Returns the bytes used by a run of ``count`` values in the slave context store ``key``"""
+    return (count + 7) // 8 if key in BIT_STORES else count * 2
+
+
+def share_slave(slave):
+    """
+    Moves the data blocks of a slave into a single register image in shared memory.
+    The blocks become sparse and can no longer allocate runs, which would be local to one process.
+
+    :param Slave slave: the slave, whose data blocks are rebound to the shared image
+    :return: the shared register image
+    :rtype: multiprocessing.sharedctypes.RawArray
+    """
+    store = slave.context.store
+    size = 0
+    for key in sorted(store):
+        for start, count in store[key].runs:
+            size += _run_size(key, count)
+    image = multiprocessing.sharedctypes.RawArray(ctypes.c_ubyte, max(size, 1))
+    offset = [0]
+
+    def factory(key):
+        def make_block(address, count):
+            buffer = (ctypes.c_ubyte * _run_size(key, count)).from_buffer(image, offset[0])
+            offset[0] += len(buffer)
+            if key in BIT_STORES:
+                return BitDataBlock(address, count, buffer=buffer)
+            return ArrayDataBlock(address, count, buffer=buffer)
+        return make_block
+
+    for key in sorted(store):
+        store[key].rebind(factory(key), shared=True)
+    # the back buffer and the engines' images were built over the previous blocks
+    slave.bank = RegisterBank(slave.context)
+    slave.engines = {}
+    return image
+
+
+def exit_on_sigterm():
+    """
+    Makes SIGTERM raise ``SystemExit`` in the supervisor so that it stops its workers before exiting,
+    rather than leaving them serving the ports
+    """
+    def handler(signum, frame):
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, handler)
+
+
+def _install_reactor():
+    """
+    Installs a new Twisted reactor in a forked worker, which must not share the supervisor's poller and waker
+    """
+    import twisted.internet
+    from twisted.internet import default
+    sys.modules.pop('twisted.internet.reactor', None)
+    if hasattr(twisted.internet, 'reactor'):
+        del twisted.internet.reactor
+    default.install()
+
+
+def _run_reactor(slaves, update_interval):
+    """
+    Runs the worker's reactor, updating the slaves and running their simulators from a scheduler if any
+
+    :param list slaves: the slaves to update, or an empty list
+    :param int update_interval: the refresh interval for simulated data without a scan class, in seconds
+    """
+    from twisted.internet import reactor
+    scheduler = None
+    if len(slaves) > 0:
+        scheduler = Scheduler(name='fleet_updater')
+        start_simulators(scheduler, slaves)
+        schedule_updates(scheduler, None, slaves, update_interval)
+        scheduler.start()
+    try:
+        reactor.run()
+    finally:
+        if scheduler is not None:
+            scheduler.stop()
+            scheduler.join()
+
+
+class Fleet(object):
+    """
+    A supervisor for worker processes serving many slaves with register images in shared memory
+    """
+    # every slave is served on its own port
+    unique_ports = True
+
+    def __init__(self, slaves, workers=None, update_interval=10, host=None, metrics_port=None):
+        """
+        :param list slaves: the ``Slave`` objects, each with its own TCP or UDP port
+        :param int workers: the number of worker processes (default the number of CPUs)
+        :param int update_interval: the refresh interval for simulated data, in seconds
+        :param str host: the interface to bind, by default the loopback interface
+        :param int metrics_port: serves the metrics of worker N on HTTP port metrics_port + N (default disabled)
+        :raises ValueError: if a slave uses a serial port, or shares its port with another slave
+        """
+        ports = {}
+        for slave in slaves:
+            if 'tcp' not in slave.port and 'udp' not in slave.port:
+                raise ValueError("Fleet mode does not support serial port {} of {}".format(slave.port,
+                                                                                          slave.template))
+            # checked before forking, as the worker serving the second slave would fail to bind the port
+            port = ('udp' in slave.port, server_address(slave.port)[1])
+            if self.unique_ports and port in ports:
+                raise ValueError("Port {} of {} is also used by {}".format(slave.port, slave.template,
+                                                                         ports[port].template))
+            ports[port] = slave
+        self.slaves = slaves
+        self.workers = min(workers or multiprocessing.cpu_count(), max(len(slaves), 1))
+        self.update_interval = update_interval
+        self.host = host
+        self.metrics_port = metrics_port
+        self.images = [share_slave(slave) for slave in slaves]
+        self.processes = []
+        self._ports = dict((slave.port, slave) for slave in slaves)
+
+    def shares(self):
+        """
+        Returns the slaves served by each worker, dealt round-robin
+
+        :rtype: list
+        """
+        return [self.slaves[worker::self.workers] for worker in range(self.workers)]
+
+    def serve(self, worker, slaves):
+        """
+        Worker process: serves each slave on its own port, and updates all of them and runs their simulators
+        from one scheduler
+
+        :param int worker: the worker number
+        :param list slaves: the worker's share of the slaves, with data blocks in shared memory
+        """
+        _install_reactor()
+        for slave in slaves:
+            context = ModbusServerContext(slaves={slave.slave_id: slave.context}, single=False)
+            start_server(slave, context, defer_reactor_run=True, host=self.host)
+        _run_reactor(slaves, self.update_interval)
+
+    def _run_worker(self, worker, slaves):
+        """Worker process entry point, restoring the default SIGTERM handling of the supervisor"""
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if self.metrics_port is not None:
+            metrics.enable()
+            metrics.MetricsServer((self.host or 'localhost', self.metrics_port + worker)).start()
+        self.serve(worker, slaves)
+
+    def start(self):
+        """Forks the worker processes"""
+        install_response_encoder()
+        for worker, share in enumerate(self.shares()):
+            process = multiprocessing.Process(target=self._run_worker, name="fleet_worker_{}".format(worker),
+                                              args=(worker, share))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+        _logger.info("Serving {} slaves with {} workers".format(len(self.slaves), len(self.processes)))
+
+    def stop(self):
+        """Terminates the worker processes"""
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        self.join()
+        self.processes = []
+
+    def join(self, timeout=None):
+        """
+        Waits for the worker processes to exit
+
+        :param float timeout: the maximum time to wait for each worker, in seconds
+        """
+        for process in self.processes:
+            process.join(timeout)
+
+    def slave(self, key):
+        """
+        Returns a slave of the fleet
+
+        :param key: the index of the slave or its port e.g. 'tcp:5020'
+        :rtype: Slave
+        :raises KeyError: if the port is not served by the fleet
+        """
+        if isinstance(key, int):
+            return self.slaves[key]
+        return self._ports[key]
+
+    def get_value(self, key, param_id):
+        """
+        Reads a register value from shared memory
+
+        :param key: the index of the slave or its port e.g. 'tcp:5020'
+        :param int param_id: the paramId of the register
+        :return: the value of the register
+        """
+        return self.slave(key).param_index[param_id].get_value()
+
+    def set_value(self, key, param_id, value):
+        """
+        Writes a register value to shared memory
+
+        .. note::
+           A value written while a worker is updating the same register is replaced by the update.
+
+        :param key: the index of the slave or its port e.g. 'tcp:5020'
+        :param int param_id: the paramId of the register
+        :param value: the new value
+        """
+        self.slave(key).param_index[param_id].set_value(value)
+
+
+class ReusePortEndpoint(Fleet):
+    """
+    A supervisor for worker processes that all serve the same slaves on one TCP or UDP port.
+
+    Each worker binds the port with ``SO_REUSEPORT`` so the kernel spreads master connections across the
+    workers, and every worker serves every unit ID from the register images in shared memory.  Only the first
+    worker runs the periodic updates and the simulators.
+    """
+    # every slave is served on the port of the first
+    unique_ports = False
+
+    def __init__(self, slaves, workers=None, update_interval=10, host=None, server='twisted', metrics_port=None):
+        """
+        :param list slaves: the ``Slave`` objects served under their unit IDs, using the port of the first
+        :param int workers: the number of worker processes (default the number of CPUs)
+        :param int update_interval: the refresh interval for simulated data, in seconds
+        :param str host: the interface to bind, by default the loopback interface
+        :param str server: the server engine of each worker, 'twisted' or 'loop'
+        :param int metrics_port: serves the metrics of worker N on HTTP port metrics_port + N (default disabled)
+        :raises ValueError: if the port is a serial port
+        """
+        super(ReusePortEndpoint, self).__init__(slaves, workers=workers, update_interval=update_interval,
+                                                host=host, metrics_port=metrics_port)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.port = slaves[0].port
+        self.server = server
+
+    def shares(self):
+        """
+        Returns the slaves served by each worker, which is all of them
+
+        :rtype: list
+        """
+        return [self.slaves] * self.workers
+
+    def serve(self, worker, slaves):
+        """
+        Worker process: serves all the slaves on the shared port
+
+        :param int worker: the worker number, the first worker also updates the values and runs the simulators
+        :param list slaves: the slaves, with data blocks in shared memory
+        """
+        slave = slaves[0]
+        context = ModbusServerContext(slaves=dict((unit.slave_id, unit.context) for unit in slaves), single=False)
+        address = server_address(self.port, self.host)
+        udp = 'udp' in self.port
+        updated = slaves if worker == 0 else []
+        if self.server == 'loop':
+            server = EventLoopServer(context, identity=slave.identity, address=address, udp=udp, reuse_port=True)
+            if len(updated) > 0:
+                start_simulators(server, updated)
+                schedule_updates(server, context, updated, self.update_interval)
+            server.serve_forever()
+            return
+        _install_reactor()
+        from twisted.internet import reactor
+        sock = listening_socket(address, udp=udp, reuse_port=True)
+        if udp:
+            reactor.adoptDatagramPort(sock.fileno(), socket.AF_INET,
+                                      PipelinedUdpProtocol(context, identity=slave.identity))
+        else:
+            reactor.adoptStreamPort(sock.fileno(), socket.AF_INET,
+                                    PipelinedServerFactory(context, identity=slave.identity))
+        # the reactor listens on a duplicate of the socket
+        sock.close()
+        _run_reactor(updated, self.update_interval)
+
+
+def get_fleet_parser():
+    """
+    Parses the command line arguments of the fleet launcher.
+
+    :returns: the simulator parser with fleet arguments
+    :rtype: argparse.ArgumentParser
+    """
+    parser = get_parser()
+    parser.description = "Modbus Slave fleet with worker processes (default one per CPU)."
+    parser.add_argument('--base-port', dest='base_port', type=int, default=None,
+                        help="serves template N on TCP port base-port + N instead of its template port")
+    parser.add_argument('--interval', type=int, default=10,
+                        help="the refresh interval for simulated data, in seconds (default 10)")
+    return parser
+
+
+def run_fleet():
+    """Runs a fleet of slaves from the command line until interrupted"""
+    parser = get_fleet_parser()
+    user_options = parser.parse_args()
+    # each worker serves several ports, which the single-listener event loop server cannot
+    if user_options.server != 'twisted':
+        parser.error("fleet mode does not support --server {}".format(user_options.server))
+    if user_options.profile_access is not None:
+        parser.error("fleet mode does not support --profile-access")
+    slaves = load_slaves(user_options, unique_ids=False)
+    if user_options.base_port is not None:
+        for n, slave in enumerate(slaves):
+            slave.port = 'tcp:{}'.format(user_options.base_port + n)
+            slave.mode = 'tcp'
+    try:
+        fleet = Fleet(slaves, workers=user_options.workers, update_interval=user_options.interval,
+                      host=user_options.bind, metrics_port=user_options.metrics_port)
+    except ValueError, e:
+        parser.error(str(e))
+    exit_on_sigterm()
+    fleet.start()
+    try:
+        fleet.join()
+    except KeyboardInterrupt, e:
+        _logger.warning("Execution stopped by keyboard interrupt: {}".format(e))
+    finally:
+        fleet.stop()
+
+
+if __name__ == "__main__":
+    run_fleet()
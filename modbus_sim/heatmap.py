@@ -0,0 +1,170 @@
+"""
+Register access profiling: which addresses masters poll, how often and in what block sizes.
+
+An ``AccessProfile`` keeps counter arrays per register type (slave context store ``d``, ``c``, ``i``, ``h``)
+indexed by Modbus address: reads, writes and rejected accesses (addresses outside the template of a ``sparse``
+slave), plus a histogram of the number of values per request.  Counters are incremented in place, so recording an
+access allocates nothing that outlives the request.
+
+Masters are served a ``ProfiledContext`` that records each access before passing it on to the slave context, so
+values read and written by the simulator itself are not counted, nor is the value pymodbus reads back to answer a
+single write.  ``format_report`` lists the counts per template register, by paramId and name, followed by
+accessed addresses that no register covers and the most frequent block sizes::
+
+   python modbus_sim/modbus_sim.py --template templates/ --profile-access access.txt
+   kill -USR1 <pid>   # writes access.txt, as does stopping the simulator
+
+"""
+
+import numpy
+
+# the address space of each register type, and the largest block a request may read (2000 coils)
+ADDRESSES = 65536
+MAX_BLOCK = 2000
+# Write Single Coil and Write Single Register, which pymodbus answers by reading back the value written
+SINGLE_WRITES = (5, 6)
+STORE_NAMES = {'d': 'di', 'c': 'co', 'i': 'ir', 'h': 'hr'}
+
+
+class AccessProfile(object):
+    """
+    Access counters of one slave, per register type and address
+    """
+    def __init__(self):
+        self.reads = {}
+        self.writes = {}
+        self.rejected = {}
+        self.sizes = {}
+        for key in STORE_NAMES:
+            self.reads[key] = numpy.zeros(ADDRESSES, dtype=numpy.uint32)
+            self.writes[key] = numpy.zeros(ADDRESSES, dtype=numpy.uint32)
+            self.rejected[key] = numpy.zeros(ADDRESSES, dtype=numpy.uint32)
+            self.sizes[key] = numpy.zeros(MAX_BLOCK + 1, dtype=numpy.uint32)
+
+    def record(self, counters, key, address, count):
+        """
+        Counts an access to ``count`` values from ``address``
+
+        :param dict counters: ``reads``, ``writes`` or ``rejected``
+        :param str key: the slave context store
+        :param int address: the Modbus address of the first value
+        :param int count: the number of values
+        """
+        counters[key][address:address + count] += 1
+        self.sizes[key][min(count, MAX_BLOCK)] += 1
+
+    def reset(self):
+        """Clears every counter"""
+        for counters in (self.reads, self.writes, self.rejected, self.sizes):
+            for array in counters.values():
+                array.fill(0)
+
+
+class ProfiledContext(object):
+    """
+    A slave context served to masters, recording every access in an ``AccessProfile``
+    """
+    def __init__(self, context, profile):
+        """
+        :param pymodbus.ModbusSlaveContext context: the slave context
+        :param AccessProfile profile: the profile to record accesses in
+        """
+        self.context = context
+        self.profile = profile
+        # the (fx, address) of a single write, whose value pymodbus reads back to echo it
+        self._echo = None
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def validate(self, fx, address, count=1):
+        valid = self.context.validate(fx, address, count)
+        if not valid:
+            self.profile.record(self.profile.rejected, self.context.decode(fx), address, count)
+        return valid
+
+    def getValues(self, fx, address, count=1):
+        echo = self._echo
+        self._echo = None
+        if echo != (fx, address) or count != 1:
+            self.profile.record(self.profile.reads, self.context.decode(fx), address, count)
+        return self.context.getValues(fx, address, count)
+
+    def setValues(self, fx, address, values):
+        self.profile.record(self.profile.writes, self.context.decode(fx), address, len(values))
+        self.context.setValues(fx, address, values)
+        self._echo = (fx, address) if fx in SINGLE_WRITES else None
+
+
+def _runs(addresses):
+    """Merges ascending addresses into (first, last) runs"""
+    runs = []
+    for address in addresses:
+        if len(runs) > 0 and runs[-1][1] == address - 1:
+            runs[-1][1] = address
+        else:
+            runs.append([address, address])
+    return runs
+
+
+def _peak(counters, span):
+    """Returns the highest count of a span of addresses, 0 for addresses outside the profiled address space"""
+    counts = counters[span]
+    return int(counts.max()) if len(counts) > 0 else 0
+
+
+def format_report(slave, profile, top=10):
+    """
+    Formats the access counts of a slave per register, with uncovered addresses and frequent block sizes
+
+    :param Slave slave: the slave whose registers are reported
+    :param AccessProfile profile: the access counters of the slave
+    :param int top: the number of block sizes to list per register type
+    :return: the report lines
+    :rtype: list
+    """
+    lines = ["Unit ID {} ({})".format(slave.slave_id, slave.template),
+             "{:>8} {:<32} {:>4} {:>6} {:>4} {:>10} {:>10} {:>10}".format('paramId', 'name', 'type', 'addr', 'len',
+                                                                        'reads', 'writes', 'rejected')]
+    covered = {}
+    for key in STORE_NAMES:
+        covered[key] = numpy.zeros(ADDRESSES, dtype=bool)
+    for reg in sorted(slave.registers, key=lambda r: (r.reg_type, r.address)):
+        if reg.address is None:
+            continue
+        key = slave.context.decode(reg.get_function_code())
+        span = slice(reg.address, reg.address + reg.length)
+        covered[key][span] = True
+        lines.append("{:>8} {:<32} {:>4} {:>6} {:>4} {:>10} {:>10} {:>10}".format(
+            reg.paramId, (reg.name or '')[:32], reg.reg_type, reg.address, reg.length,
+            _peak(profile.reads[key], span), _peak(profile.writes[key], span), _peak(profile.rejected[key], span)))
+    for key in sorted(STORE_NAMES):
+        accessed = (profile.reads[key] > 0) | (profile.writes[key] > 0) | (profile.rejected[key] > 0)
+        uncovered = numpy.flatnonzero(accessed & ~covered[key])
+        for first, last in _runs(uncovered.tolist()):
+            span = slice(first, last + 1)
+            lines.append("{:>8} {:<32} {:>4} {:>6} {:>4} {:>10} {:>10} {:>10}".format(
+                '-', '(no register)', STORE_NAMES[key], first, last - first + 1,
+                int(profile.reads[key][span].max()), int(profile.writes[key][span].max()),
+                int(profile.rejected[key][span].max())))
+    for key in sorted(STORE_NAMES):
+        sizes = profile.sizes[key]
+        frequent = [size for size in numpy.argsort(sizes)[::-1][:top] if sizes[size] > 0]
+        if len(frequent) > 0:
+            lines.append("{} block sizes: {}".format(STORE_NAMES[key], ', '.join(
+                "{}x{}".format(int(size), int(sizes[size])) for size in frequent)))
+    return lines
+
+
+def write_report(path, slaves, profiles):
+    """
+    Writes the access report of every profiled slave to a file
+
+    :param str path: the report file
+    :param list slaves: the ``Slave`` objects
+    :param dict profiles: the ``AccessProfile`` of each slave by unit ID
+    """
+    with open(path, 'w') as f:
+        for slave in slaves:
+            if slave.slave_id in profiles:
+                f.write('\n'.join(format_report(slave, profiles[slave.slave_id])) + '\n\n')
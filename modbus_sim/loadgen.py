@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+"""
+A Modbus master load generator for measuring the capacity of a running simulator.
+
+Templates are read through ``Slave`` as the simulator reads them, and the valid requests are derived from each
+``Slave.Register``: a read of every register with the function code of its type, and a write of its default value
+for holding registers and coils.  Client processes then drive the simulator over TCP or UDP with a number of
+connections each, one request in flight per connection, choosing a read or a write by ``--write-ratio``.  A serial
+target (e.g. one end of a virtual pair made with ``socat -d -d pty,raw,echo=0 pty,raw,echo=0``) is driven with RTU
+frames from one process.
+
+Without ``--rate`` each connection sends its next request as soon as the previous response arrives.  With
+``--rate`` requests are scheduled at a fixed total rate and the latency is measured from the scheduled time, so a
+server falling behind shows as latency rather than as fewer requests.
+
+The request rate and the p50/p99/p999 latency are reported, and with ``--json`` saved for tracking across
+releases, e.g.::
+
+   python modbus_sim/loadgen.py --template templates/ --target tcp:5020 --connections 100 --processes 2 \\
+       --duration 10 --write-ratio 0.1 --json results.json
+
+"""
+
+import sys
+import argparse
+import errno
+import json
+import multiprocessing
+import random
+import select
+import socket
+import struct
+import time
+
+import serial
+from pymodbus.utilities import computeCRC
+
+import template_cache
+from modbus_sim import load_slaves, server_address
+from pipeline import MBAP_HEADER, MBAP_HEADER_SIZE
+
+READ_FUNCTIONS = {'co': 1, 'di': 2, 'hr': 3, 'ir': 4}
+READ_RESPONSES = [1, 2, 3, 4]
+RECV_SIZE = 65536
+
+
+def derive_requests(slaves):
+    """
+    Derives the valid read and write requests of the registers of each slave
+
+    :param list slaves: the ``Slave`` objects
+    :return: the read and write requests as (unit_id, pdu) tuples
+    :rtype: tuple
+    """
+    reads = []
+    writes = []
+    for slave in slaves:
+        for reg in slave.registers:
+            if reg.address is None or reg.reg_type not in READ_FUNCTIONS:
+                continue
+            reads.append((slave.slave_id, struct.pack('>BHH', READ_FUNCTIONS[reg.reg_type], reg.address,
+                                                      reg.length)))
+            default = reg.default if reg.default is not None else 0
+            if reg.reg_type == 'co':
+                writes.append((slave.slave_id, struct.pack('>BHH', 5, reg.address, 0xff00 if default else 0)))
+            elif reg.reg_type == 'hr':
+                words = reg.encode(default)
+                if words is None:
+                    continue
+                if len(words) == 1:
+                    writes.append((slave.slave_id, struct.pack('>BHH', 6, reg.address, words[0])))
+                else:
+                    writes.append((slave.slave_id, struct.pack('>BHHB{}H'.format(len(words)), 16, reg.address,
+                                                               len(words), 2 * len(words), *words)))
+    return reads, writes
+
+
+def _choose(reads, writes, write_ratio):
+    """Picks a request, a write with probability ``write_ratio``"""
+    if len(writes) > 0 and (len(reads) == 0 or random.random() < write_ratio):
+        return random.choice(writes)
+    return random.choice(reads)
+
+
+class _Channel(object):
+    """A master connection with at most one request in flight"""
+    __slots__ = ['sock', 'inbuf', 'transaction', 'sent', 'due', 'waiting']
+
+    def __init__(self, sock, due):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.transaction = 0
+        self.sent = None
+        self.due = due
+        self.waiting = False
+
+
+def _open(address, udp):
+    """Opens a non-blocking TCP or UDP socket connected to the simulator"""
+    if udp:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(address)
+    else:
+        sock = socket.create_connection(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setblocking(False)
+    return sock
+
+
+def _socket_client(address, udp, connections, reads, writes, write_ratio, rate, duration, timeout, start_event,
+                   results):
+    """
+    Client process: drives the simulator over TCP or UDP connections until the duration has elapsed
+
+    :param float rate: the requests per second of this process, or None to send as fast as responses arrive
+    """
+    interval = connections / float(rate) if rate else 0.0
+    channels = {}
+    for n in range(connections):
+        sock = _open(address, udp)
+        channels[sock.fileno()] = _Channel(sock, 0.0)
+    # poll has no FD_SETSIZE limit on the number of connections
+    poller = select.poll() if hasattr(select, 'poll') else None
+    if poller is not None:
+        for fd in channels:
+            poller.register(fd, select.POLLIN)
+    start_event.wait()
+    start = time.time()
+    for n, channel in enumerate(channels.values()):
+        # spread the first requests of rate limited connections over one interval
+        channel.due = start + interval * n / connections
+    deadline = start + duration
+    latencies = []
+    exceptions = 0
+    timeouts = 0
+    transaction = 0
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+        wake = deadline
+        for channel in channels.values():
+            if channel.waiting:
+                if now - channel.sent > timeout:
+                    timeouts += 1
+                    channel.waiting = False
+                    del channel.inbuf[:]
+                    channel.due = now if not rate else channel.due + interval
+                else:
+                    wake = min(wake, channel.sent + timeout)
+                    continue
+            if channel.due <= now:
+                unit_id, pdu = _choose(reads, writes, write_ratio)
+                transaction = (transaction + 1) & 0xffff
+                channel.transaction = transaction
+                try:
+                    channel.sock.send(MBAP_HEADER.pack(transaction, 0, len(pdu) + 1, unit_id) + pdu)
+                except socket.error, e:
+                    if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNREFUSED):
+                        raise
+                channel.sent = channel.due if rate else now
+                channel.waiting = True
+                wake = min(wake, channel.sent + timeout)
+            else:
+                wake = min(wake, channel.due)
+        waiting = [fd for fd, channel in channels.items() if channel.waiting]
+        if len(waiting) == 0:
+            time.sleep(max(0.0, wake - time.time()))
+            continue
+        try:
+            if poller is not None:
+                readable = [fd for fd, event in poller.poll(max(0.0, wake - time.time()) * 1000)]
+            else:
+                readable = select.select(waiting, [], [], max(0.0, wake - time.time()))[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for fd in readable:
+            channel = channels[fd]
+            try:
+                data = channel.sock.recv(RECV_SIZE)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNREFUSED):
+                    continue
+                raise
+            received = time.time()
+            if udp:
+                channel.inbuf = bytearray(data)
+            else:
+                if not data:
+                    raise EnvironmentError("The simulator closed the connection")
+                channel.inbuf.extend(data)
+            while len(channel.inbuf) >= MBAP_HEADER_SIZE + 1:
+                transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack_from(channel.inbuf)
+                end = MBAP_HEADER_SIZE - 1 + length
+                if len(channel.inbuf) < end:
+                    break
+                function_code = channel.inbuf[MBAP_HEADER_SIZE]
+                del channel.inbuf[:end]
+                # a response to a request that timed out is discarded
+                if channel.waiting and transaction_id == channel.transaction:
+                    latencies.append(received - channel.sent)
+                    if function_code & 0x80:
+                        exceptions += 1
+                    channel.waiting = False
+                    channel.due = received if not rate else channel.due + interval
+            if udp:
+                del channel.inbuf[:]
+    for channel in channels.values():
+        channel.sock.close()
+    results.put((latencies, exceptions, timeouts))
+
+
+def _rtu_response_size(function_code, port):
+    """
+    Returns the remaining bytes of an RTU response after its unit ID and function code, reading the byte count of
+    a read response
+
+    :param int function_code: the function code of the response
+    :param serial.Serial port: the serial port
+    :return: the number of bytes including the CRC, or None if the byte count was not received
+    :rtype: int
+    """
+    if function_code & 0x80:
+        return 3
+    if function_code in READ_RESPONSES:
+        byte_count = port.read(1)
+        if len(byte_count) < 1:
+            return None
+        return ord(byte_count) + 2
+    return 6
+
+
+PARITIES = {'none': serial.PARITY_NONE, 'even': serial.PARITY_EVEN, 'odd': serial.PARITY_ODD}
+
+
+def _serial_client(port, baudrate, parity, reads, writes, write_ratio, rate, duration, timeout):
+    """
+    Drives the simulator over a serial port with RTU frames until the duration has elapsed
+
+    :return: the latencies, the number of exception responses and the number of timeouts
+    :rtype: tuple
+    """
+    master = serial.Serial(port, baudrate=baudrate, parity=PARITIES[parity], timeout=timeout)
+    interval = 1.0 / rate if rate else 0.0
+    latencies = []
+    exceptions = 0
+    timeouts = 0
+    start = time.time()
+    due = start
+    deadline = start + duration
+    try:
+        while True:
+            now = time.time()
+            if now >= deadline:
+                break
+            if due > now:
+                time.sleep(due - now)
+            unit_id, pdu = _choose(reads, writes, write_ratio)
+            frame = struct.pack('>B', unit_id) + pdu
+            master.reset_input_buffer()
+            master.write(frame + struct.pack('>H', computeCRC(frame)))
+            sent = due if rate else time.time()
+            header = master.read(2)
+            size = _rtu_response_size(ord(header[1]), master) if len(header) == 2 else None
+            body = master.read(size) if size is not None else ''
+            received = time.time()
+            if size is None or len(body) < size:
+                timeouts += 1
+            else:
+                latencies.append(received - sent)
+                if ord(header[1]) & 0x80:
+                    exceptions += 1
+            due = due + interval if rate else received
+    finally:
+        master.close()
+    return latencies, exceptions, timeouts
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if len(values) > 0 else float('nan')
+
+
+def run_load(target, reads, writes, connections=1, processes=1, duration=10.0, rate=None, write_ratio=0.0,
+             timeout=1.0, host=None, baudrate=9600, parity='even'):
+    """
+    Drives a running simulator and measures its request rate and latency
+
+    :param str target: the simulator port e.g. tcp:5020, udp:5020 or /dev/pts/3
+    :param list reads: the read requests as (unit_id, pdu) tuples
+    :param list writes: the write requests as (unit_id, pdu) tuples
+    :param int connections: the total number of TCP/UDP connections
+    :param int processes: the number of client processes sharing the connections
+    :param float duration: the seconds of load
+    :param float rate: the total requests per second, by default as fast as the simulator responds
+    :param float write_ratio: the fraction of requests that are writes
+    :param float timeout: the seconds to wait for a response
+    :param str host: the simulator host for TCP/UDP, by default the loopback interface
+    :param int baudrate: the serial baud rate
+    :param str parity: the serial parity, 'none', 'even' or 'odd'
+    :return: the results, with requests/s and latency percentiles in milliseconds
+    :rtype: dict
+    """
+    if len(reads) == 0 and len(writes) == 0:
+        raise ValueError("No requests derived from the templates")
+    if 'tcp' in target or 'udp' in target:
+        udp = 'udp' in target
+        address = server_address(target, host)
+        processes = max(1, min(processes, connections))
+        start_event = multiprocessing.Event()
+        queue = multiprocessing.Queue()
+        clients = []
+        for n in range(processes):
+            share = connections // processes + (n < connections % processes)
+            clients.append(multiprocessing.Process(target=_socket_client, args=(
+                address, udp, share, reads, writes, write_ratio,
+                rate * share / float(connections) if rate else None, duration, timeout, start_event, queue)))
+        for client in clients:
+            client.daemon = True
+            client.start()
+        start_event.set()
+        latencies = []
+        exceptions = 0
+        timeouts = 0
+        for _ in clients:
+            client_latencies, client_exceptions, client_timeouts = queue.get()
+            latencies.extend(client_latencies)
+            exceptions += client_exceptions
+            timeouts += client_timeouts
+        for client in clients:
+            client.join()
+    else:
+        connections = processes = 1
+        latencies, exceptions, timeouts = _serial_client(target, baudrate, parity, reads, writes, write_ratio, rate,
+                                                         duration, timeout)
+    latencies.sort()
+    return {
+        'target': target,
+        'connections': connections,
+        'processes': processes,
+        'duration': duration,
+        'rate': rate,
+        'write_ratio': write_ratio,
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / float(duration),
+        'exceptions': exceptions,
+        'timeouts': timeouts,
+        'p50_ms': _percentile(latencies, 0.5) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+        'p999_ms': _percentile(latencies, 0.999) * 1000,
+        'max_ms': latencies[-1] * 1000 if len(latencies) > 0 else float('nan'),
+    }
+
+
+def get_loadgen_parser():
+    """
+    Parses the command line arguments of the load generator.
+
+    :returns: a parser with command line arguments
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description="Modbus load generator for a running simulator.")
+    parser.add_argument('-t', '--template', dest='template', nargs='+', default=['DEFAULT'],
+                        help="the simulator's template file(s) or directories, from which requests are derived")
+    parser.add_argument('--target', default=None,
+                        help="the simulator port e.g. tcp:5020, udp:5020 or a serial port (default from the template)")
+    parser.add_argument('--host', default=None, help="the simulator host for TCP/UDP (default loopback)")
+    parser.add_argument('-b', '--baud', dest='baudrate', default=9600, type=int, help="the serial baud rate")
+    parser.add_argument('--parity', default='even', choices=sorted(PARITIES), help="the serial parity (default even)")
+    parser.add_argument('-c', '--connections', type=int, default=10, help="concurrent TCP/UDP connections")
+    parser.add_argument('--processes', type=int, default=1, help="client processes sharing the connections")
+    parser.add_argument('-d', '--duration', type=float, default=10, help="seconds of load (default 10)")
+    parser.add_argument('-r', '--rate', type=float, default=None,
+                        help="total requests per second (default as fast as the simulator responds)")
+    parser.add_argument('-w', '--write-ratio', dest='write_ratio', type=float, default=0.0,
+                        help="fraction of requests that write holding registers and coils (default 0)")
+    parser.add_argument('--timeout', type=float, default=1.0, help="seconds to wait for each response")
+    parser.add_argument('--json', default=None, metavar='FILE', help="saves the results to a JSON file")
+    parser.add_argument('--cache-dir', dest='cache_dir', default=template_cache.DEFAULT_CACHE_DIR,
+                        help="directory of compiled templates (default {})".format(template_cache.DEFAULT_CACHE_DIR))
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help="parses templates without reading or writing compiled templates")
+    return parser
+
+
+def run_loadgen():
+    """Runs the load generator from the command line and prints the results"""
+    user_options = get_loadgen_parser().parse_args()
+    user_options.port = 'tcp:502'
+    user_options.mode = None
+    slaves = load_slaves(user_options, unique_ids=False)
+    reads, writes = derive_requests(slaves)
+    target = user_options.target or slaves[0].port
+    print("{} read and {} write requests derived from {} templates".format(len(reads), len(writes), len(slaves)))
+    results = run_load(target, reads, writes, connections=user_options.connections,
+                       processes=user_options.processes, duration=user_options.duration, rate=user_options.rate,
+                       write_ratio=user_options.write_ratio, timeout=user_options.timeout, host=user_options.host,
+                       baudrate=user_options.baudrate, parity=user_options.parity)
+    print("{:>12} {:>10} {:>10} {:>10} {:>10} {:>10} {:>8}".format('requests/s', 'p50 (ms)', 'p99 (ms)',
+                                                                    'p999 (ms)', 'max (ms)', 'exceptions',
+                                                                    'timeouts'))
+    print("{requests_per_second:>12.0f} {p50_ms:>10.2f} {p99_ms:>10.2f} {p999_ms:>10.2f} {max_ms:>10.2f} "
+          "{exceptions:>10} {timeouts:>8}".format(**results))
+    if user_options.json is not None:
+        with open(user_options.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    try:
+        run_loadgen()
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,214 @@
+"""
+Performance metrics of the simulator: request service time per function code, update tick duration and the depth
+of pipelined request batches, kept in fixed-bucket histograms and exposed in the Prometheus text format.
+
+Metrics are disabled by default: ``registry`` is None and the instrumented code paths only test for it.
+``enable`` creates the registry and ``MetricsServer`` serves it on a local HTTP endpoint, e.g.::
+
+   python modbus_sim/modbus_sim.py --template templates/ --metrics-port 9502
+   curl http://localhost:9502/metrics
+
+.. note::
+   Histograms are updated without locks, from the server and update threads.  A scrape may see an observation
+   counted in a bucket before it is added to the sum.  Requests served by the pymodbus serial server are not
+   instrumented.
+
+"""
+
+import bisect
+import threading
+import BaseHTTPServer
+
+import headless
+
+_logger = headless.get_wrapping_logger(name=__name__, debug=True)
+
+# request service times from 10 microseconds to 1 second
+DURATION_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                    0.1, 0.25, 0.5, 1.0]
+# update ticks from 100 microseconds to 10 seconds
+UPDATE_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                  10.0]
+# pipelined requests executed per batch
+DEPTH_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+FUNCTION_NAMES = {
+    1: 'read_coils',
+    2: 'read_discrete_inputs',
+    3: 'read_holding_registers',
+    4: 'read_input_registers',
+    5: 'write_single_coil',
+    6: 'write_single_register',
+    7: 'read_exception_status',
+    8: 'diagnostics',
+    15: 'write_multiple_coils',
+    16: 'write_multiple_registers',
+    17: 'report_slave_id',
+    22: 'mask_write_register',
+    23: 'read_write_multiple_registers',
+    43: 'read_device_information',
+}
+
+registry = None
+
+
+class Histogram(object):
+    """
+    A histogram of observations in fixed buckets
+    """
+    __slots__ = ['bounds', 'counts', 'sum', 'count']
+
+    def __init__(self, bounds):
+        """
+        :param list bounds: the ascending upper bounds of the buckets, observations above the last are counted in
+            an overflow bucket
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Counts an observation
+
+        :param float value: the observed value
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def expose(self, name, labels=''):
+        """
+        Formats the histogram as Prometheus ``_bucket``, ``_sum`` and ``_count`` samples
+
+        :param str name: the metric name
+        :param str labels: label pairs to add to each sample e.g. 'function="read_coils"'
+        :rtype: list
+        """
+        separator = ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + ['+Inf'], self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(name, labels, separator, bound, cumulative))
+        suffix = '{{{}}}'.format(labels) if labels else ''
+        lines.append('{}_sum{} {!r}'.format(name, suffix, self.sum))
+        lines.append('{}_count{} {}'.format(name, suffix, cumulative))
+        return lines
+
+
+class Registry(object):
+    """
+    The simulator's metrics
+    """
+    def __init__(self):
+        self.requests = {}
+        self.update = Histogram(UPDATE_BUCKETS)
+        self.depth = Histogram(DEPTH_BUCKETS)
+
+    def observe_request(self, function_code, seconds):
+        """
+        Records the service time of a request
+
+        :param int function_code: the Modbus function code of the request
+        :param float seconds: the time taken to execute the request and encode its response
+        """
+        histogram = self.requests.get(function_code, None)
+        if histogram is None:
+            histogram = self.requests.setdefault(function_code, Histogram(DURATION_BUCKETS))
+        histogram.observe(seconds)
+
+    def observe_update(self, seconds):
+        """
+        Records the duration of an update tick
+
+        :param float seconds: the time taken by ``update_values``
+        """
+        self.update.observe(seconds)
+
+    def observe_depth(self, requests):
+        """
+        Records the number of pipelined requests executed in one batch
+
+        :param int requests: the number of requests in the batch
+        """
+        self.depth.observe(requests)
+
+    def expose(self):
+        """
+        Returns the metrics in the Prometheus text format
+
+        :rtype: str
+        """
+        lines = ['# HELP modbus_request_duration_seconds Time to execute a request and encode its response.',
+                 '# TYPE modbus_request_duration_seconds histogram']
+        for function_code in sorted(self.requests):
+            labels = 'function="{}",code="{}"'.format(
+                FUNCTION_NAMES.get(function_code, 'function_{}'.format(function_code)), function_code)
+            lines.extend(self.requests[function_code].expose('modbus_request_duration_seconds', labels))
+        lines.extend(['# HELP modbus_update_duration_seconds Time taken by each update of the register values.',
+                      '# TYPE modbus_update_duration_seconds histogram'])
+        lines.extend(self.update.expose('modbus_update_duration_seconds'))
+        lines.extend(['# HELP modbus_request_queue_depth Pipelined requests executed per batch on a connection.',
+                      '# TYPE modbus_request_queue_depth histogram'])
+        lines.extend(self.depth.expose('modbus_request_queue_depth'))
+        return '\n'.join(lines) + '\n'
+
+
+def enable():
+    """
+    Enables metrics collection
+
+    :return: the metrics registry
+    :rtype: Registry
+    """
+    global registry
+    if registry is None:
+        registry = Registry()
+    return registry
+
+
+def disable():
+    """Disables metrics collection"""
+    global registry
+    registry = None
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the metrics registry on ``/metrics``"""
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = registry.expose() if registry is not None else ''
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _logger.debug("Metrics request from {}: {}".format(self.client_address[0], format % args))
+
+
+class MetricsServer(threading.Thread):
+    """
+    A daemon thread serving the metrics over HTTP
+    """
+    def __init__(self, address=('localhost', 9502)):
+        """
+        :param tuple address: the (host, port) to listen on
+        """
+        super(MetricsServer, self).__init__(name='metrics_server')
+        self.daemon = True
+        self.httpd = BaseHTTPServer.HTTPServer(address, _MetricsHandler)
+        _logger.info("Serving metrics on http://{}:{}/metrics".format(*self.httpd.server_address))
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        """Stops serving"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
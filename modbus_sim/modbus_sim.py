@@ -40,6 +40,17 @@ Use ``;`` to separate metadata tags.
    * ``paramId=<number>`` a uniqe parameter ID
    * ``name=<string>``
    * ``default=<value>`` the default value to configure in the register(s)
+   * ``scan=<seconds>`` (optional) the update interval of the register's scan class e.g. 0.1 for a fast analog
+     point, 0 for a static point that is never updated (default the simulator's update interval)
+   * ``waveform=<type>`` (optional) generates the value on each update instead of incrementing or toggling it,
+     one of **sine**, **ramp**, **square**, **walk** (random walk), **noise** (Gaussian) or **step**, with:
+
+      * ``period=<seconds>`` the period of the wave, or the duration of each step (default 60)
+      * ``amplitude=<value>`` the peak deviation from the offset (default 1)
+      * ``offset=<value>`` the center value (default the register's default value)
+      * ``phase=<fraction>`` the phase as a fraction of the period (default 0)
+      * ``sigma=<value>`` the standard deviation of the noise or of each step of a random walk (default 1)
+      * ``steps=<value>|<value>|...`` the values of a step sequence
 
 * ``paramId=<number>;deviceId=<number>;registerType=<reg>;address=<number>;encoding=<enc>[;length=<number>]`` where:
 
@@ -55,10 +66,10 @@ Use ``;`` to separate metadata tags.
    * **address** is the Modbus or PLC address
    * **encoding** is one of:
 
-      * **int8**, **int16**, **int32**, **uint8**, **uint16**, **uint32**
-      * **float32**
+      * **int8**, **int16**, **int32**, **int64**, **uint8**, **uint16**, **uint32**, **uint64**
+      * **float32**, **float64**
       * **boolean**
-      * **string**
+      * **string** or **ascii**
 
    * **length** is required for **string** encodings to specify how many registers are used
 
@@ -68,14 +79,27 @@ __version__ = "0.1.0"
 
 import sys
 import os
+import signal
 import argparse
 import serial
 import glob
+import math
+import stat
 
 import headless
-from headless import RepeatingTimer
 from simulators import sim_weather_lufft
+import template_cache
+import waveforms
+import codec
+import heatmap
+import metrics
+from datastore import ArrayDataBlock, BitDataBlock, SegmentedDataBlock, RegisterBank, install_response_encoder
+from engine import UpdateEngine
+from eventloop import EventLoopServer
+from pipeline import PipelinedServerFactory, PipelinedUdpProtocol
+from scheduler import Scheduler
 import threading
+import time
 
 from pymodbus import __version__ as pymodbus_version
 from pymodbus.server.async import StartTcpServer
@@ -83,18 +107,18 @@ from pymodbus.server.async import StartUdpServer
 from pymodbus.server.async import StartSerialServer
 
 from pymodbus.device import ModbusDeviceIdentification
-from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSparseDataBlock
 from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
 from pymodbus.transaction import ModbusRtuFramer, ModbusAsciiFramer, ModbusSocketFramer
 
 from pymodbus.constants import Endian
-from pymodbus.payload import BinaryPayloadBuilder
-from pymodbus.payload import BinaryPayloadDecoder
 
 import httplib
 
 PORT_DEFAULT = 'tcp:502'
 
+# Serial port names, discovered on first use by SerialPort.list_serial_ports
+_serial_ports = None
+
 active = True
 
 # --------------------------------------------------------------------------- #
@@ -118,7 +142,11 @@ WRITE_MULTI_HR = 0x10
 READ_EXCEPTION_STATUS = 0x07
 READ_DIAGNOSTICS = 0x08
 
-REGISTER_ENCODING_TYPES = ['uint8', 'int8', 'uint16', 'int16', 'boolean', 'float32', 'ascii']
+# Unused addresses between template registers that are allocated anyway to keep runs contiguous (non-sparse)
+SEGMENT_GAP = 32
+
+REGISTER_ENCODING_TYPES = ['uint8', 'int8', 'uint16', 'int16', 'boolean', 'float32', 'ascii',
+                           'int32', 'uint32', 'int64', 'uint64', 'float64', 'string']
 
 # --------------------------------------------------------------------------- #
 # File parser configuration
@@ -130,6 +158,19 @@ TEMPLATE_PARSER_NETWORK = "deviceId"
 TEMPLATE_PARSER_REG_DESC = "/*REGISTER"
 TEMPLATE_PARSER_REG = "paramId"
 TEMPLATE_PARSER_SEPARATOR = ";"
+TEMPLATE_REGISTER_TYPES = {'analog': 'ir', 'holding': 'hr', 'input': 'di', 'coil': 'co'}
+
+# --------------------------------------------------------------------------- #
+# Compiled template configuration
+# --------------------------------------------------------------------------- #
+COMPILED_IDENTITY_FIELDS = ['VendorName', 'ProductCode', 'VendorUrl', 'ProductName', 'ModelName',
+                            'MajorMinorRevision']
+COMPILED_REGISTER_FIELDS = ['paramId', 'address', 'length', 'name', 'reg_type', 'encoding', 'default', 'min', 'max',
+                            'byteorder', 'wordorder', 'scan', 'waveform']
+# the update interval of registers without a scan class, in seconds
+UPDATE_INTERVAL = 10
+# the seconds before refreshing a simulator again after its ``apply`` raised
+SIMULATOR_RETRY_INTERVAL = 5.0
 
 DEFAULT_TEMPLATE = "/**DEVICE_DESC;VendorName=PyModbus;ProductCode=PM;VendorUrl=http://github.com/bashwork/pymodbus;" \
                    "ProductName=PyModbus;ModelName=AsyncServer;MajorMinorRevision=1.0.0;sparse\n" \
@@ -273,9 +314,18 @@ def get_simulator(vendor, model):
     the list ['hr', 'ir', 'di', 'co]:
 
        * ``run`` a function that executes simulation
+       * ``fetch`` (optional) a function fetching the input of one step of the simulation e.g. from a web API,
+         taking ``run_params``.  It may block, so each fetch runs on a short-lived thread instead of the scheduler.
+       * ``apply`` (with ``fetch``) a function applying the fetched input (None if the fetch raised), taking the
+         input and ``run_params`` and returning the seconds until the next fetch.  It runs on the shared scheduler,
+         so the simulation needs no thread of its own between fetches.
        * ``run_params`` optional kwargs passed into the run function
        * ``read`` a function to read a raw Modbus register based on register_type and address
        * ``write`` a function to write a raw Modbus register based on register_type and address
+       * ``image`` (optional) a function returning every raw register value by (register_type, address), read in
+         place of ``read`` for each register when the whole register map is updated
+       * ``changes`` (optional) a ``simulators.feed.ChangeFeed`` publishing each register value the simulator
+         changes, so that ``update_values`` applies only the changes instead of reading every register
 
     :param vendor:
     :param model:
@@ -286,11 +336,15 @@ def get_simulator(vendor, model):
         sim = {
             'module': sim_weather_lufft,
             'run': sim_weather_lufft.simulate,
+            'fetch': sim_weather_lufft.simulation.fetch,
+            'apply': sim_weather_lufft.simulation.apply,
             'run_params': {
                 'log': log
             },
             'read': sim_weather_lufft.read_register,
-            'write': sim_weather_lufft.write_register
+            'write': sim_weather_lufft.write_register,
+            'image': sim_weather_lufft.read_image,
+            'changes': sim_weather_lufft.changes
         }
     return sim
 
@@ -313,29 +367,64 @@ class Slave(object):
         self.parity = 'none'
         self.stopbits = 1
         self.mode = user_options.mode
+        # the port and mode set by the template itself, None if taken from the command line
+        self.template_port = None
+        self.template_mode = None
         self.slave_id = None
         self.zero_mode = True
         self.registers = []
+        self.param_index = {}
         self.devices = []
         self.context = None
+        self.bank = None
         self.sparse = False
         self.byteorder = Endian.Big
         self.wordorder = Endian.Big
         self.simulator = None
-        self._parse_template()
+        self.subscription = None
+        self.address_index = {}
+        self.scan_index = None
+        self.default_scan = None
+        self.engines = {}
+        self.cache_dir = getattr(user_options, 'cache_dir', template_cache.DEFAULT_CACHE_DIR)
+        compiled = None
+        if self.template != 'DEFAULT':
+            compiled = template_cache.load(self.template, cache_dir=self.cache_dir)
+        if compiled is not None:
+            log.info("Using compiled template from cache")
+            self._load_compiled(compiled)
+        else:
+            self._parse_template()
+            if self.template != 'DEFAULT':
+                template_cache.save(self.template, self.compile(), cache_dir=self.cache_dir)
 
-    def _parse_template(self):
-        """Parsing rules from template file to create Slave device"""
+    def _template_lines(self):
+        """Yields the template one line at a time without reading a file template into memory"""
         if self.template == 'DEFAULT':
-            template = DEFAULT_TEMPLATE
-            lines = template.splitlines()
+            for line in DEFAULT_TEMPLATE.splitlines():
+                yield line
         else:
             if valid_path(self.template):
                 with open(self.template) as f:
-                    lines = f.readlines()
+                    for line in f:
+                        yield line
             else:
                 raise ImportError("File name {filename} not found.".format(filename=self.template))
-        for line in lines:
+
+    def _index_register(self, reg):
+        """Adds a register to the list of registers and the paramId index"""
+        self.registers.append(reg)
+        if reg.paramId is not None:
+            self.param_index[reg.paramId] = reg
+
+    def _parse_template(self):
+        """
+        Parsing rules from template file to create Slave device.
+
+        The template is read in a single pass, with each register line resolved against the paramId index
+        built up from the preceding lines so that parse time grows linearly with the template size.
+        """
+        for line in self._template_lines():
             if line[0:len(TEMPLATE_PARSER_DESC)] == TEMPLATE_PARSER_DESC:
                 modbus_id = line.replace("/**", "").replace("/*", "").replace("*/", "").split(TEMPLATE_PARSER_SEPARATOR)
                 for i in modbus_id:
@@ -362,7 +451,7 @@ class Slave(object):
                 for i in net_info:
                     if i[0:len('networkId')] == 'networkId':
                         net_id = int(i[len('networkId')+1:].strip())
-                        if net_id in range(1, 254):
+                        if 1 <= net_id < 254:
                             self.slave_id = int(i[len('networkId')+1:])
                         else:
                             log.error("Invalid Modbus Slave ID {id}".format(id=net_id))
@@ -381,11 +470,12 @@ class Slave(object):
                     if i[0:len('port')] == 'port':
                         port = i[len('port')+1:].strip()
                         log.info("port={port}".format(port=port))
+                        self.template_port = port
                         if 'tcp' in port or 'udp' in port:
                             if port != self.port:
                                 log.warning("Port mismatch: CLI={} but {}={}".format(self.port, self.template, port))
                             self.port = port
-                        elif port in SerialPort.list_serial_ports():
+                        elif SerialPort.is_serial_port(port):
                             self.port = port
                             self.ser = SerialPort(name=port)
                         else:
@@ -393,6 +483,7 @@ class Slave(object):
                                                    .format(port, template=self.template))
                     elif i[0:len('mode')] == 'mode':
                         self.mode = i[len('mode')+1:].strip()
+                        self.template_mode = self.mode
                         log.info("mode={mode}".format(mode=self.mode))
                         if self.mode not in ['rtu', 'ascii', 'tcp']:
                             log.error("Undefined mode parsed from {template}".format(template=self.template))
@@ -449,7 +540,7 @@ class Slave(object):
                         reg.paramId = int(i[len('paramId')+1:].strip())
                     elif i[0:len('address')].lower() == 'address':
                         addr = int(i[len('address') + 1:].strip())
-                        if addr in range(0, 99999):
+                        if 0 <= addr < 99999:
                             reg.address = addr
                         else:
                             log.error("Invalid Modbus address {num}".format(num=addr))
@@ -461,148 +552,258 @@ class Slave(object):
                         reg.max = i[len('max') + 1:].strip()
                     elif i[0:len('default')].lower() == 'default':
                         reg.default = i[len('default') + 1:].strip()
-                self.registers.append(reg)
+                    elif i[0:len('scan')].lower() == 'scan':
+                        text = i[len('scan') + 1:].strip()
+                        scan = _parse_float(text)
+                        if scan is not None and scan >= 0:
+                            reg.scan = scan
+                        else:
+                            log.error("Invalid scan interval {scan} for {name}".format(scan=text, name=reg.name))
+                    elif i[0:len('waveform')].lower() == 'waveform':
+                        waveform = i[len('waveform') + 1:].strip().lower()
+                        if waveform in waveforms.WAVEFORMS:
+                            reg.waveform = dict(reg.waveform or {}, type=waveform)
+                        else:
+                            log.error("Unsupported waveform {type} for {name}".format(type=waveform, name=reg.name))
+                    elif i[0:len('steps')].lower() == 'steps':
+                        text = i[len('steps') + 1:].strip()
+                        steps = [_parse_float(v) for v in text.split('|')]
+                        if all(_finite(v) for v in steps):
+                            reg.waveform = dict(reg.waveform or {}, steps=steps)
+                        else:
+                            log.error("Invalid waveform steps {steps} for {name}".format(steps=text, name=reg.name))
+                    elif i.split('=')[0].strip().lower() in waveforms.PARAMETERS:
+                        parameter, text = i.split('=', 1)
+                        value = _parse_float(text)
+                        if _finite(value):
+                            reg.waveform = dict(reg.waveform or {})
+                            reg.waveform[parameter.strip().lower()] = value
+                        else:
+                            log.error("Invalid waveform {parameter} {value} for {name}"
+                                      .format(parameter=parameter.strip().lower(), value=text.strip(), name=reg.name))
+                self._index_register(reg)
 
             elif line[0:len(TEMPLATE_PARSER_REG)] == TEMPLATE_PARSER_REG:
-                # TODO: assign to proper objects, sort/group addresses by reg_type and min/max
+                # TODO: sort/group addresses by reg_type and min/max
                 reg_config = line.replace("/**", "").replace("/*", "").replace("*/", "").split(TEMPLATE_PARSER_SEPARATOR)
-                reg_exists = False
                 this_reg = None
                 for c in reg_config:
                     if c[0:len('paramId')] == 'paramId':
                         paramId = int(c[len('paramId')+1:].strip())
-                        for reg in self.registers:
-                            if paramId == reg.paramId:
-                                reg_exists = True
-                        if not reg_exists:
-                            reg = self.Register(context=self.context, paramId=paramId)
-                            self.registers.append(reg)
-                            reg_exists = True
-                        this_reg = paramId
+                        this_reg = self.param_index.get(paramId, None)
+                        if this_reg is None:
+                            this_reg = self.Register(context=self.context, paramId=paramId)
+                            self._index_register(this_reg)
                     elif c[0:len('address')] == 'address':
                         addr = int(c[len('address')+1:].strip())
-                        if addr in range(0, 99999):
-                            for reg in self.registers:
-                                if reg.paramId == this_reg:
-                                    reg.address = addr
-                            if not reg_exists:
-                                reg = self.Register(context=self.context, address=addr)
-                                self.registers.append(reg)
-                                reg_exists = True
+                        if 0 <= addr < 99999:
+                            if this_reg is not None:
+                                this_reg.address = addr
+                            else:
+                                this_reg = self.Register(context=self.context, address=addr)
+                                self._index_register(this_reg)
                         else:
                             log.error("Invalid Modbus address {num}".format(num=addr))
                     elif c[0:len('registerType')] == 'registerType':
                         reg_type = c[len('registerType')+1:].strip()
-                        if reg_type in ['analog']:
-                            for reg in self.registers:
-                                if reg.paramId == this_reg:
-                                    reg.reg_type = 'ir'
-                        elif reg_type in ['holding']:
-                            for reg in self.registers:
-                                if reg.paramId == this_reg:
-                                    reg.reg_type = 'hr'
-                        elif reg_type in ['input']:
-                            for reg in self.registers:
-                                if reg.paramId == this_reg:
-                                    reg.reg_type = 'di'
-                        elif reg_type in ['coil']:
-                            for reg in self.registers:
-                                if reg.paramId == this_reg:
-                                    reg.reg_type = 'co'
+                        if reg_type in TEMPLATE_REGISTER_TYPES:
+                            if this_reg is not None:
+                                this_reg.reg_type = TEMPLATE_REGISTER_TYPES[reg_type]
                         else:
                             log.error("Unsupported registerType {type}".format(type=reg_type))
                     elif c[0:len('encoding')] == 'encoding':
                         enc = c[len('encoding')+1:].strip()
-                        if enc in ['int16', 'int8', 'boolean']:
-                            for reg in self.registers:
-                                if reg.paramId == this_reg:
-                                    reg.encoding = enc
-                                    reg.default = int(reg.default)
-                                    reg.min = int(reg.min) if reg.min is not None else None
-                                    reg.max = int(reg.max) if reg.max is not None else None
-                        elif enc in ['float32', 'int32']:
-                            for reg in self.registers:
-                                if reg.paramId == this_reg:
-                                    reg.encoding = enc
-                                    reg.length = 2
-                                    reg.default = float(reg.default) if enc == 'float32' else int(reg.default)
-                                    if reg.min is not None:
-                                        reg.min = float(reg.min) if enc == 'float32' else int(reg.min)
-                                    if reg.max is not None:
-                                        reg.max = float(reg.max) if enc == 'float32' else int(reg.max)
+                        if enc in REGISTER_ENCODING_TYPES:
+                            if this_reg is not None:
+                                this_reg.encoding = enc
+                                if enc in codec.STRING_ENCODINGS:
+                                    cast = str
+                                else:
+                                    this_reg.length = codec.register_count(enc)
+                                    cast = float if 'float' in enc else int
+                                this_reg.default = cast(this_reg.default)
+                                this_reg.min = cast(this_reg.min) if this_reg.min is not None else None
+                                this_reg.max = cast(this_reg.max) if this_reg.max is not None else None
                         else:
                             log.error("Unsupported encoding {type}".format(type=enc))
-        hr_sequential = []
-        hr_sparse_block = {}
-        ir_sequential = []
-        ir_sparse_block = {}
-        di_sequential = []
-        di_sparse_block = {}
-        co_sequential = []
-        co_sparse_block = {}
+                    elif c[0:len('length')] == 'length':
+                        length = int(c[len('length')+1:].strip())
+                        if this_reg is not None:
+                            this_reg.length = length
         for reg in self.registers:
             if reg.min is None:
                 reg.min = reg.get_range()[0]
             if reg.max is None:
                 reg.max = reg.get_range()[1]
             reg.default = reg.get_default()
-            if reg.reg_type == 'hr' and reg.address is not None:
-                if self.sparse:
-                    hr_sparse_block[reg.address] = 0
-                else:
-                    hr_sequential.append(reg.address)
-            elif reg.reg_type == 'ir' and reg.address is not None:
-                if self.sparse:
-                    ir_sparse_block[reg.address] = 0
-                else:
-                    ir_sequential.append(reg.address)
-            elif reg.reg_type == 'di' and reg.address is not None:
-                if self.sparse:
-                    di_sparse_block[reg.address] = 0
-                else:
-                    di_sequential.append(reg.address)
-            elif reg.reg_type == 'co' and reg.address is not None:
-                if self.sparse:
-                    co_sparse_block[reg.address] = 0
-                else:
-                    co_sequential.append(reg.address)
+            if reg.waveform is not None:
+                if 'type' not in reg.waveform:
+                    log.error("Waveform parameters without a waveform for {name}".format(name=reg.name))
+                    reg.waveform = None
+                elif reg.waveform.get('period', 1) <= 0:
+                    log.error("Invalid waveform period for {name}".format(name=reg.name))
+                    reg.waveform = None
+                elif reg.waveform['type'] == 'step' and 'steps' not in reg.waveform:
+                    log.error("Step waveform without steps for {name}".format(name=reg.name))
+                    reg.waveform = None
+        self._build_context()
+        # initialize default values
+        self.set_values((reg, reg.default) for reg in self.registers)
+
+    def _build_context(self):
+        """
+        Creates the slave context with segmented data blocks allocating only the address runs used by the registers
+        """
+        # with PLC base address 1 the slave context offsets every address by one
+        offset = 0 if self.zero_mode else 1
+        extents = dict((reg_type, []) for reg_type in REGISTER_TYPES)
+        for reg in self.registers:
+            if reg.reg_type in REGISTER_TYPES and reg.address is not None:
+                extents[reg.reg_type].append((reg.address + offset, reg.length))
             else:
                 log.error("Unhandled exception register {reg} addr={addr}".format(reg=reg.name, addr=str(reg.address)))
-        if self.sparse:
-            hr_block = ModbusSparseDataBlock(hr_sparse_block) if len(hr_sparse_block) > 0 else None
-            ir_block = ModbusSparseDataBlock(ir_sparse_block) if len(ir_sparse_block) > 0 else None
-            di_block = ModbusSparseDataBlock(di_sparse_block) if len(di_sparse_block) > 0 else None
-            co_block = ModbusSparseDataBlock(co_sparse_block) if len(co_sparse_block) > 0 else None
-        else:
-            if len(hr_sequential) > 0:
-                hr_sequential.sort()
-                hr_block = ModbusSequentialDataBlock(0, [0 for x in range(hr_sequential[0],
-                                                                          hr_sequential[len(hr_sequential)-1])])
-            else:
-                hr_block = None
-            if len(ir_sequential) > 0:
-                ir_sequential.sort()
-                ir_block = ModbusSequentialDataBlock(0, [0 for x in range(ir_sequential[0],
-                                                                          ir_sequential[len(ir_sequential)-1])])
-            else:
-                ir_block = None
-            if len(di_sequential) > 0:
-                di_sequential.sort()
-                di_block = ModbusSequentialDataBlock(0, [0 for x in range(di_sequential[0],
-                                                                          di_sequential[len(di_sequential)-1])])
-            else:
-                di_block = None
-            if len(co_sequential) > 0:
-                co_sequential.sort()
-                co_block = ModbusSequentialDataBlock(0, [0 for x in range(co_sequential[0],
-                                                                          co_sequential[len(co_sequential)-1])])
-            else:
-                co_block = None
+        hr_block = SegmentedDataBlock(extents['hr'], ArrayDataBlock, sparse=self.sparse, gap=SEGMENT_GAP)
+        ir_block = SegmentedDataBlock(extents['ir'], ArrayDataBlock, sparse=self.sparse, gap=SEGMENT_GAP)
+        di_block = SegmentedDataBlock(extents['di'], _bit_block, sparse=self.sparse, gap=SEGMENT_GAP)
+        co_block = SegmentedDataBlock(extents['co'], _bit_block, sparse=self.sparse, gap=SEGMENT_GAP)
         self.context = ModbusSlaveContext(hr=hr_block, ir=ir_block, di=di_block, co=co_block, zero_mode=self.zero_mode)
-        # initialize default values
+        self.bank = RegisterBank(self.context)
         for reg in self.registers:
             reg.context = self.context
-            reg.set_value(reg.default)
+
+    def set_values(self, values, context=None):
+        """
+        Sets the values of many registers, merging registers at adjacent addresses into contiguous runs
+        that are each written to the slave context with a single ``setValues`` call.
+
+        :param values: an iterable of (Register, value) tuples
+        :param pymodbus.ModbusSlaveContext context: the context to write e.g. the staging context of
+            the slave's ``RegisterBank``, by default the slave's context
+        """
+        if context is None:
+            context = self.context
+        writes = {}
+        for reg, value in values:
+            words = reg.encode(value)
+            if words is not None:
+                writes.setdefault(reg.get_function_code(), []).append((reg.address, words, reg, value))
+        for function_code, pending in writes.items():
+            pending.sort(key=lambda write: write[0])
+            run_address = None
+            run_words = []
+            for address, words, reg, value in pending:
+                if run_address is not None and address != run_address + len(run_words):
+                    context.setValues(function_code, run_address, run_words)
+                    run_address = None
+                if run_address is None:
+                    run_address = address
+                    run_words = []
+                run_words.extend(words)
+            if run_address is not None:
+                context.setValues(function_code, run_address, run_words)
+            for address, words, reg, value in pending:
+                reg.value = value
+
+    def index_scan_classes(self, default=UPDATE_INTERVAL):
+        """
+        Groups the registers into scan classes by their ``scan`` interval, updated by ``update_values`` on their own
+        cadence.  Registers with a scan interval of 0 are static and never updated.
+
+        :param float default: the scan interval of registers without one, in seconds
+        :return: the scan intervals to update the slave at, in seconds
+        :rtype: list
+        """
+        self.default_scan = default
+        self.scan_index = {}
+        self.engines = {}
+        for reg in self.registers:
+            interval = reg.scan if reg.scan is not None else default
+            if interval > 0:
+                self.scan_index.setdefault(interval, []).append(reg)
+        if self.simulator is not None:
+            # simulated values are applied at the default interval
+            return [default]
+        return sorted(self.scan_index)
+
+    def compile(self):
+        """
+        Returns the compiled form of the parsed template for the template cache, including the default
+        register image so that a cached load does not need to re-encode any values.
+        Only the port and mode set by the template are stored, so a cached load still honors the command line.
+
+        :rtype: dict
+        """
+        identity = {}
+        for field in COMPILED_IDENTITY_FIELDS:
+            identity[field] = getattr(self.identity, field)
+        serial_settings = None
+        if self.ser is not None:
+            serial_settings = {
+                'name': self.ser.name,
+                'baudrate': self.ser.baudrate,
+                'bytesize': self.ser.bytesize,
+                'parity': self.ser.parity,
+                'stopbits': self.ser.stopbits,
+            }
+        registers = []
+        image = []
+        for reg in self.registers:
+            registers.append(tuple(getattr(reg, field) for field in COMPILED_REGISTER_FIELDS))
+            if reg.context is not None and reg.reg_type in REGISTER_TYPES and reg.address is not None:
+                image.append(list(reg.context.getValues(reg.get_function_code(), reg.address, reg.length)))
+            else:
+                image.append(None)
+        return {
+            'identity': identity,
+            'port': self.template_port,
+            'mode': self.template_mode,
+            'serial': serial_settings,
+            'slave_id': self.slave_id,
+            'zero_mode': self.zero_mode,
+            'sparse': self.sparse,
+            'byteorder': self.byteorder,
+            'wordorder': self.wordorder,
+            'registers': registers,
+            'image': image,
+        }
+
+    def _load_compiled(self, compiled):
+        """
+        Restores the Slave from a compiled template, writing the pre-encoded default register image directly
+
+        :param dict compiled: the compiled template returned by ``compile``
+        """
+        for field in COMPILED_IDENTITY_FIELDS:
+            setattr(self.identity, field, compiled['identity'][field])
+        self.simulator = get_simulator(self.identity.VendorName, self.identity.ModelName)
+        port = compiled['port']
+        if port is not None:
+            if ('tcp' in port or 'udp' in port) and port != self.port:
+                log.warning("Port mismatch: CLI={} but {}={}".format(self.port, self.template, port))
+            self.port = port
+            self.template_port = port
+        if compiled['mode'] is not None:
+            self.mode = compiled['mode']
+            self.template_mode = self.mode
+        if compiled['serial'] is not None:
+            # the serial settings apply to the port in use, which may come from the command line
+            self.ser = SerialPort(name=self.port)
+            for setting, value in compiled['serial'].items():
+                if setting != 'name':
+                    setattr(self.ser, setting, value)
+        self.slave_id = compiled['slave_id']
+        self.zero_mode = compiled['zero_mode']
+        self.sparse = compiled['sparse']
+        self.byteorder = compiled['byteorder']
+        self.wordorder = compiled['wordorder']
+        for fields in compiled['registers']:
+            reg = self.Register(context=None, **dict(zip(COMPILED_REGISTER_FIELDS, fields)))
+            self._index_register(reg)
+        self._build_context()
+        for reg, payload in zip(self.registers, compiled['image']):
+            if payload is not None:
+                self.context.setValues(reg.get_function_code(), reg.address, payload)
+                reg.value = reg.default
 
     class Register(object):
         """
@@ -612,7 +813,8 @@ class Slave(object):
            docstring
         """
         def __init__(self, context, paramId=None, address=None, length=1, name=None, reg_type=None, encoding=None,
-                     default=0, min=None, max=None, byteorder=Endian.Big, wordorder=Endian.Big):
+                     default=0, min=None, max=None, byteorder=Endian.Big, wordorder=Endian.Big, scan=None,
+                     waveform=None):
             """
             Initializes a new Register object
 
@@ -628,7 +830,12 @@ class Slave(object):
             :param max: the maximum valid value
             :param byteorder: the byte order from [Endian.Big, Endian.Little]
             :param wordorder: the word order from [Endian.Big, Endian.Little]
+            :param float scan: the update interval of the register's scan class in seconds, 0 if static, or None
+                for the default
+            :param dict waveform: (optional) the waveform generating the register's values, with its ``type`` and
+                parameters (see ``waveforms``)
             """
+            self._codec = None
             self.context = context
             self.paramId = paramId
             self.address = address
@@ -641,6 +848,8 @@ class Slave(object):
             self.max = max if max is not None else self.get_range()[1]
             self.byteorder = byteorder
             self.wordorder = wordorder
+            self.scan = scan
+            self.waveform = waveform
             self.value = None
 
         def get_range(self):
@@ -693,72 +902,142 @@ class Slave(object):
                 else:
                     raise EnvironmentError("Illegal operation cannot write to {type}".format(type=self.reg_type))
 
+        @property
+        def reg_type(self):
+            """The register type from ['hr', 'ir', 'di', 'co']"""
+            return self._reg_type
+
+        @reg_type.setter
+        def reg_type(self, reg_type):
+            self._reg_type = reg_type
+            self._codec = None
+
+        @property
+        def encoding(self):
+            """The data encoding e.g. 'uint16'"""
+            return self._encoding
+
+        @encoding.setter
+        def encoding(self, encoding):
+            self._encoding = encoding
+            self._codec = None
+
+        @property
+        def byteorder(self):
+            """The byte order from [Endian.Big, Endian.Little]"""
+            return self._byteorder
+
+        @byteorder.setter
+        def byteorder(self, byteorder):
+            self._byteorder = byteorder
+            self._codec = None
+
+        @property
+        def wordorder(self):
+            """The word order from [Endian.Big, Endian.Little]"""
+            return self._wordorder
+
+        @wordorder.setter
+        def wordorder(self, wordorder):
+            self._wordorder = wordorder
+            self._codec = None
+
+        @property
+        def length(self):
+            """The number of registers used by the value"""
+            return self._length
+
+        @length.setter
+        def length(self, length):
+            self._length = length
+            self._codec = None
+
+        @property
+        def codec(self):
+            """
+            The codec for the register's encoding, byte order and word order, resolved once and cached until
+            any of those attributes change.  Discrete inputs and coils use a bit codec.
+
+            :rtype: codec.RegisterCodec or codec.BitCodec
+            :raises ValueError: if the encoding is not supported
+            """
+            if self._codec is None and self._reg_type in ['di', 'co']:
+                self._codec = codec.get_bit_codec(self._encoding, length=self._length)
+            elif self._codec is None:
+                self._codec = codec.get_codec(self._encoding, byteorder=self._byteorder, wordorder=self._wordorder,
+                                              length=self._length)
+            return self._codec
+
         def get_value(self):
             """
             :return: the value of the register
             """
-            values = self.context.getValues(self.get_function_code(), self.address, self.length)
-            decoder = BinaryPayloadDecoder.fromRegisters(registers=values,
-                                                         byteorder=self.byteorder, wordorder=self.wordorder)
-            if self.encoding in ['int8', 'uint8', 'boolean']:
-                decoded = decoder.decode_8bit_int() if self.encoding == 'int8' else decoder.decode_8bit_uint()
-            elif self.encoding in ['int16', 'uint16']:
-                decoded = decoder.decode_16bit_int() if self.encoding == 'int16' else decoder.decode_16bit_uint()
-            elif self.encoding in ['int32', 'uint32']:
-                decoded = decoder.decode_32bit_int() if self.encoding == 'int32' else decoder.decode_32bit_uint()
-            elif self.encoding in ['float32', 'float64']:
-                decoded = decoder.decode_32bit_float() if self.encoding == 'float32' else decoder.decode_64bit_float()
-            elif self.encoding in ['int64', 'uint64']:
-                decoded = decoder.decode_64bit_int() if self.encoding == 'int64' else decoder.decode_64bit_uint()
-            # Not using bits for boolean due to padding by codec operation
-            elif self.encoding == 'bits':
-                decoded = decoder.decode_bits()
-            elif self.encoding in ['string', 'ascii']:
-                decoded = decoder.decode_string()
-            else:
+            try:
+                reg_codec = self._codec or self.codec
+            except ValueError:
                 log.error("Unhandled encoding exception {enc}".format(enc=self.encoding))
-                decoded = None
-            # log.debug("Read {reg_type} {addr} as {enc} {val} from {list}".format(reg_type=self.reg_type, addr=self.address,
-            #                                                                  enc=self.encoding, val=decoded,
-            #                                                                  list=str(values)))
+                self.value = None
+                return None
+            values = self.context.getValues(self.get_function_code(), self.address, reg_codec.length)
+            decoded = reg_codec.decode(values)
             self.value = decoded
             return decoded
 
-        def set_value(self, value):
+        def encode(self, value):
             """
-            Set the value of the register
+            Encodes a value into the words (or bits) to write to the register
 
-            :param value:
+            :param value: the value to encode
+            :return: the encoded values, or None if the value cannot be set
+            :rtype: list
             """
             if value is not None:
-                builder = BinaryPayloadBuilder(byteorder=self.byteorder, wordorder=self.wordorder)
-                if self.encoding in ['int8', 'uint8', 'boolean']:
-                    builder.add_8bit_int(value) if self.encoding == 'int8' else builder.add_8bit_uint(value)
-                elif self.encoding in ['int16', 'uint16']:
-                    builder.add_16bit_int(value) if self.encoding == 'int16' else builder.add_16bit_uint(value)
-                elif self.encoding in ['int32', 'uint32']:
-                    builder.add_32bit_int(value) if self.encoding == 'int32' else builder.add_32bit_uint(value)
-                elif self.encoding in ['float32', 'float64']:
-                    builder.add_32bit_float(value) if self.encoding == 'float32' else builder.add_64bit_float(value)
-                elif self.encoding in ['int64', 'uint64']:
-                    builder.add_64bit_int(value) if self.encoding == 'int64' else builder.add_64bit_uint(value)
-                # Not using bits for boolean due to padding by codec operation
-                elif self.encoding == 'bits':
-                    builder.add_bits([value])
-                elif self.encoding in ['string', 'ascii']:
-                    builder.add_string(value)
-                else:
+                try:
+                    reg_codec = self._codec or self.codec
+                except ValueError:
                     log.error("Unhandled encoding exception {enc}".format(enc=self.encoding))
-                payload = builder.to_registers()
-                # log.debug("Setting {reg_type} {addr} to {enc} {val} as {list}".format(reg_type=self.reg_type, addr=self.address,
-                #                                                                   enc=self.encoding, val=value,
-                #                                                                   list=str(payload)))
-                self.context.setValues(self.get_function_code(), self.address, payload)
-                self.value = value
+                    return None
+                return reg_codec.encode(value)
             else:
                 log.warning("Attempt to set {type} {addr} to None (default={default})".format(type=self.reg_type,
                                                                                               addr=self.address,
                                                                                               default=self.default))
+                return None
+
+        def set_value(self, value):
+            """
+            Set the value of the register
+
+            :param value:
+            """
+            words = self.encode(value)
+            if words is not None:
+                self.context.setValues(self.get_function_code(), self.address, words)
+                self.value = value
+
+
+def _bit_block(address, count):
+    """Returns a bit-packed data block for a run of discrete inputs or coils"""
+    return BitDataBlock(address, count)
+
+
+def _parse_float(text):
+    """
+    Parses a number of a template
+
+    :param str text: the text of the number
+    :return: the number, or None if the text is not a number
+    :rtype: float
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _finite(value):
+    """Returns True if a parsed number is neither None, infinite nor NaN"""
+    return value is not None and not math.isinf(value) and not math.isnan(value)
 
 
 def valid_path(filename):
@@ -786,10 +1065,18 @@ def valid_path(filename):
         return False
 
 
-def update_values(server_context, slaves):
+def update_values(server_context, slaves, scan=None):
     """
     Updates the configured register values in the Modbus context.
-    Increments or toggles values
+    Increments or toggles values, vectorized across the registers of a scan class by an ``UpdateEngine``,
+    or writes the changed values read from the slave's simulator with ``Slave.set_values``.
+    A simulator with an ``image`` is read in one call rather than once per register, and registers it does not
+    simulate are left as they are.  A simulator with a ``changes`` feed is read in full on the first tick only;
+    later ticks apply just the registers published to the slave's subscription since the previous tick, and stage
+    nothing when there are none.  Simulated values are applied with the slave's default scan class.
+    Each slave's update is written to the back buffer of its ``RegisterBank`` and only the ranges it wrote are
+    published, so requests never see a partly updated (e.g. multi-register) value and master writes to other
+    addresses are kept.
 
     .. todo::
 
@@ -797,29 +1084,147 @@ def update_values(server_context, slaves):
 
     :param pymodbus.ModbusServerContext server_context: (unused) a server context object
     :param Slave slaves: a list of ``Slave`` objects
+    :param float scan: (optional) the interval of the scan class to update, in seconds, by default every register
+        that is not static (see ``Slave.index_scan_classes``)
     """
     # context = server_context
+    start = time.time()
     for slave in slaves:
+        if slave.scan_index is None:
+            slave.index_scan_classes()
+        if slave.simulator is not None and scan is not None and scan != slave.default_scan:
+            continue
+        if slave.subscription is not None:
+            changes = []
+            for (reg_type, address), value in slave.subscription.drain().iteritems():
+                reg = slave.address_index.get((reg_type, address), None)
+                if reg is not None:
+                    changes.append((reg, value))
+            # nothing is staged or published for a tick without changes
+            if len(changes) > 0:
+                slave.set_values(changes, context=slave.bank.stage())
+                slave.bank.publish()
+            continue
         if slave.simulator is None:
-            for reg in slave.registers:
-                old_value = reg.get_value()
-                if reg.reg_type in ['hr', 'ir']:
-                    if reg.max is None or old_value < reg.max:
-                        new_value = old_value + 1
-                    else:
-                        new_value = reg.min
+            if scan is not None and scan not in slave.scan_index:
+                continue
+            engine = slave.engines.get(scan, None)
+            if engine is None:
+                if scan is not None:
+                    registers = slave.scan_index[scan]
                 else:
-                    new_value = 0 if old_value == 1 else 1
-                reg.set_value(new_value)
-                log.debug("Reg={} Name={} Old={} New={} Max={} Min={}"
-                          .format(reg.address, reg.name, old_value, new_value, reg.max, reg.min))
+                    registers = [reg for interval in sorted(slave.scan_index) for reg in slave.scan_index[interval]]
+                engine = slave.engines[scan] = UpdateEngine(slave, registers)
+            engine.tick(slave.bank.stage())
         else:
+            staging = slave.bank.stage()
+            if 'changes' in slave.simulator:
+                # subscribe before reading every register once, so that no change is missed in between
+                slave.subscription = slave.simulator['changes'].subscribe()
+                slave.address_index = dict(((reg.reg_type, reg.address), reg) for reg in slave.registers)
+            changes = []
+            image = slave.simulator['image']() if 'image' in slave.simulator else None
             for reg in slave.registers:
+                if image is None:
+                    new_value = slave.simulator['read'](reg_type=reg.reg_type, address=reg.address)
+                elif (reg.reg_type, reg.address) in image:
+                    new_value = image[(reg.reg_type, reg.address)]
+                else:
+                    continue
                 old_value = reg.get_value()
-                new_value = slave.simulator['read'](reg_type=reg.reg_type, address=reg.address)
                 if new_value != old_value:
-                    reg.set_value(new_value)
+                    changes.append((reg, new_value))
                     log.debug("New simulation value for {} old={} new={}".format(reg.name, old_value, new_value))
+            slave.set_values(changes, context=staging)
+        slave.bank.publish()
+    registry = metrics.registry
+    if registry is not None:
+        registry.observe_update(time.time() - start)
+
+
+def schedule_updates(timers, server_context, slaves, update_interval=UPDATE_INTERVAL):
+    """
+    Updates the values of the slaves now, then periodically with one timer per scan class
+
+    :param scheduler.TimerQueue timers: the scheduler to run the updates e.g. a ``Scheduler`` or ``EventLoopServer``
+    :param pymodbus.ModbusServerContext server_context: (unused) a server context object
+    :param list slaves: the ``Slave`` objects to update
+    :param float update_interval: the scan interval of registers without a scan class, in seconds
+    :return: the scan intervals scheduled, in seconds
+    :rtype: list
+    """
+    intervals = set()
+    for slave in slaves:
+        intervals.update(slave.index_scan_classes(update_interval))
+    update_values(server_context, slaves)
+    for interval in sorted(intervals):
+        timers.call_every(interval, update_values, server_context=server_context, slaves=slaves, scan=interval)
+    log.info("Updating {} scan classes every {} seconds".format(len(intervals),
+                                                                ', '.join(str(i) for i in sorted(intervals))))
+    return sorted(intervals)
+
+
+def _schedule_fetches(timers, simulator):
+    """
+    Refreshes a simulator with ``fetch`` and ``apply`` now and after each delay ``apply`` returns.
+    Each fetch runs on a thread of its own and posts its result to the scheduler, so a slow web API never delays
+    the updates or the requests of an event loop.
+
+    :param scheduler.TimerQueue timers: the scheduler to run ``apply`` e.g. a ``Scheduler`` or ``EventLoopServer``
+    :param dict simulator: the simulator, see ``get_simulator``
+    """
+    params = simulator['run_params']
+
+    def fetch():
+        try:
+            data = simulator['fetch'](**params)
+        except Exception, e:
+            log.error("Simulator fetch failed: {}".format(e))
+            data = None
+        timers.call_later(0, apply, data=data)
+
+    def apply(data):
+        try:
+            delay = simulator['apply'](data, **params)
+        except Exception, e:
+            log.error("Simulator update failed: {}".format(e))
+            delay = SIMULATOR_RETRY_INTERVAL
+        if delay is not None:
+            timers.call_later(delay, start)
+
+    def start():
+        fetch_thread = threading.Thread(target=fetch, name="simulator_fetch")
+        fetch_thread.setDaemon(True)
+        fetch_thread.start()
+
+    start()
+
+
+def start_simulators(timers, slaves):
+    """
+    Starts the simulator of each slave, once per simulator, refreshed by ``fetch`` and ``apply`` or else running on a
+    thread of its own
+
+    :param scheduler.TimerQueue timers: the scheduler to run the refreshes e.g. a ``Scheduler`` or ``EventLoopServer``
+    :param list slaves: the ``Slave`` objects
+    :return: the threads of the simulators without ``fetch``
+    :rtype: list
+    """
+    simulators = []
+    threads = []
+    for unit in slaves:
+        if unit.simulator is not None and unit.simulator['run'] not in simulators:
+            log.info("Simulating {} {}".format(unit.identity.VendorName, unit.identity.ModelName))
+            simulators.append(unit.simulator['run'])
+            if 'fetch' in unit.simulator:
+                _schedule_fetches(timers, unit.simulator)
+            else:
+                sim_thread = threading.Thread(target=unit.simulator['run'], name="rtu_simulator",
+                                              kwargs=unit.simulator['run_params'])
+                sim_thread.setDaemon(True)
+                sim_thread.start()
+                threads.append(sim_thread)
+    return threads
 
 
 class SerialPort(object):
@@ -827,7 +1232,7 @@ class SerialPort(object):
     Setup and metadata for a serial port used for Modbus
     """
     def __init__(self, name='/dev/ttyUSB0', baudrate=9600, bytesize=8, parity=serial.PARITY_EVEN, stopbits=1):
-        if name in self.list_serial_ports():
+        if self.is_serial_port(name):
             self.name = name
             self.baudrate = baudrate if baudrate in self.supported_baudrates() else 9600
             self.bytesize = bytesize
@@ -868,30 +1273,118 @@ class SerialPort(object):
         return [2400, 4800, 9600, 19200, 38400, 57600, 115200]
 
     @staticmethod
-    def list_serial_ports():
+    def list_serial_ports(refresh=False):
         """
-        Lists serial port names.
+        Lists serial port names, discovered on first use and cached for the process.
+
+        On Linux the ports are enumerated from sysfs (``/sys/class/tty/*/device``) without opening any device,
+        excluding unprobed legacy platform ports.  Other platforms use the pyserial port enumeration.
+
+        :param bool refresh: discards the cached list and enumerates the ports again
         :raises EnvironmentError: On unsupported or unknown platforms
         :returns: A list of the serial ports available on the system
         """
-        if sys.platform.startswith('win'):
-            ports = ['COM%s' % (i + 1) for i in range(256)]
-        elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-            # this excludes your current terminal "/dev/tty"
-            ports = glob.glob('/dev/tty[A-Za-z]*')
-        elif sys.platform.startswith('darwin'):
-            ports = glob.glob('/dev/tty.*')
-        else:
-            raise EnvironmentError("Unsupported OS/platform")
-        result = []
-        for port in ports:
+        global _serial_ports
+        if _serial_ports is None or refresh:
+            if sys.platform.startswith('linux'):
+                ports = []
+                for device in sorted(glob.glob('/sys/class/tty/*/device')):
+                    subsystem = os.path.basename(os.path.realpath(os.path.join(device, 'subsystem')))
+                    port = os.path.join('/dev', os.path.basename(os.path.dirname(device)))
+                    if subsystem != 'platform' and os.path.exists(port):
+                        ports.append(port)
+            elif sys.platform.startswith('win') or sys.platform.startswith('darwin') \
+                    or sys.platform.startswith('cygwin'):
+                from serial.tools import list_ports
+                ports = sorted(info[0] for info in list_ports.comports())
+            else:
+                raise EnvironmentError("Unsupported OS/platform")
+            log.debug("Discovered serial ports: {}".format(ports))
+            _serial_ports = ports
+        return list(_serial_ports)
+
+    @staticmethod
+    def is_serial_port(name):
+        """
+        Checks a serial port name, accepting any existing character device so that virtual ports
+        (e.g. a pty created by socat) can be named explicitly even though discovery does not list them
+
+        :param str name: the serial port name, e.g. /dev/ttyUSB0
+        :rtype: bool
+        """
+        if os.path.exists(name):
             try:
-                s = serial.Serial(port)
-                s.close()
-                result.append(port)
-            except (OSError, serial.SerialException):
+                if stat.S_ISCHR(os.stat(name).st_mode):
+                    return True
+            except OSError:
                 pass
-        return result
+        return name in SerialPort.list_serial_ports()
+
+
+def port_name(name):
+    """
+    Validates the ``--port`` argument, discovering serial ports only if the port is not TCP or UDP
+
+    :param str name: tcp:<port>, udp:<port> or a serial port name
+    :return: the port name
+    :rtype: str
+    :raises argparse.ArgumentTypeError: if the port is not valid
+    """
+    if name[0:len('tcp')] == 'tcp' or name[0:len('udp')] == 'udp':
+        if len(name.split(':')) > 1 and not name.split(':')[1].isdigit():
+            raise argparse.ArgumentTypeError("invalid port {}".format(name))
+        return name
+    if not SerialPort.is_serial_port(name):
+        raise argparse.ArgumentTypeError("serial port {} not found".format(name))
+    return name
+
+
+def expand_templates(templates):
+    """
+    Expands template arguments into a list of templates, replacing each directory by the files it contains
+
+    :param templates: a template name or a list of template file names/URLs, directories of templates or DEFAULT
+    :return: the template names
+    :rtype: list
+    """
+    if isinstance(templates, basestring):
+        templates = [templates]
+    result = []
+    for template in templates:
+        if os.path.isdir(template):
+            for name in sorted(os.listdir(template)):
+                path = os.path.join(template, name)
+                if name[0:1] != '.' and os.path.isfile(path):
+                    result.append(path)
+        else:
+            result.append(template)
+    return result
+
+
+def load_slaves(user_options, unique_ids=True):
+    """
+    Creates a ``Slave`` from each template, to be served under its own unit ID (the template networkId)
+
+    :param user_options: object returned by the command line argument parser, whose ``template`` may be a list
+    :param bool unique_ids: requires a different unit ID for each template (False if served on separate ports)
+    :return: the slaves in template order
+    :rtype: list
+    :raises EnvironmentError: if two templates use the same unit ID
+    """
+    slaves = []
+    unit_ids = {}
+    for template in expand_templates(user_options.template):
+        options = argparse.Namespace(**vars(user_options))
+        options.template = template
+        slave = Slave(options)
+        if unique_ids and slave.slave_id in unit_ids:
+            raise EnvironmentError("Unit ID {} of {} already used by {}".format(slave.slave_id, template,
+                                                                                 unit_ids[slave.slave_id]))
+        unit_ids[slave.slave_id] = template
+        slaves.append(slave)
+    if len(slaves) == 0:
+        raise EnvironmentError("No templates found in {}".format(user_options.template))
+    return slaves
 
 
 def get_parser():
@@ -903,13 +1396,10 @@ def get_parser():
     """
     parser = argparse.ArgumentParser(description="Modbus Slave Endpoint.")
 
-    port_choices = SerialPort.list_serial_ports() + ['tcp:502', 'udp:5020']
-
-    parser.add_argument('-t', '--template', dest='template', default='DEFAULT',
-                        help="the template file to use")
+    parser.add_argument('-t', '--template', dest='template', nargs='+', default=['DEFAULT'],
+                        help="the template files or directories of templates to use, one unit ID per template")
 
-    parser.add_argument('-p', '--port', dest='port', default=PORT_DEFAULT,
-                        choices=port_choices,
+    parser.add_argument('-p', '--port', dest='port', default=PORT_DEFAULT, type=port_name,
                         help="tcp:502, udp:5020, or a USB/serial port name")
 
     parser.add_argument('-b', '--baud', dest='baudrate', default=9600, type=int,
@@ -924,6 +1414,28 @@ def get_parser():
                         choices=['rtu', 'ascii', 'tcp'],
                         help="Modbus framing mode RTU, ASCII or TCP")
 
+    parser.add_argument('--server', dest='server', default='twisted', choices=['twisted', 'loop'],
+                        help="the server engine: the Twisted servers of pymodbus or a single-threaded event loop "
+                             "(TCP/UDP only) running requests and updates without threads (default twisted)")
+
+    parser.add_argument('--bind', dest='bind', default=None,
+                        help="the interface address to listen on for TCP/UDP e.g. 0.0.0.0 (default loopback)")
+
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes sharing the TCP/UDP port with SO_REUSEPORT and the register values "
+                             "in shared memory (default 1)")
+
+    parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=None,
+                        help="serves performance metrics in Prometheus format on this HTTP port (default disabled)")
+    parser.add_argument('--profile-access', dest='profile_access', default=None, metavar='FILE',
+                        help="counts master reads and writes per address and writes a report per register to FILE "
+                             "on SIGUSR1 and on exit (default disabled)")
+    parser.add_argument('--cache-dir', dest='cache_dir', default=template_cache.DEFAULT_CACHE_DIR,
+                        help="directory for compiled templates (default {})".format(template_cache.DEFAULT_CACHE_DIR))
+
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help="always parse the template without using or writing a compiled template")
+
     parser.add_argument('--logfile', default=None,
                         help="the log file name with optional extension (default extension .log)")
 
@@ -936,70 +1448,157 @@ def get_parser():
     return parser
 
 
-def run_async_server(update_interval=10):
+def server_address(port, host=None):
     """
-    Runs the Modbus asynchronous server
+    Returns the address to listen on for a TCP or UDP port
 
-    :param int update_interval: the refresh interval for simulated data, in seconds
+    :param str port: tcp:<port> or udp:<port>
+    :param str host: the interface to bind e.g. 0.0.0.0 for all, by default the loopback interface
+    :return: (host, port)
+    :rtype: tuple
+    """
+    if 'tcp' in port:
+        default_host, number = "localhost", 502
+    else:
+        default_host, number = "127.0.0.1", 5020
+    host = host or default_host
+    if len(port.split(':')) > 1 and int(port.split(':')[1]) in range(0, 65535+1):
+        number = int(port.split(':')[1])
+    return host, number
+
+
+def start_server(slave, context, defer_reactor_run=False, host=None):
+    """
+    Starts the Modbus server listening on a slave's port with its mode
+
+    :param Slave slave: the slave whose port, mode and identity are used
+    :param pymodbus.ModbusServerContext context: the server context to serve
+    :param bool defer_reactor_run: only listens on the port, without running the reactor
+    :param str host: the interface to bind for TCP/UDP, by default the loopback interface
+    """
+    if slave.mode == 'tcp':
+        framer = ModbusSocketFramer
+    elif slave.mode == 'ascii':
+        framer = ModbusAsciiFramer
+    else:
+        framer = ModbusRtuFramer
+
+    # TODO: trap master connect/disconnect as INFO logs rather than DEBUG (default of pyModbus)
+    if 'tcp' in slave.port and framer is ModbusSocketFramer:
+        # pipelined requests are executed in batches and answered with one write per batch
+        from twisted.internet import reactor
+        address = server_address(slave.port, host)
+        log.info("Starting pipelined Modbus TCP server on {}:{}".format(*address))
+        reactor.listenTCP(address[1], PipelinedServerFactory(context, identity=slave.identity),
+                          interface=address[0])
+        if not defer_reactor_run:
+            reactor.run(installSignalHandlers=isinstance(threading.current_thread(), threading._MainThread))
+    elif 'tcp' in slave.port:
+        StartTcpServer(context, identity=slave.identity, address=server_address(slave.port, host), framer=framer,
+                       defer_reactor_run=defer_reactor_run)
+    elif 'udp' in slave.port and framer is ModbusSocketFramer:
+        from twisted.internet import reactor
+        address = server_address(slave.port, host)
+        log.info("Starting Modbus UDP server on {}:{}".format(*address))
+        reactor.listenUDP(address[1], PipelinedUdpProtocol(context, identity=slave.identity), interface=address[0])
+        if not defer_reactor_run:
+            reactor.run(installSignalHandlers=isinstance(threading.current_thread(), threading._MainThread))
+    elif 'udp' in slave.port:
+        StartUdpServer(context, identity=slave.identity, address=server_address(slave.port, host), framer=framer,
+                       defer_reactor_run=defer_reactor_run)
+    else:
+        log.debug("serial settings: {}".format(vars(slave.ser)))
+        StartSerialServer(context, identity=slave.identity, framer=framer,
+                          port=slave.ser.name,
+                          baudrate=slave.ser.baudrate,
+                          bytesize=slave.ser.bytesize,
+                          parity=slave.ser.parity,
+                          stopbits=slave.ser.stopbits,
+                          defer_reactor_run=defer_reactor_run)
+
+
+def run_async_server(update_interval=UPDATE_INTERVAL):
+    """
+    Runs the Modbus asynchronous server.
+    Simulator refreshes and value updates run on one scheduler: the event loop of the loop engine, or else a
+    ``Scheduler`` thread beside the Twisted reactor, each timer waiting for its exact deadline.  Simulators fetch
+    their input e.g. from a web API on short-lived threads, so only applying it runs on the scheduler.
+    With ``--workers`` they run in the first worker process.
+
+    :param int update_interval: the refresh interval for simulated data without a scan class, in seconds
     """
     global active
-    slave_updater = None
-    sim_thread = None
+    scheduler = None
+    sim_threads = []
+    endpoint = None
+    metrics_server = None
+    profiles = None
     try:
         parser = get_parser()
         user_options = parser.parse_args()
 
-        slave = Slave(user_options)
-        slaves = {
-            slave.slave_id: slave.context
-        }
-        context = ModbusServerContext(slaves=slaves, single=False)
-
-        if slave.simulator is not None:
-            log.info("Simulating {} {}".format(slave.identity.VendorName, slave.identity.ModelName))
-            sim_thread = threading.Thread(target=slave.simulator['run'], name="rtu_simulator",
-                                          kwargs=slave.simulator['run_params'])
-            sim_thread.setDaemon(True)
-            sim_thread.start()
-
-        # Set up looping call to update values
-        slave_list = [slave]
-        updater_args = {'server_context': context, 'slaves': slave_list}
-        slave_updater = RepeatingTimer(seconds=update_interval, name='slave_updater', defer=False,
-                                       callback=update_values, **updater_args)
-        slave_updater.start_timer()
-
-        if slave.mode == 'tcp':
-            framer = ModbusSocketFramer
-        elif slave.mode == 'ascii':
-            framer = ModbusAsciiFramer
-        else:
-            framer = ModbusRtuFramer
-
-        # TODO: trap master connect/disconnect as INFO logs rather than DEBUG (default of pyModbus)
-        if 'tcp' in slave.port:
-            if len(slave.port.split(':')) > 1 and int(slave.port.split(':')[1]) in range(0, 65535+1):
-                tcp_port = int(slave.port.split(':')[1])
+        slave_list = load_slaves(user_options)
+        # the first template defines the listener (port, mode, identity) shared by every unit ID
+        slave = slave_list[0]
+        workers = user_options.workers if user_options.workers is not None else 1
+        if user_options.profile_access is not None:
+            if workers > 1:
+                log.warning("Access profiling is not supported with --workers")
             else:
-                tcp_port = 502
-            StartTcpServer(context, identity=slave.identity, address=("localhost", tcp_port), framer=framer,
-                           defer_reactor_run=False)
-        elif 'udp' in slave.port:
-            if len(slave.port.split(':')) > 1 and int(slave.port.split(':')[1]) in range(0, 65535+1):
-                udp_port = int(slave.port.split(':')[1])
+                profiles = dict((unit.slave_id, heatmap.AccessProfile()) for unit in slave_list)
+                signal.signal(signal.SIGUSR1, lambda signum, frame: heatmap.write_report(user_options.profile_access,
+                                                                                         slave_list, profiles))
+        slaves = {}
+        for unit in slave_list:
+            if unit.port != slave.port or unit.mode != slave.mode:
+                log.warning("Unit ID {} ({}) served on {} {} instead of {} {}".format(unit.slave_id, unit.template,
+                                                                                     slave.port, slave.mode,
+                                                                                     unit.port, unit.mode))
+            if profiles is not None:
+                slaves[unit.slave_id] = heatmap.ProfiledContext(unit.context, profiles[unit.slave_id])
             else:
-                udp_port = 5020
-            StartUdpServer(context, identity=slave.identity, address=("127.0.0.1", udp_port), framer=framer,
-                           defer_reactor_run=False)
+                slaves[unit.slave_id] = unit.context
+        context = ModbusServerContext(slaves=slaves, single=False)
+        install_response_encoder()
+        log.info("Serving {} unit IDs on {}".format(len(slaves), slave.port))
+        if user_options.metrics_port is not None and workers == 1:
+            metrics.enable()
+            metrics_server = metrics.MetricsServer((user_options.bind or 'localhost', user_options.metrics_port))
+            metrics_server.start()
+
+        server = None
+        timers = None
+        if workers == 1 and user_options.server == 'loop':
+            if 'tcp' not in slave.port and 'udp' not in slave.port:
+                raise EnvironmentError("The loop server does not support serial port {}".format(slave.port))
+            server = EventLoopServer(context, identity=slave.identity,
+                                     address=server_address(slave.port, user_options.bind), udp='udp' in slave.port)
+            timers = server
+        elif workers == 1:
+            scheduler = Scheduler()
+            timers = scheduler
+
+        if timers is not None:
+            sim_threads = start_simulators(timers, slave_list)
+
+        # Set up one timer per scan class to update the values of all slaves
+        if workers > 1:
+            from fleet import ReusePortEndpoint, exit_on_sigterm
+            endpoint = ReusePortEndpoint(slave_list, workers=workers, update_interval=update_interval,
+                                         host=user_options.bind, server=user_options.server,
+                                         metrics_port=user_options.metrics_port)
+            exit_on_sigterm()
+            # the first worker updates the values and runs the simulators, which must write to its copy of them
+            endpoint.start()
+            endpoint.join()
+        elif server is not None:
+            schedule_updates(server, context, slave_list, update_interval)
+            signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+            server.serve_forever()
         else:
-            log.debug("serial settings: {}".format(vars(slave.ser)))
-            StartSerialServer(context, identity=slave.identity, framer=framer,
-                              port=slave.ser.name,
-                              baudrate=slave.ser.baudrate,
-                              bytesize=slave.ser.bytesize,
-                              parity=slave.ser.parity,
-                              stopbits=slave.ser.stopbits,
-                              defer_reactor_run=False)
+            schedule_updates(scheduler, context, slave_list, update_interval)
+            scheduler.start()
+            start_server(slave, context, host=user_options.bind)
 
     except KeyboardInterrupt, e:
         log.warning("Execution stopped by keyboard interrupt: {}".format(e))
@@ -1010,13 +1609,21 @@ def run_async_server(update_interval=10):
     finally:
         print("********************** EXCEPTION OCCURRED *********************")
         print("Attempting to stop async server")
-        if slave_updater is not None:
-            print("slave_updater terminating")
-            slave_updater.stop_timer()
-            slave_updater.terminate()
-            slave_updater.join()
-        elif sim_thread is not None:
-            sim_thread.join()
+        if endpoint is not None:
+            log.info("endpoint workers terminating")
+            endpoint.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if profiles is not None:
+            log.info("writing access profile to {}".format(user_options.profile_access))
+            heatmap.write_report(user_options.profile_access, slave_list, profiles)
+        if scheduler is not None and scheduler.running:
+            log.info("scheduler terminating")
+            scheduler.stop()
+            scheduler.join()
+        else:
+            for sim_thread in sim_threads:
+                sim_thread.join()
         sys.exit(0)
 
 
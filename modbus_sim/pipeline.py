@@ -0,0 +1,241 @@
+"""
+Pipelined Modbus TCP request processing shared by the server engines.
+
+Masters may send several requests without waiting for each response, distinguishing them by MBAP transaction ID.
+Each connection queues the bytes it receives; every complete MBAP frame in the queue is decoded and the batch is
+executed in order against the ``ModbusServerContext``, looking up each unit's slave context once per batch.  The
+response frames are then written back with one write per batch (``writeSequence`` for Twisted, one ``send`` of
+the joined frames for the event loop, as Python 2.7 has no ``sendmsg``).
+
+``PipelinedServerFactory`` replaces the pymodbus ``ModbusServerFactory`` for Modbus TCP, which frames by
+concatenating strings and writes every response separately.  ``PipelinedUdpProtocol`` replaces the pymodbus
+``ModbusUdpProtocol``, which never answers with pymodbus 2.1 (its framer is called without the unit IDs).
+
+"""
+
+import struct
+import time
+
+import headless
+from twisted.internet import protocol
+
+from pymodbus.compat import int2byte, byte2int
+from pymodbus.device import ModbusControlBlock, ModbusDeviceIdentification
+from pymodbus.exceptions import NoSuchSlaveException
+from pymodbus.factory import ServerDecoder
+from pymodbus.pdu import ExceptionResponse, ModbusExceptions
+
+import metrics
+
+_logger = headless.get_wrapping_logger(name=__name__, debug=True)
+
+MBAP_HEADER = struct.Struct('>HHHB')
+MBAP_HEADER_SIZE = MBAP_HEADER.size
+# the MBAP length counts the unit ID and the PDU, which is at most 253 bytes
+MBAP_MAX_LENGTH = 254
+
+
+class RequestProcessor(object):
+    """
+    Decodes and executes batches of pipelined MBAP frames against a server context
+    """
+    def __init__(self, context, identity=None):
+        """
+        :param pymodbus.ModbusServerContext context: the slave contexts to serve
+        :param pymodbus.ModbusDeviceIdentification identity: the device identification to report
+        """
+        self.context = context
+        self.decoder = ServerDecoder()
+        self.control = ModbusControlBlock()
+        if isinstance(identity, ModbusDeviceIdentification):
+            self.control.Identity.update(identity)
+
+    def decode(self, inbuf):
+        """
+        Decodes every complete MBAP frame at the start of a buffer
+
+        :param bytearray inbuf: the received bytes
+        :return: the number of bytes consumed, or -1 if the buffer does not start with a valid MBAP header,
+            and a list of (transaction_id, protocol_id, unit_id, pdu) tuples
+        :rtype: tuple
+        """
+        frames = []
+        offset = 0
+        size = len(inbuf)
+        while size - offset >= MBAP_HEADER_SIZE:
+            transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack_from(inbuf, offset)
+            if length < 2 or length > MBAP_MAX_LENGTH:
+                return -1, frames
+            end = offset + MBAP_HEADER_SIZE - 1 + length
+            if end > size:
+                break
+            frames.append((transaction_id, protocol_id, unit_id, bytes(inbuf[offset + MBAP_HEADER_SIZE:end])))
+            offset = end
+        return offset, frames
+
+    def process(self, inbuf, responses):
+        """
+        Executes every complete MBAP frame at the start of a buffer as one batch
+
+        :param bytearray inbuf: the received bytes
+        :param list responses: the list to append the response frames to, in request order
+        :return: the number of bytes consumed, or -1 if the buffer does not start with a valid MBAP header
+        :rtype: int
+        """
+        consumed, frames = self.decode(inbuf)
+        if len(frames) > 0:
+            self.execute_batch(frames, responses)
+        return consumed
+
+    def execute_batch(self, frames, responses):
+        """
+        Executes decoded requests in order, resolving the slave context of each unit once
+
+        :param list frames: (transaction_id, protocol_id, unit_id, pdu) tuples
+        :param list responses: the list to append the response frames to
+        """
+        if self.control.ListenOnly:
+            return
+        registry = metrics.registry
+        if registry is not None:
+            registry.observe_depth(len(frames))
+        slaves = {}
+        for transaction_id, protocol_id, unit_id, pdu in frames:
+            slave = slaves.get(unit_id, None)
+            if slave is None:
+                try:
+                    slave = self.context[unit_id]
+                except NoSuchSlaveException:
+                    # as with the pymodbus servers, requests to units that are not served are dropped
+                    _logger.debug("Requested slave does not exist: {}".format(unit_id))
+                    continue
+                slaves[unit_id] = slave
+            if registry is None:
+                response = self.execute(transaction_id, protocol_id, unit_id, pdu, slave)
+            else:
+                start = time.time()
+                response = self.execute(transaction_id, protocol_id, unit_id, pdu, slave)
+                registry.observe_request(byte2int(pdu[0]), time.time() - start)
+            if response is not None:
+                responses.append(response)
+
+    def execute(self, transaction_id, protocol_id, unit_id, pdu, slave):
+        """
+        Executes one request PDU against a slave context
+
+        :param int transaction_id: the MBAP transaction ID
+        :param int protocol_id: the MBAP protocol ID
+        :param int unit_id: the unit ID of the slave
+        :param bytes pdu: the request PDU
+        :param pymodbus.ModbusSlaveContext slave: the context of the unit
+        :return: the response frame, an Illegal Data Value exception if the PDU cannot be decoded, or None if
+            there is no response
+        :rtype: bytes
+        """
+        try:
+            request = self.decoder.decode(pdu)
+        except Exception, e:
+            # e.g. struct.error for a PDU too short for its function code
+            _logger.warning("Unable to decode request function {}: {}".format(byte2int(pdu[0]), e))
+            response = ExceptionResponse(byte2int(pdu[0]), ModbusExceptions.IllegalValue)
+            return self.encode(transaction_id, protocol_id, unit_id, response)
+        if request is None:
+            _logger.warning("Unable to decode request function {}".format(byte2int(pdu[0])))
+            return None
+        request.transaction_id = transaction_id
+        request.protocol_id = protocol_id
+        request.unit_id = unit_id
+        try:
+            response = request.execute(slave)
+        except Exception, e:
+            _logger.debug("Datastore unable to fulfill request: {}".format(e))
+            response = request.doException(ModbusExceptions.SlaveFailure)
+        if not response.should_respond:
+            return None
+        return self.encode(transaction_id, protocol_id, unit_id, response)
+
+    def encode(self, transaction_id, protocol_id, unit_id, response):
+        """
+        Encodes a response frame
+
+        :param int transaction_id: the MBAP transaction ID
+        :param int protocol_id: the MBAP protocol ID
+        :param int unit_id: the unit ID of the slave
+        :param pymodbus.pdu.ModbusResponse response: the response
+        :rtype: bytes
+        """
+        self.control.Counter.BusMessage += 1
+        data = response.encode()
+        return MBAP_HEADER.pack(transaction_id, protocol_id, len(data) + 2, unit_id) + \
+            int2byte(response.function_code) + data
+
+
+class PipelinedTcpProtocol(protocol.Protocol):
+    """
+    A Modbus TCP connection that queues received bytes and answers each batch of requests with one write
+    """
+    def connectionMade(self):
+        self.inbuf = bytearray()
+        _logger.debug("Client connected {}".format(self.transport.getPeer()))
+
+    def connectionLost(self, reason):
+        _logger.debug("Client disconnected: {}".format(reason.getErrorMessage()))
+
+    def dataReceived(self, data):
+        """
+        Executes the complete requests received so far and writes their responses
+
+        :param bytes data: the bytes received
+        """
+        self.inbuf.extend(data)
+        responses = []
+        consumed = self.factory.processor.process(self.inbuf, responses)
+        if consumed < 0:
+            _logger.warning("Invalid MBAP header from {}".format(self.transport.getPeer()))
+            self.transport.loseConnection()
+            return
+        del self.inbuf[:consumed]
+        if len(responses) > 0:
+            self.transport.writeSequence(responses)
+
+
+class PipelinedUdpProtocol(protocol.DatagramProtocol):
+    """
+    A Modbus UDP server answering the requests of each datagram with one datagram
+    """
+    def __init__(self, store, identity=None):
+        """
+        :param pymodbus.ModbusServerContext store: the slave contexts to serve
+        :param pymodbus.ModbusDeviceIdentification identity: the device identification to report
+        """
+        self.store = store
+        self.processor = RequestProcessor(store, identity)
+        self.control = self.processor.control
+
+    def datagramReceived(self, data, address):
+        """
+        Executes the requests of a datagram and sends their responses
+
+        :param bytes data: the datagram
+        :param tuple address: the master's (host, port)
+        """
+        responses = []
+        self.processor.process(bytearray(data), responses)
+        if len(responses) > 0:
+            self.transport.write(b''.join(responses), address)
+
+
+class PipelinedServerFactory(protocol.ServerFactory):
+    """
+    Builds pipelined Modbus TCP connections sharing one request processor
+    """
+    protocol = PipelinedTcpProtocol
+
+    def __init__(self, store, identity=None):
+        """
+        :param pymodbus.ModbusServerContext store: the slave contexts to serve
+        :param pymodbus.ModbusDeviceIdentification identity: the device identification to report
+        """
+        self.store = store
+        self.processor = RequestProcessor(store, identity)
+        self.control = self.processor.control
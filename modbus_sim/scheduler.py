@@ -0,0 +1,169 @@
+"""
+Timers of the simulator, run on exact deadlines from one thread or event loop.
+
+A ``TimerQueue`` keeps periodic and one-off callbacks in a heap ordered by deadline, so adding, cancelling and
+running a timer costs O(log n) and thousands of timers stay cheap.  Its owner waits until ``next_timeout`` and
+then calls ``run_due``: the ``EventLoopServer`` does so between socket events, and a ``Scheduler`` is a thread that
+does nothing else, blocking until the next deadline (or until an earlier timer is added) instead of waking up
+periodically to check the time.
+
+Callbacks run one at a time on the owner's thread and should not block.  A periodic callback that raises is
+logged and keeps its schedule.
+"""
+
+import errno
+import heapq
+import os
+import select
+import threading
+import time
+
+import headless
+
+_logger = headless.get_wrapping_logger(name=__name__, debug=True)
+
+
+class Timer(object):
+    """
+    A scheduled callback, returned by ``TimerQueue`` so it can be cancelled
+    """
+    __slots__ = ['callback', 'kwargs', 'interval', 'cancelled']
+
+    def __init__(self, callback, kwargs, interval=None):
+        self.callback = callback
+        self.kwargs = kwargs
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        """Stops the timer, which is discarded when its deadline comes up"""
+        self.cancelled = True
+
+
+class TimerQueue(object):
+    """
+    Callbacks ordered by deadline in a heap
+    """
+    def __init__(self, wake=None):
+        """
+        :param wake: (optional) a function called when a timer is added with an earlier deadline than any other, to
+            interrupt the owner's wait
+        """
+        self._timers = []
+        self._timer_sequence = 0
+        self._timer_lock = threading.Lock()
+        self._timer_wake = wake
+
+    def _schedule(self, timer, deadline, wake=True):
+        with self._timer_lock:
+            self._timer_sequence += 1
+            heapq.heappush(self._timers, (deadline, self._timer_sequence, timer))
+            first = self._timers[0][2] is timer
+        if first and wake and self._timer_wake is not None:
+            self._timer_wake()
+        return timer
+
+    def call_later(self, seconds, callback, **kwargs):
+        """
+        Runs a callback once, after ``seconds``
+
+        :param float seconds: the delay in seconds
+        :param callback: the function to call
+        :param kwargs: the keyword arguments of the callback
+        :rtype: Timer
+        """
+        return self._schedule(Timer(callback, kwargs), time.time() + seconds)
+
+    def call_every(self, seconds, callback, **kwargs):
+        """
+        Runs a callback periodically, first after ``seconds``.  Deadlines are kept on the original schedule, and
+        deadlines missed while a callback overran are skipped rather than run back to back.
+
+        :param float seconds: the interval in seconds
+        :param callback: the function to call
+        :param kwargs: the keyword arguments of the callback
+        :rtype: Timer
+        """
+        return self._schedule(Timer(callback, kwargs, interval=seconds), time.time() + seconds)
+
+    def next_timeout(self):
+        """
+        Returns the seconds until the earliest deadline
+
+        :return: the timeout, 0 if a timer is due or None if there are no timers
+        :rtype: float
+        """
+        with self._timer_lock:
+            while len(self._timers) > 0 and self._timers[0][2].cancelled:
+                heapq.heappop(self._timers)
+            if len(self._timers) == 0:
+                return None
+            return max(0.0, self._timers[0][0] - time.time())
+
+    def run_due(self):
+        """Runs the callbacks that are due, rescheduling periodic ones"""
+        now = time.time()
+        while True:
+            with self._timer_lock:
+                if len(self._timers) == 0 or self._timers[0][0] > now:
+                    return
+                deadline, sequence, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(**timer.kwargs)
+            except Exception, e:
+                _logger.error("Timer callback {} failed: {}".format(timer.callback.__name__, e))
+            if timer.interval is not None:
+                next_deadline = deadline + timer.interval
+                if next_deadline < now:
+                    next_deadline += ((now - next_deadline) // timer.interval + 1) * timer.interval
+                self._schedule(timer, next_deadline, wake=False)
+
+
+class Scheduler(TimerQueue):
+    """
+    A thread running timers, e.g. simulator refreshes and update ticks beside the Twisted reactor
+    """
+    def __init__(self, name='scheduler'):
+        """
+        :param str name: the thread name
+        """
+        super(Scheduler, self).__init__(wake=self._wakeup)
+        self.running = False
+        self._wake_read, self._wake_write = os.pipe()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+
+    def _wakeup(self):
+        try:
+            os.write(self._wake_write, b'x')
+        except OSError:
+            pass
+
+    def start(self):
+        """Starts running timers"""
+        self.running = True
+        self._thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                readable = select.select([self._wake_read], [], [], self.next_timeout())[0]
+            except (IOError, OSError, select.error), e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if len(readable) > 0:
+                os.read(self._wake_read, 512)
+            if self.running:
+                self.run_due()
+
+    def stop(self):
+        """Stops running timers, from any thread"""
+        self.running = False
+        self._wakeup()
+
+    def join(self, timeout=None):
+        """Waits for the thread to stop"""
+        self._thread.join(timeout)
@@ -0,0 +1,66 @@
+"""
+Change feed from a simulator to the slaves it serves.
+
+A simulator publishes each register value it changes as (register_type, address, value) to its ``ChangeFeed``.
+Each slave using the simulator subscribes once and drains its ``Subscription`` on every update tick, so the work
+of a tick grows with the number of changed registers rather than the size of the register map.  A subscription
+keeps only the latest value per register, so a register changed many times between ticks is applied once.
+"""
+
+import threading
+
+
+class Subscription(object):
+    """
+    The registers changed since the subscriber last drained them
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = {}
+
+    def put(self, reg_type, address, value):
+        with self._lock:
+            self._dirty[(reg_type, address)] = value
+
+    def drain(self):
+        """
+        Takes the pending changes
+
+        :return: the latest value of each changed register, by (register_type, address)
+        :rtype: dict
+        """
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = {}
+        return dirty
+
+
+class ChangeFeed(object):
+    """
+    Publishes the register changes of a simulator to every subscriber
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+    def subscribe(self):
+        """
+        Adds a subscriber, which receives the changes published from now on
+
+        :rtype: Subscription
+        """
+        subscription = Subscription()
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def publish(self, reg_type, address, value):
+        """
+        Publishes a changed register value
+
+        :param str reg_type: register type from the list ['hr', 'ir', 'di', 'co']
+        :param int address: the native Modbus register address
+        :param value: the new value
+        """
+        for subscription in self._subscriptions:
+            subscription.put(reg_type, address, value)
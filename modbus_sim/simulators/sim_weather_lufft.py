@@ -62,11 +62,12 @@ Configuration Registers:
 
 """
 
-import requests
-import json
 import time
 import headless
 
+from feed import ChangeFeed
+from weather_client import WeatherClient, FetchError, Backoff
+
 '''
 Example calls:
 api.openweathermap.org/data/2.5/weather?q={city name}[,{country code}][&units=metric][&callback={callback}]&APPID={key}
@@ -84,6 +85,11 @@ DEFAULT_KEY = "ea59750a8c2eba42d0cb26b9bf68b68d"
 _USE_LIVE_API = True
 MIN_REFRESH = 660 if _USE_LIVE_API else 10
 
+# register changes published to the slaves served by this simulator
+changes = ChangeFeed()
+# a pooled, caching API client per subscription key
+_clients = {}
+
 sample_weather_resp = {
     "coord": {"lon": -75.9, "lat": 45.32},
     "weather": [{"id": 803, "main": "Clouds", "description": "broken clouds", "icon": "04n"}],
@@ -207,14 +213,15 @@ def get_weatherstation_id(station_model="WS501-UMB", software_version=1):
     return register_value
 
 
-def get_weather(location, key, units="metric"):
+def get_weather(location, key, units="metric", client=None):
     """
     Fetches weather and UV information from a subscription to OpenWeatherMap.org
 
     :param str location: format lat=Y&lon=X or city_name,country_code
     :param str key: the subscription key
     :param str units: from a selection of [metric, imperial] or using default (Kelvin/metric)
-    :return: A dictionary with the following parameters:
+    :param WeatherClient client: (optional) the API client, by default a shared client for the key
+    :return: A dictionary with the following parameters, empty if the API could not be queried:
 
        * ``temp_c`` (float) air temperature, Celsius
        * ``temp_f`` (float) air temperature, Fahrenheit
@@ -233,23 +240,15 @@ def get_weather(location, key, units="metric"):
     uv_data = None
     if _USE_LIVE_API:
         if units in ["metric", "imperial", "default"]:
-            queries_ok = True
-            weather_query = requests.get("http://api.openweathermap.org/data/2.5/"
-                                         "weather?{location}{units}&APPID={appid}"
-                                         .format(location=location, units="&units={}".format(units), appid=key),
-                                         timeout=5)
-            # TODO: handle failed queries (e.g. too many requests)
-            if weather_query.status_code == requests.codes.ok:
-                weather_data = json.loads(weather_query.content)
-            else:
-                _logger.error("Bad response from server: {}".format(weather_query.status_code))
-                queries_ok = False
-            uv_query = requests.get("http://api.openweathermap.org/data/2.5/uvi?{location}&appid={appid}"
-                                    .format(location=location, appid=key), timeout=5)
-            if uv_query.status_code == requests.codes.ok:
-                uv_data = json.loads(uv_query.content)
-            else:
-                _logger.error("Bad response from server: {}".format(uv_query.status_code))
+            if client is None:
+                client = _clients.get(key, None)
+                if client is None:
+                    client = _clients.setdefault(key, WeatherClient(key))
+            try:
+                weather_data, uv_data = client.fetch(location, units)
+                queries_ok = True
+            except FetchError, e:
+                _logger.error("Weather query failed: {}".format(e))
                 queries_ok = False
         else:
             raise ValueError("Invalid units reg_type {} - must be metric, imperial or default".format(units))
@@ -295,6 +294,26 @@ def get_weather(location, key, units="metric"):
     return weather
 
 
+def _index_registers(registers):
+    """
+    Indexes the simulated registers by name and by (register_type, address), the first definition of each winning
+
+    :param list registers: the register definitions e.g. ``MODBUS_REGISTERS``
+    :return: the name index and the address index
+    :rtype: tuple
+    """
+    by_name = {}
+    by_address = {}
+    for reg in registers:
+        by_name.setdefault(reg['name'], reg)
+        for addr in reg['sparse']:
+            by_address.setdefault((reg['register_type'], addr), reg)
+    return by_name, by_address
+
+
+_BY_NAME, _BY_ADDRESS = _index_registers(MODBUS_REGISTERS)
+
+
 def set_value(name, value):
     """
     Sets the abstracted value of a parameter (pre-factored, not necessarily the Modbus register value)
@@ -302,32 +321,32 @@ def set_value(name, value):
     :param str name: the parameter name of the Modbus register e.g. "Relative Humidity (act)"
     :param value: the value, a number could be int or float or raw data
     """
-    for reg in MODBUS_REGISTERS:
-        if reg['name'] == name:
-            value = value * reg['factor'] if isinstance(reg['factor'], int) else value
-            for addr in reg['sparse']:
-                write_register(reg_type=reg['register_type'], address=addr, value=value)
-            break
+    reg = _BY_NAME.get(name, None)
+    if reg is not None:
+        value = value * reg['factor'] if isinstance(reg['factor'], int) else value
+        for addr in reg['sparse']:
+            write_register(reg_type=reg['register_type'], address=addr, value=value)
     if name in ["Reset Abs. Rain", "Device Reset"]:
         set_value("Precipitation abs mm", 0)
 
 
 def write_register(reg_type, address, value):
     """
-    Writes the raw register value in Modbus
+    Writes the raw register value in Modbus, publishing it to ``changes`` if it changed
 
     :param str reg_type: register type from the list ['hr', 'ir', 'di', 'co']
     :param int address: the native Modbus register address
     :param value: the value int or float or binary data
     """
-    for reg in MODBUS_REGISTERS:
-        if reg['register_type'] == reg_type and address in reg['sparse']:
-            if "int" in reg['enc']:
-                value = int(value)
-            elif "float" in reg['enc']:
-                value = float(value)
+    reg = _BY_ADDRESS.get((reg_type, address), None)
+    if reg is not None:
+        if "int" in reg['enc']:
+            value = int(value)
+        elif "float" in reg['enc']:
+            value = float(value)
+        if reg['sparse'][address] != value:
             reg['sparse'][address] = value
-            break
+            changes.publish(reg_type, address, value)
 
 
 def read_register(reg_type, address):
@@ -339,12 +358,18 @@ def read_register(reg_type, address):
     :return: the register value
     :rtype: int or float or blob
     """
-    value = 0
-    for reg in MODBUS_REGISTERS:
-        if reg['register_type'] == reg_type and address in reg['sparse']:
-            value = reg['sparse'][address]
-            break
-    return value
+    reg = _BY_ADDRESS.get((reg_type, address), None)
+    return reg['sparse'][address] if reg is not None else 0
+
+
+def read_image():
+    """
+    Reads every simulated register value at once
+
+    :return: the raw register values by (register_type, address)
+    :rtype: dict
+    """
+    return dict((key, reg['sparse'][key[1]]) for key, reg in _BY_ADDRESS.iteritems())
 
 
 def get_value(name):
@@ -356,89 +381,139 @@ def get_value(name):
     :rtype: float or int depending on value type
     """
     value = 0
-    for reg in MODBUS_REGISTERS:
-        if reg['name'] == name:
-            for addr in reg['sparse']:
-                value = read_register(reg_type=reg['register_type'], address=addr)
-            if isinstance(reg['factor'], int) and reg['factor'] != 1:
-                value = float(value / reg['factor'])
-            break
+    reg = _BY_NAME.get(name, None)
+    if reg is not None:
+        for addr in reg['sparse']:
+            value = reg['sparse'][addr]
+        if isinstance(reg['factor'], int) and reg['factor'] != 1:
+            value = float(value / reg['factor'])
     return value
 
 
-def simulate(location=DEFAULT_LOCATION, key=DEFAULT_KEY, log=_logger, refresh=MIN_REFRESH):
+def apply_weather(weather):
+    """
+    Sets the simulated registers from weather data, with the derived dew point and rain total
+
+    :param dict weather: the weather data returned by ``get_weather``
+    """
+    set_value("Identification", get_weatherstation_id())
+    # TODO: set values / simulate sensor faults periodically in Sensor Status N
+    for tag in weather:
+        if tag == "temp_c":
+            set_value("Air Temperature C (act)", weather[tag])
+        elif tag == "temp_f":
+            set_value("Air Temperature F (act)", weather[tag])
+        elif tag == "rh_pct":
+            set_value("Relative Humidity (act)", weather[tag])
+        elif tag == "windspeed_kph":
+            set_value("Wind Speed kph (avg)", weather[tag])
+            set_value("Wind Speed kph (max)", weather[tag])
+        elif tag == "winddirection":
+            set_value("Wind Direction (act)", weather[tag])
+        elif tag == "airpress_hpa":
+            set_value("Relative Air Pressure (act)", weather[tag])
+        elif tag == "precip_intensity":
+            set_value("Precipitation Intensity mm/h", weather[tag])
+        elif tag == "global_radiation":
+            set_value("Global Radiation (act)", weather[tag])
+    if "Dew Point C (act)" in _BY_NAME:
+        # Tdp = T - (100 - RH)/5  ==> https://en.wikipedia.org/wiki/Dew_point (Simple approximation)
+        t = get_value("Air Temperature C (act)")
+        rh = get_value("Relative Humidity (act)")
+        set_value("Dew Point C (act)", int(t - (100 - rh) / 5))
+    if "Precipitation abs mm" in _BY_NAME:
+        prev = get_value("Precipitation abs mm")
+        new = get_value("Precipitation Intensity mm/h")
+        set_value("Precipitation abs mm", prev + new)
+
+
+class WeatherSimulation(object):
+    """
+    Periodic weather refreshes, each a blocking ``fetch`` followed by an ``apply`` that can run on a scheduler
+    """
+    def __init__(self, location=DEFAULT_LOCATION, key=DEFAULT_KEY, refresh=MIN_REFRESH, client=None):
+        """
+        :param str location: format lat=Y&lon=X or city_name,country_code
+        :param str key: the OpenWeatherMap.org subscription key
+        :param int refresh: the refresh interval for weather data, in seconds (default 660)
+        :param WeatherClient client: (optional) the API client e.g. for a local stub server
+        """
+        self.location = location
+        self.key = key
+        self.refresh = max(refresh, MIN_REFRESH)
+        self.client = client
+        self.first_run = True
+        self.backoff = Backoff(maximum=self.refresh)
+
+    def fetch(self, log=_logger):
+        """
+        Queries the weather data, blocking until the API responds
+
+        :param logging.Log log: (optional) logger to store debug messages
+        :return: the weather data returned by ``get_weather``
+        :rtype: dict
+        """
+        if self.first_run:
+            log.debug("Initial query running via {}".format('Internet' if _USE_LIVE_API else 'static data'))
+            self.first_run = False
+        else:
+            log.debug("Refreshing weather data via {}".format('Internet' if _USE_LIVE_API else 'static data'))
+        return get_weather(self.location, self.key, client=self.client)
+
+    def apply(self, weather, log=_logger):
+        """
+        Sets the simulated registers from fetched weather data, without blocking.
+        A failed query is retried after a delay doubling from 5 seconds up to the refresh interval.
+
+        :param dict weather: the weather data returned by ``fetch``, empty or None if the query failed
+        :param logging.Log log: (optional) logger to store debug messages
+        :return: the seconds until the next refresh
+        :rtype: float
+        """
+        if weather:
+            self.backoff.reset()
+            apply_weather(weather)
+            return self.refresh
+        delay = self.backoff.next()
+        log.warning("No weather data returned by API call, retrying in {} seconds".format(int(delay)))
+        return delay
+
+    def step(self, log=_logger):
+        """
+        Refreshes the weather data, fetching and applying it in turn
+
+        :param logging.Log log: (optional) logger to store debug messages
+        :return: the seconds until the next refresh
+        :rtype: float
+        """
+        return self.apply(self.fetch(log=log), log=log)
+
+
+# the simulation of every slave served by this simulator, refreshed by the simulator's scheduler
+simulation = WeatherSimulation()
+
+
+def simulate(location=DEFAULT_LOCATION, key=DEFAULT_KEY, log=_logger, refresh=MIN_REFRESH, client=None):
     """
-    Starts a loop periodically updating weather data into Modbus registers
+    Starts a loop periodically updating weather data into Modbus registers, sleeping until each refresh
 
     :param str location: format lat=Y&lon=X or city_name,country_code
     :param str key: the OpenWeatherMap.org subscription key
     :param logging.Log log: (optional) logger to store debug messages
     :param int refresh: the refresh interval for weather data, in seconds (default 660)
+    :param WeatherClient client: (optional) the API client e.g. for a local stub server
     """
-    if refresh < MIN_REFRESH:
-        refresh = MIN_REFRESH
-    time_ref = time.time()
+    weather_simulation = WeatherSimulation(location=location, key=key, refresh=refresh, client=client)
     log.debug("Simulating with {interval} {units} refresh"
-              .format(interval=refresh if refresh < 60 else int(refresh/60),
-                      units='seconds' if refresh < 60 else 'minutes'))
-    is_running = True
-    first_run = True
+              .format(interval=weather_simulation.refresh if weather_simulation.refresh < 60
+                      else int(weather_simulation.refresh/60),
+                      units='seconds' if weather_simulation.refresh < 60 else 'minutes'))
     try:
         while True:
-            if time.time() - time_ref >= refresh or first_run:
-                if first_run:
-                    log.debug("Initial query running via {}".format('Internet' if _USE_LIVE_API else 'static data'))
-                    first_run = False
-                else:
-                    log.debug("Refreshing weather data via {}".format('Internet' if _USE_LIVE_API else 'static data'))
-                time_ref = time.time()
-                weather = get_weather(location, key)
-                if len(weather) > 0:
-                    set_value("Identification", get_weatherstation_id())
-                    # TODO: set values / simulate sensor faults periodically in Sensor Status N
-                    for tag in weather:
-                        if tag == "temp_c":
-                            set_value("Air Temperature C (act)", weather[tag])
-                        elif tag == "temp_f":
-                            set_value("Air Temperature F (act)", weather[tag])
-                        elif tag == "rh_pct":
-                            set_value("Relative Humidity (act)", weather[tag])
-                        elif tag == "windspeed_kph":
-                            set_value("Wind Speed kph (avg)", weather[tag])
-                            set_value("Wind Speed kph (max)", weather[tag])
-                        elif tag == "winddirection":
-                            set_value("Wind Direction (act)", weather[tag])
-                        elif tag == "airpress_hpa":
-                            set_value("Relative Air Pressure (act)", weather[tag])
-                        elif tag == "precip_intensity":
-                            set_value("Precipitation Intensity mm/h", weather[tag])
-                        elif tag == "global_radiation":
-                            set_value("Global Radiation (act)", weather[tag])
-                    for reg in MODBUS_REGISTERS:
-                        if reg['name'] == "Dew Point C (act)":
-                            # Tdp = T - (100 - RH)/5  ==> https://en.wikipedia.org/wiki/Dew_point (Simple approximation)
-                            t = get_value("Air Temperature C (act)")
-                            rh = get_value("Relative Humidity (act)")
-                            set_value("Dew Point C (act)", int(t - (100 - rh) / 5))
-                        elif reg['name'] == "Precipitation abs mm":
-                            prev = get_value("Precipitation abs mm")
-                            new = get_value("Precipitation Intensity mm/h")
-                            set_value("Precipitation abs mm", prev + new)
-                    # log.debug("Updating weather simulation {}".format(MODBUS_REGISTERS))
-                else:
-                    log.warning("No weather data returned by API call")
-            else:
-                if (time.time() - time_ref) % 60 == 0:
-                    remaining_time = int((refresh - (time.time() - time_ref)) / 60)
-                    log.debug("Waiting {} minutes for refresh".format(remaining_time))
-                time.sleep(1)
+            time.sleep(weather_simulation.step(log=log))
     except Exception, e:
         log.error("Exception: {}".format(e))
-        if "HTTPConnectionPool" in str(e):
-            simulate()
         raise ValueError(e)
-    finally:
-        is_running = False
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+"""
+Fetching of OpenWeatherMap.org data for the weather simulators.
+
+A ``WeatherClient`` keeps one ``requests.Session`` so connections to the API are reused, and fetches the weather
+and UV responses of a location concurrently.  Responses are cached in memory and on disk for ``ttl`` seconds, by
+default the API's 10 minute update interval, so neither a refresh nor a restarted simulator queries the API again
+before new data is available.  A failed query raises ``FetchError``; ``Backoff`` spaces out the caller's retries.
+
+The client can be pointed at a local stub server with ``base_url``, e.g.::
+
+   client = WeatherClient(key='test', base_url='http://localhost:8000', cache_dir=None)
+   weather, uv = client.fetch('lat=45.3&lon=-75.8')
+
+"""
+
+import os
+import hashlib
+import json
+import tempfile
+import threading
+import time
+
+import requests
+import headless
+
+API_URL = 'http://api.openweathermap.org/data/2.5'
+API_TTL = 600
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.modbus_sim', 'weather')
+
+_logger = headless.get_wrapping_logger(name=__name__, debug=True)
+
+
+class FetchError(IOError):
+    """A query to the weather API failed"""
+    pass
+
+
+class Backoff(object):
+    """
+    Exponentially increasing retry delays, up to a maximum
+    """
+    def __init__(self, initial=5.0, maximum=600.0, factor=2.0):
+        """
+        :param float initial: the first delay in seconds
+        :param float maximum: the longest delay in seconds
+        :param float factor: the increase of each successive delay
+        """
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.delay = initial
+
+    def next(self):
+        """
+        Returns the delay before the next retry
+
+        :rtype: float
+        """
+        delay = min(self.delay, self.maximum)
+        self.delay = min(self.delay * self.factor, self.maximum)
+        return delay
+
+    def reset(self):
+        """Restarts from the first delay, after a success"""
+        self.delay = self.initial
+
+
+class WeatherClient(object):
+    """
+    A pooled, caching client of the OpenWeatherMap.org weather and UV APIs
+    """
+    def __init__(self, key, base_url=API_URL, ttl=API_TTL, cache_dir=DEFAULT_CACHE_DIR, timeout=5.0):
+        """
+        :param str key: the subscription key
+        :param str base_url: the API root, e.g. a local stub server for testing
+        :param float ttl: the seconds a response is reused
+        :param str cache_dir: the directory of cached responses, or None to cache in memory only
+        :param float timeout: the seconds to wait for each response
+        """
+        self.key = key
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.session = requests.Session()
+        # the weather and UV queries run concurrently on up to two pooled connections
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _cache_file(self, url):
+        """Returns the path of the cached response of a URL, named by a hash so the key is not stored"""
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _cached(self, url):
+        """Returns the cached response of a URL if it is younger than the TTL, else None"""
+        with self._lock:
+            entry = self._cache.get(url, None)
+        if entry is None and self.cache_dir is not None:
+            try:
+                with open(self._cache_file(url)) as f:
+                    entry = json.load(f)
+                entry = (entry['time'], entry['data'])
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                entry = None
+        if entry is not None and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def _store(self, url, data):
+        """Caches a response in memory and on disk, writing a temporary file then renaming it"""
+        fetched = time.time()
+        with self._lock:
+            self._cache[url] = (fetched, data)
+        if self.cache_dir is None:
+            return
+        tmp_name = None
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix='.json.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'time': fetched, 'data': data}, f)
+            artifact = self._cache_file(url)
+            if os.name == 'nt' and os.path.exists(artifact):
+                os.remove(artifact)
+            os.rename(tmp_name, artifact)
+        except (IOError, OSError), e:
+            _logger.warning("Unable to cache weather response: {}".format(e))
+            if tmp_name is not None and os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+    def get(self, path, query):
+        """
+        Queries the API, or returns a cached response younger than the TTL
+
+        :param str path: the API path e.g. 'weather'
+        :param str query: the URL query including the subscription key
+        :return: the decoded JSON response
+        :rtype: dict
+        :raises FetchError: if the query fails or the response is not JSON
+        """
+        url = '{}/{}?{}'.format(self.base_url, path, query)
+        data = self._cached(url)
+        if data is not None:
+            return data
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException, e:
+            raise FetchError("Query {} failed: {}".format(path, e))
+        if response.status_code != requests.codes.ok:
+            raise FetchError("Bad response from server to {}: {}".format(path, response.status_code))
+        try:
+            data = response.json()
+        except ValueError, e:
+            raise FetchError("Invalid response from server to {}: {}".format(path, e))
+        self._store(url, data)
+        return data
+
+    def fetch(self, location, units='metric'):
+        """
+        Fetches the weather and UV index of a location, concurrently
+
+        :param str location: format lat=Y&lon=X or q=city_name,country_code
+        :param str units: from a selection of [metric, imperial, default]
+        :return: the weather and UV responses
+        :rtype: tuple
+        :raises FetchError: if either query fails
+        """
+        uv = {}
+
+        def get_uv():
+            try:
+                uv['data'] = self.get('uvi', '{}&appid={}'.format(location, self.key))
+            except FetchError, e:
+                uv['error'] = e
+
+        thread = threading.Thread(target=get_uv, name='uv_query')
+        thread.daemon = True
+        thread.start()
+        try:
+            weather = self.get('weather', '{}&units={}&APPID={}'.format(location, units, self.key))
+        finally:
+            thread.join()
+        if 'error' in uv:
+            raise uv['error']
+        return weather, uv['data']
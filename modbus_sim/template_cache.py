@@ -0,0 +1,133 @@
+"""
+A cache of compiled device templates used to skip template parsing on simulator startup.
+
+A compiled template is a binary (pickled) artifact holding the parsed identity, port settings, register table
+and pre-encoded default register image of a ``Slave``.  Only settings read from the template are stored, so the
+command line options still apply to a cached load.  Artifacts are stored in a cache directory under a file name
+derived from the template path, with a header recording the template's modification time, size and content hash:
+
+   * if the template's mtime and size are unchanged, the artifact is used without reading the template
+   * otherwise the template content is hashed and the artifact is used if the hash is unchanged
+   * anything else (or an unreadable/outdated artifact) is a cache miss and the template is parsed again
+
+"""
+
+import os
+import hashlib
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import headless
+
+CACHE_FORMAT_VERSION = 4
+CACHE_FILE_EXTENSION = '.mbsc'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.modbus_sim', 'cache')
+
+_logger = headless.get_wrapping_logger(name=__name__, debug=True)
+
+
+def content_hash(template):
+    """
+    Returns the SHA-1 hex digest of a template file's content
+
+    :param str template: the template file path
+    :rtype: str
+    """
+    sha = hashlib.sha1()
+    with open(template, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_file(template, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the path of the compiled artifact for a template file
+
+    :param str template: the template file path
+    :param str cache_dir: the cache directory
+    :rtype: str
+    """
+    key = hashlib.sha1(os.path.abspath(template).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key + CACHE_FILE_EXTENSION)
+
+
+def load(template, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Loads the compiled form of a template if a current one exists in the cache
+
+    :param str template: the template file path
+    :param str cache_dir: the cache directory
+    :return: the compiled template or ``None`` if not cached or stale
+    :rtype: dict
+    """
+    if cache_dir is None or not os.path.isfile(template):
+        return None
+    artifact = cache_file(template, cache_dir)
+    if not os.path.isfile(artifact):
+        return None
+    try:
+        stat = os.stat(template)
+        with open(artifact, 'rb') as f:
+            header = pickle.load(f)
+            if header.get('version') != CACHE_FORMAT_VERSION:
+                return None
+            if header['mtime'] != stat.st_mtime or header['size'] != stat.st_size:
+                if header['sha1'] != content_hash(template):
+                    return None
+                _logger.debug("Template {} touched but unchanged".format(template))
+                touched = True
+            else:
+                touched = False
+            compiled = pickle.load(f)
+    except (IOError, OSError, EOFError, KeyError, AttributeError, pickle.UnpicklingError) as e:
+        _logger.warning("Ignoring unreadable template cache {}: {}".format(artifact, e))
+        return None
+    if touched:
+        save(template, compiled, cache_dir=cache_dir, sha1=header['sha1'])
+    _logger.debug("Loaded compiled template {} from {}".format(template, artifact))
+    return compiled
+
+
+def save(template, compiled, cache_dir=DEFAULT_CACHE_DIR, sha1=None):
+    """
+    Stores the compiled form of a template in the cache.
+    The artifact is written to a temporary file then renamed so concurrent simulators never read a partial file.
+
+    :param str template: the template file path
+    :param dict compiled: the compiled template
+    :param str cache_dir: the cache directory
+    :param str sha1: (optional) the template content hash if already computed
+    :return: True if the artifact was written
+    :rtype: bool
+    """
+    if cache_dir is None or not os.path.isfile(template):
+        return False
+    tmp_name = None
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        stat = os.stat(template)
+        header = {
+            'version': CACHE_FORMAT_VERSION,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha1': sha1 if sha1 is not None else content_hash(template),
+        }
+        artifact = cache_file(template, cache_dir)
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir, suffix=CACHE_FILE_EXTENSION + '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+        if os.name == 'nt' and os.path.exists(artifact):
+            os.remove(artifact)
+        os.rename(tmp_name, artifact)
+    except (IOError, OSError, pickle.PicklingError) as e:
+        _logger.warning("Unable to write template cache for {}: {}".format(template, e))
+        if tmp_name is not None and os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        return False
+    return True
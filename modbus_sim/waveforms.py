@@ -0,0 +1,102 @@
+"""
+Waveform generators for simulated register values, evaluated for many registers at once with NumPy.
+
+A register driven by a waveform takes a new value on every tick of its scan class instead of being incremented
+or toggled.  Each generator computes the values of all the registers sharing its waveform in one batch, from the
+tick time and per-register parameter arrays:
+
+   * ``sine``: ``offset + amplitude * sin(2 * pi * (t / period + phase))``
+   * ``ramp``: a sawtooth rising from ``offset - amplitude`` to ``offset + amplitude`` every period
+   * ``square``: ``offset + amplitude`` for the first half of each period, ``offset - amplitude`` for the second
+   * ``walk``: a random walk adding a Gaussian step of deviation ``sigma`` to the register's current value
+   * ``noise``: Gaussian noise of deviation ``sigma`` around ``offset``
+   * ``step``: the values of ``steps`` in turn, each held for one period
+
+``t`` is the Unix time in seconds, so registers with the same parameters stay in phase across slaves and
+restarts, and ``phase`` is a fraction of the period.  The engine clips the values to the register's min and max
+(rounding integer encodings) before encoding them.
+"""
+
+import numpy
+
+# the parameters of the template and their defaults; the default offset is the register's default value
+PARAMETERS = {
+    'period': 60.0,
+    'amplitude': 1.0,
+    'offset': None,
+    'phase': 0.0,
+    'sigma': 1.0,
+}
+
+
+def _cycles(t, params):
+    """Returns the periods elapsed at time t, including the phase"""
+    return t / params['period'] + params['phase']
+
+
+def _fraction(t, params):
+    """Returns the fraction of the current period elapsed at time t"""
+    return numpy.mod(_cycles(t, params), 1.0)
+
+
+def sine(t, params, previous, random):
+    # the angle is taken within one period, as the sine of the millions of radians since the epoch is slower
+    # and less precise
+    return params['offset'] + params['amplitude'] * numpy.sin(2 * numpy.pi * _fraction(t, params))
+
+
+def ramp(t, params, previous, random):
+    return params['offset'] + params['amplitude'] * (2 * _fraction(t, params) - 1)
+
+
+def square(t, params, previous, random):
+    high = _fraction(t, params) < 0.5
+    return params['offset'] + numpy.where(high, params['amplitude'], -params['amplitude'])
+
+
+def walk(t, params, previous, random):
+    return previous + params['sigma'] * random.standard_normal(len(previous))
+
+
+def noise(t, params, previous, random):
+    return params['offset'] + params['sigma'] * random.standard_normal(len(params['offset']))
+
+
+def step(t, params, previous, random):
+    index = numpy.floor(_cycles(t, params)).astype(numpy.int64) % params['counts']
+    return params['steps'].take(params['rows'] + index)
+
+
+WAVEFORMS = {
+    'sine': sine,
+    'ramp': ramp,
+    'square': square,
+    'walk': walk,
+    'noise': noise,
+    'step': step,
+}
+
+
+def parameter_arrays(registers):
+    """
+    Collects the waveform parameters of registers into arrays, one value per register
+
+    :param list registers: the ``Slave.Register`` objects, each with a ``waveform`` dictionary
+    :return: the arrays by parameter name, with ``steps`` as a flattened (registers, most steps) array padded
+        with zeros, ``rows`` the offset of each register's steps in it and ``counts`` the number of steps of each
+        register
+    :rtype: dict
+    """
+    params = {}
+    for name, default in PARAMETERS.items():
+        params[name] = numpy.array([reg.waveform.get(name, default if default is not None else reg.default)
+                                    for reg in registers], dtype=numpy.float64)
+    sequences = [reg.waveform.get('steps', [0.0]) for reg in registers]
+    params['counts'] = numpy.array([len(sequence) for sequence in sequences], dtype=numpy.int64)
+    width = params['counts'].max()
+    steps = numpy.zeros((len(registers), width), dtype=numpy.float64)
+    for i, sequence in enumerate(sequences):
+        steps[i, :len(sequence)] = sequence
+    params['steps'] = steps.ravel()
+    params['rows'] = numpy.arange(len(registers), dtype=numpy.int64) * width
+    return params
@@ -19,6 +19,7 @@ setup(name='modbus-sim',
             'twisted',
             'pyserial>=3.4',
             'requests',
+            'numpy',
       ],
       include_package_data=True,
       zip_safe=False)
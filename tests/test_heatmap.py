@@ -0,0 +1,87 @@
+"""
+Tests of register access profiling.
+
+Usage::
+
+   python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import argparse
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim'))
+
+from pymodbus.bit_write_message import WriteSingleCoilRequest
+from pymodbus.register_read_message import ReadHoldingRegistersRequest
+from pymodbus.register_write_message import WriteMultipleRegistersRequest, WriteSingleRegisterRequest
+
+import heatmap
+import modbus_sim
+
+# register 2 has no /*REGISTER line, so no name, and register 3 is outside the Modbus address space
+TEMPLATE = """/**DEVICE_DESC;VendorName=Test;ModelName=Heatmap
+deviceId=1;networkId=1;plcBaseAddress=0
+/*REGISTER;paramId=1;Name=Point;Default=7
+paramId=1;deviceId=1;registerType=holding;address=0;encoding=int16
+paramId=2;deviceId=1;registerType=holding;address=1;encoding=int16
+/*REGISTER;paramId=3;Name=High;Default=1
+paramId=3;deviceId=1;registerType=holding;address=70000;encoding=int16
+/*REGISTER;paramId=4;Name=Switch;Default=0
+paramId=4;deviceId=1;registerType=coil;address=0;encoding=boolean
+"""
+
+
+class AccessProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        template = os.path.join(self.directory, 'device.txt')
+        with open(template, 'w') as f:
+            f.write(TEMPLATE)
+        self.slave = modbus_sim.Slave(argparse.Namespace(template=template, port='tcp:502', baudrate=9600,
+                                                         mode=None, cache_dir=None))
+        self.profile = heatmap.AccessProfile()
+        self.context = heatmap.ProfiledContext(self.slave.context, self.profile)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_single_writes(self):
+        WriteSingleRegisterRequest(0, 5).execute(self.context)
+        WriteSingleCoilRequest(0, True).execute(self.context)
+        self.assertEqual(self.profile.writes['h'][0], 1)
+        self.assertEqual(self.profile.reads['h'][0], 0)
+        self.assertEqual(self.profile.writes['c'][0], 1)
+        self.assertEqual(self.profile.reads['c'][0], 0)
+        self.assertEqual(self.profile.sizes['h'][1], 1)
+        ReadHoldingRegistersRequest(0, 1).execute(self.context)
+        self.assertEqual(self.profile.reads['h'][0], 1)
+
+    def test_multiple_write_then_read(self):
+        WriteMultipleRegistersRequest(0, [5]).execute(self.context)
+        ReadHoldingRegistersRequest(0, 1).execute(self.context)
+        self.assertEqual(self.profile.writes['h'][0], 1)
+        self.assertEqual(self.profile.reads['h'][0], 1)
+
+    def _report(self):
+        lines = heatmap.format_report(self.slave, self.profile)
+        return dict((line.split()[0], line.split()) for line in lines[2:])
+
+    def test_report_unnamed_register(self):
+        ReadHoldingRegistersRequest(0, 2).execute(self.context)
+        rows = self._report()
+        self.assertEqual(rows['1'][-3:], ['1', '0', '0'])
+        self.assertEqual(rows['2'][1:], ['hr', '1', '1', '1', '0', '0'])
+
+    def test_report_address_out_of_range(self):
+        rows = self._report()
+        self.assertEqual(rows['3'][1:], ['High', 'hr', '70000', '1', '0', '0', '0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Tests of the pipelined request processing shared by the server engines.
+
+Usage::
+
+   python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import socket
+import struct
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim'))
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusSlaveContext
+
+from eventloop import EventLoopServer
+from pipeline import RequestProcessor
+
+UNIT = 1
+# a Read Holding Registers request without its address and count
+SHORT_FRAME = struct.pack('>HHHBB', 2, 0, 2, UNIT, 3)
+READ_FRAME = struct.pack('>HHHBBHH', 3, 0, 6, UNIT, 3, 0, 2)
+READ_RESPONSE = struct.pack('>HHHBBBHH', 3, 0, 7, UNIT, 3, 4, 10, 11)
+# Illegal Data Value (3) for function code 3
+SHORT_RESPONSE = struct.pack('>HHHBBB', 2, 0, 3, UNIT, 0x83, 3)
+
+
+def _context():
+    slave = ModbusSlaveContext(hr=ModbusSequentialDataBlock(0, [10, 11, 12, 13]), zero_mode=True)
+    return ModbusServerContext(slaves={UNIT: slave}, single=False)
+
+
+class RequestProcessorTest(unittest.TestCase):
+
+    def test_short_frame(self):
+        processor = RequestProcessor(_context())
+        inbuf = bytearray(SHORT_FRAME + READ_FRAME)
+        responses = []
+        consumed = processor.process(inbuf, responses)
+        self.assertEqual(consumed, len(inbuf))
+        self.assertEqual(responses, [SHORT_RESPONSE, READ_RESPONSE])
+
+
+class EventLoopServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EventLoopServer(_context(), address=('localhost', 0))
+        self.server.listen()
+        self.address = self.server._listener.getsockname()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join(5)
+
+    def _receive(self, sock, count):
+        data = b''
+        while len(data) < count:
+            chunk = sock.recv(count - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def test_short_frame(self):
+        sock = socket.create_connection(self.address, timeout=5)
+        try:
+            sock.sendall(SHORT_FRAME)
+            self.assertEqual(self._receive(sock, len(SHORT_RESPONSE)), SHORT_RESPONSE)
+            sock.sendall(READ_FRAME)
+            self.assertEqual(self._receive(sock, len(READ_RESPONSE)), READ_RESPONSE)
+        finally:
+            sock.close()
+        self.assertTrue(self.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Tests of loading slaves from compiled templates.
+
+Usage::
+
+   python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import argparse
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim'))
+
+import modbus_sim
+
+# a template without a port line, served on the port and mode of the command line
+TEMPLATE = """/**DEVICE_DESC;VendorName=Test;ModelName=Cache
+deviceId=1;networkId=1;plcBaseAddress=0
+/*REGISTER;paramId=1;Name=Point;Default=7
+paramId=1;deviceId=1;registerType=holding;address=0;encoding=int16
+"""
+
+
+class CompiledTemplateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template = os.path.join(self.directory, 'device.txt')
+        with open(self.template, 'w') as f:
+            f.write(TEMPLATE)
+        self.cache_dir = os.path.join(self.directory, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _slave(self, port, mode):
+        return modbus_sim.Slave(argparse.Namespace(template=self.template, port=port, baudrate=9600, mode=mode,
+                                                   cache_dir=self.cache_dir))
+
+    def test_command_line_port(self):
+        self._slave('tcp:502', None)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        slave = self._slave('udp:5020', 'rtu')
+        self.assertEqual(slave.template_port, None)
+        self.assertEqual((slave.port, slave.mode), ('udp:5020', 'rtu'))
+        self.assertEqual(list(slave.context.getValues(3, 0, 1)), [7])
+
+    def test_template_port(self):
+        with open(self.template, 'a') as f:
+            f.write("/**SIM_PORT;port=tcp:5021;mode=tcp\n")
+        self._slave('tcp:502', None)
+        slave = self._slave('udp:5020', 'rtu')
+        self.assertEqual((slave.port, slave.mode), ('tcp:5021', 'tcp'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Tests of the OpenWeatherMap.org client against a local stub server.
+
+Usage::
+
+   python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbus_sim'))
+
+from simulators import sim_weather_lufft
+from simulators.weather_client import Backoff, FetchError, WeatherClient
+
+LOCATION = 'lat=45.3&lon=-75.8'
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers weather and UV queries with the simulator's sample responses, or with the server's status"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.paths.append(self.path.split('?')[0])
+        if self.server.status != 200:
+            body = ''
+        elif self.path.startswith('/uvi'):
+            body = json.dumps(sim_weather_lufft.sample_uv_resp)
+        else:
+            body = json.dumps(sim_weather_lufft.sample_weather_resp)
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0), StubHandler)
+        self.paths = []
+        self.status = 200
+
+
+class WeatherClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://localhost:{}'.format(self.server.server_address[1])
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def _client(self, **kwargs):
+        kwargs.setdefault('cache_dir', self.cache_dir)
+        return WeatherClient('test', base_url=self.base_url, **kwargs)
+
+    def test_fetch(self):
+        weather, uv = self._client().fetch(LOCATION)
+        self.assertEqual(weather, sim_weather_lufft.sample_weather_resp)
+        self.assertEqual(uv, sim_weather_lufft.sample_uv_resp)
+        self.assertEqual(sorted(self.server.paths), ['/uvi', '/weather'])
+
+    def test_cache_hit(self):
+        client = self._client()
+        client.fetch(LOCATION)
+        client.fetch(LOCATION)
+        self.assertEqual(len(self.server.paths), 2)
+        # a restarted simulator reads the responses cached on disk
+        restarted = self._client()
+        self.assertEqual(restarted.fetch(LOCATION)[0], sim_weather_lufft.sample_weather_resp)
+        self.assertEqual(len(self.server.paths), 2)
+        expired = self._client(ttl=0)
+        expired.fetch(LOCATION)
+        self.assertEqual(len(self.server.paths), 4)
+
+    def test_error_status(self):
+        self.server.status = 429
+        self.assertRaises(FetchError, self._client(cache_dir=None).fetch, LOCATION)
+
+    def test_unreachable(self):
+        client = WeatherClient('test', base_url='http://localhost:1', cache_dir=None, timeout=1.0)
+        self.assertRaises(FetchError, client.fetch, LOCATION)
+
+    def test_simulation_backoff(self):
+        self.server.status = 429
+        # without caching every step queries the server
+        client = self._client(cache_dir=None, ttl=0)
+        simulation = sim_weather_lufft.WeatherSimulation(location=LOCATION, key='test', client=client)
+        delays = [simulation.step() for _ in range(3)]
+        self.assertEqual(delays, [5.0, 10.0, 20.0])
+        self.server.status = 200
+        self.assertEqual(simulation.step(), simulation.refresh)
+        self.server.status = 429
+        self.assertEqual(simulation.step(), 5.0)
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_delays(self):
+        backoff = Backoff(initial=5.0, maximum=30.0)
+        self.assertEqual([backoff.next() for _ in range(5)], [5.0, 10.0, 20.0, 30.0, 30.0])
+        backoff.reset()
+        self.assertEqual(backoff.next(), 5.0)
+
+
+if __name__ == '__main__':
+    unittest.main()